@@ -0,0 +1,61 @@
+"""Benchmark the compiled giveaway matcher against per-word regex searches"""
+
+import argparse
+import json
+import re
+import time
+
+import pandas as pd
+
+from pylabel.matching import GiveawayMatcher
+
+
+def detect_giveaway_per_word(text, giveaway_words, cta_words):
+    """The original detect_giveaway: one regex search per word per post"""
+    has_giveaway = any(re.search(rf"\b{re.escape(word)}\b", text, re.IGNORECASE) for word in giveaway_words)
+    has_cta = any(re.search(rf"\b{re.escape(cta)}\b", text, re.IGNORECASE) for cta in cta_words)
+    return has_giveaway and has_cta
+
+
+def time_pass(detect, texts, repeat):
+    """Best wall time of repeat passes of detect over texts, plus the verdicts of the last pass"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        verdicts = [detect(text) for text in texts]
+        best = min(best, time.perf_counter() - start)
+    return best, verdicts
+
+
+def main():
+    """Main function for the benchmark"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("labeler_inputs_dir", type=str)
+    parser.add_argument("posts", type=str, nargs="?", default="bluesky_combined_posts.json")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    df_keywords = pd.read_csv(args.labeler_inputs_dir + "/giveaway-words.csv")
+    giveaway_words = df_keywords['Words'].dropna().tolist()
+    cta_words = df_keywords['call-to-action'].dropna().tolist()
+    with open(args.posts, 'r', encoding='utf-8') as f:
+        texts = [post['text'] for post in json.load(f)]
+
+    #Clear the re module cache so the baseline pays for compiling like it would with a large lexicon
+    re.purge()
+    baseline, expected = time_pass(lambda text: detect_giveaway_per_word(text, giveaway_words, cta_words), texts, args.repeat)
+
+    start = time.perf_counter()
+    matcher = GiveawayMatcher(giveaway_words, cta_words)
+    compile_time = time.perf_counter() - start
+    compiled, verdicts = time_pass(matcher.matches, texts, args.repeat)
+
+    mismatches = sum(a != b for a, b in zip(expected, verdicts))
+    print(f"Posts: {len(texts)}, giveaway words: {len(giveaway_words)}, CTA words: {len(cta_words)}")
+    print(f"Per-word regex:   {baseline:.4f}s ({len(texts) / baseline:,.0f} posts/s)")
+    print(f"Compiled matcher: {compiled:.4f}s ({len(texts) / compiled:,.0f} posts/s), compiled in {compile_time * 1000:.2f}ms")
+    print(f"Speedup: {baseline / compiled:.1f}x, giveaway posts: {sum(verdicts)}, mismatches: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
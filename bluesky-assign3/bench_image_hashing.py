@@ -0,0 +1,68 @@
+"""Compare the original full-decode pHash path with draft decoding and the process pool"""
+
+import argparse
+import os
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+from perception import hashers
+
+from pylabel.automated_labeler import THRESH
+from pylabel.hashing import DRAFT_SIZE, ImageHasher
+
+
+def load_images(image_dir: str, copies: int) -> list:
+    """Encoded bytes of every image in image_dir, repeated `copies` times"""
+    datas = []
+    for filename in sorted(os.listdir(image_dir)):
+        if filename.lower().endswith((".jpg", ".jpeg", ".png")):
+            with open(os.path.join(image_dir, filename), "rb") as f:
+                datas.append(f.read())
+    return datas * copies
+
+
+def full_decode_hashes(datas: list) -> list:
+    """The original path: Image.open at native resolution, hashed on the calling thread"""
+    hasher = hashers.PHash()
+    return [hasher.compute(Image.open(BytesIO(data)), hash_format="vector") for data in datas]
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    """Main function for the benchmark"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("image_dir", type=str, nargs="?", default="labeler-inputs/dog-list-images")
+    parser.add_argument("--copies", type=int, default=8, help="hash each image this many times")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--draft_size", type=int, default=DRAFT_SIZE)
+    args = parser.parse_args()
+
+    datas = load_images(args.image_dir, args.copies)
+    print(f"{len(datas)} images, {os.cpu_count()} CPUs")
+
+    baseline, baseline_time = timed(full_decode_hashes, datas)
+    runs = {"full decode, inline": (baseline, baseline_time)}
+    runs["draft decode, inline"] = timed(ImageHasher(0, args.draft_size).hash_many, datas)
+    pool = ImageHasher(args.workers, args.draft_size)
+    pool.hash(datas[0])  #Start the worker processes outside the timed run
+    runs[f"draft decode, {args.workers} processes"] = timed(pool.hash_many, datas)
+    pool.close()
+
+    for name, (vectors, seconds) in runs.items():
+        distances = [np.count_nonzero(a != b) / a.size for a, b in zip(baseline, vectors)]
+        print(
+            f"{name:<28} {len(datas) / seconds:8.1f} images/s  {baseline_time / seconds:5.2f}x  "
+            f"hash distance to full decode: max {max(distances):.3f}, mean {np.mean(distances):.4f} "
+            f"(match threshold {THRESH})"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""Benchmark the labelers per detector stage and compare benchmark runs"""
+
+import argparse
+import csv
+import datetime
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from pylabel import AutomatedLabeler, get_client, moderate_urls, post_cache
+from pylabel.blob_cache import BlobHashCache
+from pylabel.identity import identity_resolver
+from pylabel.metrics import SamplingProfiler, instrument_http, latency_summary, stage_metrics
+
+RESULTS_VERSION = 1
+#Metrics compared by the compare command, as (path, description); all are "lower is better"
+COMPARED_METRICS = [
+    (("latency", "p50"), "post latency p50"),
+    (("latency", "p95"), "post latency p95"),
+    (("latency", "p99"), "post latency p99"),
+    (("seconds_per_post",), "wall time per post"),
+    (("requests_per_post",), "requests per post"),
+    (("memory", "tracemalloc_peak"), "traced peak memory"),
+    (("memory", "max_rss"), "max RSS"),
+]
+STAGE_METRICS = ["p50", "p95", "p99", "requests"]
+
+
+def read_urls(path: str) -> list:
+    """URL column of a test-data CSV"""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return [row["URL"] for row in csv.DictReader(f)]
+
+
+def make_labeler(name: str, client, input_dir: str):
+    """Construct the pylabel or giveaway labeler"""
+    if name == "giveaway":
+        from giveaway_labeler.policy_proposal_labeler import AutomatedLabeler as GiveawayLabeler
+        return GiveawayLabeler(client, input_dir)
+    #Keep image hashes in memory so results don't depend on earlier runs
+    return AutomatedLabeler(client, input_dir, blob_cache=BlobHashCache(None))
+
+
+def git_revision() -> str:
+    """Current commit, or None outside a git checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def max_rss_bytes() -> int:
+    """Peak resident set size of this process"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def run_benchmark(labeler, urls: list, concurrency: int, repeat: int, warmup: int, trace_memory: bool,
+                  profiler: SamplingProfiler = None) -> dict:
+    """Moderate urls `repeat` times and collect per-post and per-stage metrics"""
+    if warmup:
+        moderate_urls(labeler, urls[:warmup], concurrency)
+
+    restore_http = instrument_http()
+    stage_metrics.reset()
+    stage_metrics.enable()
+    if trace_memory:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.start()
+    try:
+        results = []
+        start = time.perf_counter()
+        for _ in range(repeat):
+            #Drop cached posts, DIDs, image hashes, profiles, URL checks and text verdicts
+            #so every repetition does the full work
+            post_cache.clear()
+            identity_resolver.cache.clear()
+            labeler.verdicts.clear()
+            if hasattr(labeler, "blob_cache"):
+                labeler.blob_cache.clear()
+            if hasattr(labeler, "profile_cache"):
+                labeler.profile_cache.clear()
+            if hasattr(labeler, "safe_browsing"):
+                labeler.safe_browsing.cache.clear()
+            results.extend(moderate_urls(labeler, urls, concurrency))
+        wall = time.perf_counter() - start
+        traced_peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if profiler is not None:
+            profiler.stop()
+        if trace_memory:
+            tracemalloc.stop()
+        stage_metrics.disable()
+        restore_http()
+
+    stages = stage_metrics.summary()
+    requests_total = sum(stats["requests"] for stats in stages.values())
+    return {
+        "posts": len(results),
+        "errors": sum(result.error is not None for result in results),
+        "labeled": sum(bool(result.labels) for result in results),
+        "wall_seconds": wall,
+        "seconds_per_post": wall / len(results) if results else 0.0,
+        "posts_per_second": len(results) / wall if wall else 0.0,
+        "latency": latency_summary([result.elapsed for result in results]),
+        "stages": stages,
+        "requests": requests_total,
+        "requests_per_post": requests_total / len(results) if results else 0.0,
+        "memory": {"tracemalloc_peak": traced_peak, "max_rss": max_rss_bytes()},
+        "metrics": stage_metrics.snapshot(),
+    }
+
+
+def print_report(name: str, report: dict):
+    """Human-readable summary of one labeler's benchmark"""
+    latency = report["latency"]
+    print(f"== {name}: {report['posts']} posts, {report['labeled']} labeled, {report['errors']} errors")
+    print(f"   throughput {report['posts_per_second']:.2f} posts/s, "
+          f"{report['requests']} requests ({report['requests_per_post']:.2f}/post)")
+    print(f"   post latency p50 {latency['p50'] * 1000:.1f}ms  p95 {latency['p95'] * 1000:.1f}ms  "
+          f"p99 {latency['p99'] * 1000:.1f}ms")
+    memory = report["memory"]
+    traced = f"{memory['tracemalloc_peak'] / 2**20:.1f}MiB" if memory["tracemalloc_peak"] is not None else "n/a"
+    print(f"   peak memory traced {traced}, max RSS {memory['max_rss'] / 2**20:.1f}MiB")
+    print(f"   {'stage':<10} {'runs':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'requests':>9}")
+    for stage_name, stats in report["stages"].items():
+        print(f"   {stage_name:<10} {stats['count']:>6} {stats['p50'] * 1000:>9.2f} {stats['p95'] * 1000:>9.2f} "
+              f"{stats['p99'] * 1000:>9.2f} {stats['requests']:>9}")
+
+
+def run(args):
+    """Run the benchmark and write the results file"""
+    urls = read_urls(args.input_urls)
+    if args.limit:
+        urls = urls[:args.limit]
+    client = get_client()
+    names = ["pylabel", "giveaway"] if args.labeler == "both" else [args.labeler]
+
+    results = {
+        "version": RESULTS_VERSION,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "input_urls": args.input_urls,
+        "concurrency": args.concurrency,
+        "repeat": args.repeat,
+        "labelers": {},
+    }
+    for name in names:
+        labeler = make_labeler(name, client, args.labeler_inputs_dir)
+        profiler = SamplingProfiler(args.profile_interval) if args.profile else None
+        report = run_benchmark(labeler, urls, args.concurrency, args.repeat, args.warmup, args.trace_memory, profiler)
+        results["labelers"][name] = report
+        print_report(name, report)
+        if profiler is not None:
+            print(profiler.report())
+            with open(f"{args.profile}.{name}.folded", 'w', encoding='utf-8') as f:
+                f.write(profiler.folded())
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote results to {args.output}")
+
+
+def lookup(report: dict, path: tuple):
+    """Nested value of a report, or None if missing"""
+    for key in path:
+        if not isinstance(report, dict) or report.get(key) is None:
+            return None
+        report = report[key]
+    return report
+
+
+def compare_value(description: str, old, new, threshold: float, min_delta: float, regressions: list):
+    """Print one metric pair and record it if new is worse by more than threshold"""
+    if old is None or new is None:
+        return
+    change = (new - old) / old if old else (0.0 if new == old else float("inf"))
+    flag = ""
+    if change > threshold and new - old > min_delta:
+        flag = "  REGRESSION"
+        regressions.append(description)
+    elif change < -threshold:
+        flag = "  improved"
+    print(f"   {description:<34} {old:>14.4f} {new:>14.4f} {change * 100:>+8.1f}%{flag}")
+
+
+def compare(args):
+    """Compare two results files and exit non-zero if the candidate regressed"""
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.candidate, 'r', encoding='utf-8') as f:
+        candidate = json.load(f)
+
+    regressions = []
+    for name, new_report in candidate["labelers"].items():
+        old_report = baseline["labelers"].get(name)
+        if old_report is None:
+            print(f"== {name}: not in baseline, skipped")
+            continue
+        print(f"== {name} ({baseline.get('git_revision')} -> {candidate.get('git_revision')})")
+        print(f"   {'metric':<34} {'baseline':>14} {'candidate':>14} {'change':>9}")
+        for path, description in COMPARED_METRICS:
+            compare_value(f"{name} {description}", lookup(old_report, path), lookup(new_report, path),
+                          args.threshold, args.min_delta, regressions)
+        for stage_name in new_report["stages"]:
+            for metric in STAGE_METRICS:
+                old = lookup(old_report, ("stages", stage_name, metric))
+                new = lookup(new_report, ("stages", stage_name, metric))
+                if metric == "requests":
+                    #Compare request counts per post so runs of different sizes line up
+                    old = old / old_report["posts"] if old is not None and old_report["posts"] else None
+                    new = new / new_report["posts"] if new is not None and new_report["posts"] else None
+                compare_value(f"{name} {stage_name} {metric}", old, new,
+                              args.threshold, args.min_delta, regressions)
+
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {args.threshold * 100:.0f}%: {', '.join(regressions)}")
+        sys.exit(1)
+    print("No regressions")
+
+
+def main():
+    """Main function for the benchmark"""
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run")
+    run_parser.add_argument("labeler_inputs_dir", type=str)
+    run_parser.add_argument("input_urls", type=str)
+    run_parser.add_argument("--labeler", choices=["pylabel", "giveaway", "both"], default="both")
+    run_parser.add_argument("--concurrency", type=int, default=1)
+    run_parser.add_argument("--repeat", type=int, default=1)
+    run_parser.add_argument("--warmup", type=int, default=0, help="posts to moderate before measuring")
+    run_parser.add_argument("--limit", type=int, default=None)
+    run_parser.add_argument("--trace_memory", action="store_true", help="track peak allocations (slower)")
+    run_parser.add_argument("--output", type=str, default="bench_results.json")
+    run_parser.add_argument("--profile", type=str, default=None,
+                            help="sample stacks while running and write <PROFILE>.<labeler>.folded (flamegraph input)")
+    run_parser.add_argument("--profile_interval", type=float, default=0.005)
+
+    compare_parser = subparsers.add_parser("compare")
+    compare_parser.add_argument("baseline", type=str)
+    compare_parser.add_argument("candidate", type=str)
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="relative change counted as a regression")
+    compare_parser.add_argument("--min_delta", type=float, default=0.0005,
+                                help="ignore absolute changes smaller than this (seconds, requests or bytes)")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
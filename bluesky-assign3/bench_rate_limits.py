@@ -0,0 +1,142 @@
+"""Drive the transport against a local rate-limited stub server and compare throughput with its ceiling"""
+
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pylabel.ratelimit import RateLimitScheduler
+from pylabel.transport import Transport
+
+
+class RateLimitedStub(ThreadingHTTPServer):
+    """
+    Local stand-in for a rate-limited API.
+
+    Allows `limit` requests per fixed `window` seconds (answering 429 past
+    that) and at most `max_concurrent` requests in flight (answering 503
+    past that), and sends Bluesky-style ratelimit-* headers.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, limit: int, window: float, latency: float, max_concurrent: int, retry_after: bool):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.limit = limit
+        self.window = window
+        self.latency = latency
+        self.max_concurrent = max_concurrent
+        self.send_retry_after = retry_after
+        self.lock = threading.Lock()
+        self.window_start = time.time()
+        self.used = 0
+        self.in_flight = 0
+        self.counts = {200: 0, 429: 0, 503: 0}
+
+    def admit(self):
+        """Status and rate-limit headers for one incoming request"""
+        with self.lock:
+            now = time.time()
+            if now - self.window_start >= self.window:
+                self.window_start += (now - self.window_start) // self.window * self.window
+                self.used = 0
+            reset = self.window_start + self.window
+            headers = {"ratelimit-limit": str(self.limit), "ratelimit-policy": f"{self.limit};w={self.window:g}"}
+            if self.used >= self.limit:
+                status = 429
+                if self.send_retry_after:
+                    headers["Retry-After"] = f"{max(0.0, reset - now):.3f}"
+            elif self.in_flight >= self.max_concurrent:
+                status = 503
+            else:
+                status = 200
+                self.used += 1
+                self.in_flight += 1
+            headers["ratelimit-remaining"] = str(max(0, self.limit - self.used))
+            headers["ratelimit-reset"] = f"{reset:.3f}"
+            self.counts[status] += 1
+            return status, headers
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        status, headers = self.server.admit()
+        if status == 200:
+            time.sleep(self.server.latency)
+            self.server.release()
+        body = b"{}"
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def drive(transport: Transport, url: str, threads: int, duration: float) -> dict:
+    """GET url from `threads` threads for `duration` seconds; count the outcomes seen by callers"""
+    outcomes = {"ok": 0, "failed": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        while time.perf_counter() < deadline:
+            try:
+                ok = transport.get(url, endpoint="stub").status_code == 200
+            except Exception:
+                ok = False
+            with lock:
+                outcomes["ok" if ok else "failed"] += 1
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    outcomes["seconds"] = time.perf_counter() - start
+    return outcomes
+
+
+def main():
+    """Main function for the benchmark"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--limit", type=int, default=100, help="requests allowed per window")
+    parser.add_argument("--window", type=float, default=2.0, help="rate-limit window in seconds")
+    parser.add_argument("--latency", type=float, default=0.02, help="stub response time in seconds")
+    parser.add_argument("--max_concurrent", type=int, default=16, help="requests in flight before the stub answers 503")
+    parser.add_argument("--retry_after", action="store_true", help="send Retry-After with 429s")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    ceiling = args.limit / args.window
+    print(f"Stub: {args.limit} requests per {args.window:g}s ({ceiling:.1f}/s), "
+          f"{args.max_concurrent} in flight, {args.latency * 1000:.0f}ms per request; {args.threads} threads")
+    for name, scheduler in [("no scheduler", None), ("scheduler", RateLimitScheduler({"default": (None, 0, 4, 64)}))]:
+        stub = RateLimitedStub(args.limit, args.window, args.latency, args.max_concurrent, args.retry_after)
+        threading.Thread(target=stub.serve_forever, daemon=True).start()
+        transport = Transport(scheduler=scheduler, backoff=0.05, max_backoff=args.window)
+        outcomes = drive(transport, f"http://127.0.0.1:{stub.server_port}/stub", args.threads, args.duration)
+        transport.close()
+        stub.shutdown()
+        rate = outcomes["ok"] / outcomes["seconds"]
+        print(f"{name:<13} {rate:7.1f} ok/s ({rate / ceiling:6.1%} of ceiling), {outcomes['failed']} failed calls; "
+              f"server answered {stub.counts[200]} ok, {stub.counts[429]} x 429, {stub.counts[503]} x 503")
+        if scheduler is not None:
+            limiter = scheduler.limiter("default")
+            print(f"{'':<13} final window {limiter.window:.1f}, rate {limiter.bucket.rate or 0:.1f}/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Measure cold-start time of the labelers in fresh interpreter processes"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+STAGES = {
+    "import pylabel": "import pylabel",
+    "import giveaway labeler": "import giveaway_labeler.policy_proposal_labeler",
+    "construct pylabel labeler": "from pylabel import AutomatedLabeler; AutomatedLabeler(None, {inputs!r})",
+    "construct giveaway labeler": (
+        "from giveaway_labeler.policy_proposal_labeler import AutomatedLabeler; AutomatedLabeler(None, {inputs!r})"
+    ),
+}
+LOGIN_STAGE = "first client (get_client)"
+LOGIN_CODE = "from pylabel import get_client; get_client()"
+
+
+def time_process(code: str) -> float:
+    """Wall time of running code in a new interpreter"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main():
+    """Main function for the benchmark"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("labeler_inputs_dir", type=str, nargs="?", default="labeler-inputs")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--login", action="store_true", help="also time logging in (uses the saved session if present)")
+    args = parser.parse_args()
+
+    stages = {name: code.format(inputs=args.labeler_inputs_dir) for name, code in STAGES.items()}
+    if args.login:
+        stages[LOGIN_STAGE] = LOGIN_CODE
+
+    baseline = min(time_process("pass") for _ in range(args.runs))
+    print(f"Bare interpreter start: {baseline * 1000:.0f}ms (subtracted below)")
+    for name, code in stages.items():
+        times = [time_process(code) - baseline for _ in range(args.runs)]
+        print(f"{name:<28} median {statistics.median(times) * 1000:7.0f}ms   min {min(times) * 1000:7.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""Script for converting stored JSON corpora to indexed JSONL corpora"""
+
+import argparse
+import os
+import time
+
+from pylabel.corpus import Corpus, build_index, convert, index_path
+
+
+def main():
+    """
+    Main function for the convert script
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("corpora", type=str, nargs="+",
+                        help="JSON corpora to convert (e.g. initial-stored-posts/*.json), or JSONL corpora to index")
+    parser.add_argument("--output_dir", type=str, default=None, help="where to write the JSONL files (default: next to the input)")
+    args = parser.parse_args()
+
+    for source in args.corpora:
+        start = time.perf_counter()
+        if source.endswith(".jsonl"):
+            path = source
+            count = build_index(path)
+        else:
+            name = os.path.splitext(os.path.basename(source))[0] + ".jsonl"
+            path = os.path.join(args.output_dir or os.path.dirname(source), name)
+            count = convert(source, path)
+        elapsed = time.perf_counter() - start
+        with Corpus(path) as corpus:
+            assert len(corpus) == count
+        print(f"{path}: {count} posts, {os.path.getsize(path)} bytes "
+              f"(index {os.path.getsize(index_path(path))} bytes) in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Script for caching detector features of labeled posts and sweeping the detector thresholds offline"""
+
+import argparse
+import ast
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from pylabel.evaluation import (BOT_LABEL, DOG_LABEL, HUMAN_LABEL, FeatureCache, best, fixed_label_metrics, grid,
+                                sweep_bot, sweep_dog)
+
+
+def make_labeler(name: str, labeler_inputs_dir: str, client):
+    if name == "giveaway":
+        from giveaway_labeler.policy_proposal_labeler import AutomatedLabeler as GiveawayLabeler
+        return GiveawayLabeler(client, labeler_inputs_dir)
+    from pylabel import AutomatedLabeler
+    return AutomatedLabeler(client, labeler_inputs_dir)
+
+
+def extract(args):
+    """Fetch every labeled post not yet in the feature cache and store its features"""
+    from pylabel import get_client
+    from pylabel.label import fetch_post
+
+    client = get_client()
+    labeler = make_labeler(args.labeler, args.labeler_inputs_dir, client)
+    cache = FeatureCache(args.features)
+    urls = pd.read_csv(args.input_urls, converters={"Labels": ast.literal_eval})
+    todo = [(row["URL"], row["Labels"]) for _index, row in urls.iterrows() if row["URL"] not in cache]
+    print(f"{len(urls) - len(todo)} posts already cached, extracting {len(todo)}")
+
+    def extract_one(item):
+        url, expected = item
+        try:
+            post = fetch_post(client, url, labeler.post_cache)
+            cache.add(url, expected, labeler.features(post))
+            return True
+        except Exception as e:
+            print(f"For {url}, feature extraction failed: {e}")
+            return False
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        done = sum(executor.map(extract_one, todo))
+    print(f"Extracted features of {done} posts in {time.perf_counter() - start:.1f}s "
+          f"({len(todo) - done} failed; run again to retry them)")
+
+
+def print_metrics(label: str, setting: str, metrics: dict, index=()):
+    print(f"{label:<24} {setting:<52} precision {float(metrics['precision'][index]):.3f}  "
+          f"recall {float(metrics['recall'][index]):.3f}  f1 {float(metrics['f1'][index]):.3f}  "
+          f"(support {metrics['support']})")
+
+
+def sweep(args):
+    """Re-score the cached features over the threshold grids"""
+    records = FeatureCache(args.features).ordered()
+    print(f"{len(records)} posts with cached features")
+    start = time.perf_counter()
+    rows = []
+    if args.labeler == "giveaway":
+        from giveaway_labeler.policy_proposal_labeler import FOLLOW_RATIO_THRESHOLD, POSTS_PER_DAY_THRESHOLD, bot_rule
+
+        fixed = fixed_label_metrics(records, lambda features: features.get("safe_link") or [],
+                                    skip=(BOT_LABEL, HUMAN_LABEL))
+        follow_ratios, posts_per_day = grid(args.follow_ratio), grid(args.posts_per_day)
+        curves = sweep_bot(records, follow_ratios, posts_per_day, bot_rule)
+        current = sweep_bot(records, np.array([FOLLOW_RATIO_THRESHOLD], dtype=float),
+                            np.array([POSTS_PER_DAY_THRESHOLD], dtype=float), bot_rule)
+        elapsed = time.perf_counter() - start
+        for label, metrics in fixed.items():
+            print_metrics(label, "(no threshold)", metrics)
+        for label, metrics in curves.items():
+            print_metrics(label, f"current: follow_ratio > {FOLLOW_RATIO_THRESHOLD:g} "
+                          f"or posts/day > {POSTS_PER_DAY_THRESHOLD:g}", current[label], (0, 0))
+            i, j = best(metrics)
+            print_metrics(label, f"best:    follow_ratio > {follow_ratios[i]:g} or posts/day > {posts_per_day[j]:g}",
+                          metrics, (i, j))
+            for i, follow_ratio in enumerate(follow_ratios):
+                for j, posts in enumerate(posts_per_day):
+                    rows.append({"label": label, "follow_ratio": follow_ratio, "posts_per_day": posts,
+                                 "precision": metrics["precision"][i, j], "recall": metrics["recall"][i, j],
+                                 "f1": metrics["f1"][i, j]})
+        settings = len(follow_ratios) * len(posts_per_day)
+    else:
+        from pylabel.automated_labeler import T_AND_S_LABEL, THRESH
+
+        def text_labels(features):
+            hits = features["domain_matches"] or features["word_matches"]
+            return ([T_AND_S_LABEL] if hits else []) + features["news_labels"]
+
+        fixed = fixed_label_metrics(records, text_labels, skip=(DOG_LABEL,))
+        thresholds = grid(args.dog_thresholds)
+        metrics = sweep_dog(records, thresholds)
+        current = sweep_dog(records, np.array([THRESH]))
+        elapsed = time.perf_counter() - start
+        for label, label_metrics in fixed.items():
+            print_metrics(label, "(no threshold)", label_metrics)
+        print_metrics(DOG_LABEL, f"current: distance < {THRESH:g}", current, 0)
+        i, = best(metrics)
+        print_metrics(DOG_LABEL, f"best:    distance < {thresholds[i]:g}", metrics, i)
+        for i, threshold in enumerate(thresholds):
+            rows.append({"label": DOG_LABEL, "threshold": threshold, "precision": metrics["precision"][i],
+                         "recall": metrics["recall"][i], "f1": metrics["f1"][i]})
+        settings = len(thresholds)
+    print(f"Scored {settings} threshold settings over {len(records)} posts in {elapsed * 1000:.1f}ms")
+    if args.output:
+        pd.DataFrame(rows).to_csv(args.output, index=False)
+        print(f"Wrote precision/recall/F1 curves to {args.output}")
+
+
+def main():
+    """
+    Main function for the evaluation script
+    """
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    extract_parser = subparsers.add_parser("extract", help="cache the features of the posts in a labeled CSV")
+    extract_parser.add_argument("labeler_inputs_dir", type=str)
+    extract_parser.add_argument("input_urls", type=str)
+    extract_parser.add_argument("--concurrency", type=int, default=8)
+
+    sweep_parser = subparsers.add_parser("sweep", help="score the cached features over threshold grids")
+    sweep_parser.add_argument("--dog_thresholds", type=str, default="0:0.6:0.01",
+                              help="pHash distance thresholds, start:stop:step or a list")
+    sweep_parser.add_argument("--follow_ratio", type=str, default="0.5:10:0.5")
+    sweep_parser.add_argument("--posts_per_day", type=str, default="1:50:1")
+    sweep_parser.add_argument("--output", type=str, default=None, help="CSV of the precision/recall/F1 curves")
+
+    for command_parser in (extract_parser, sweep_parser):
+        command_parser.add_argument("--features", type=str, required=True, help="feature cache (JSONL)")
+        command_parser.add_argument("--labeler", choices=["pylabel", "giveaway"], default="pylabel")
+    args = parser.parse_args()
+
+    if args.command == "extract":
+        extract(args)
+    else:
+        sweep(args)
+
+
+if __name__ == "__main__":
+    main()
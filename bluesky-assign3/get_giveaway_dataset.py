@@ -1,119 +1,77 @@
-from atproto import Client
-from dotenv import load_dotenv
+import argparse
+import itertools
 import os
-import pprint
 import random
-import time
-import json
 import pandas as pd
-import re
 
-load_dotenv(override=True)
-USERNAME = os.getenv("USERNAME")
-PW = os.getenv("PW")
+from pylabel.collector import CollectionState, PostCollector, PostWriter
+from pylabel.corpus import Corpus, iter_jsonl, write_corpus, write_json_array
+from pylabel.lexicon import load_lexicon
+from pylabel.session import get_client
+
+RANDOM_KEYWORDS = [
+    "the", "life", "news", "day", "art", "love", "fun", 
+    "you", "post", "time", "and", "world", "game", "travel",
+    "music", "photo", "food", "coffee", "fashion", "tech", "science",
+    "health", "nature", "sunset", "sunrise", "travel", "code", "design",
+    "film", "video", "story", "humor", "fitness", "yoga", "pets", "cats",
+    "dogs", "meme", "inspiration", "mindfulness", "book", "poetry",
+    "cooking", "sports", "newsfeed", "tutorial", "climate", "culture"
+]
+
+def collect(path, make_tasks, workers=8, target=None, fresh=False):
+    """
+    Collect posts into a JSONL file with make_tasks(collector)'s tasks,
+    resuming from the file and its .state checkpoint unless fresh is set
+    """
+    state_path = path + ".state"
+    if fresh:
+        for stale in (path, state_path):
+            if os.path.exists(stale):
+                os.remove(stale)
+    writer = PostWriter(path)
+    resumed = len(writer)
+    collector = PostCollector(get_client(), writer, CollectionState(state_path), workers=workers, target=target)
+    try:
+        total = collector.run(make_tasks(collector))
+    finally:
+        writer.close()
+    print(f"{path}: {total} posts ({total - resumed} new, {writer.duplicates} duplicates dropped, "
+          f"{collector.failed} failed listings)")
 
-client = Client()
-profile = client.login(USERNAME, PW)
-pprint.pprint(profile.__dict__)
+def get_random_posts(posts_to_collect=6000, users_per_keyword=20, posts_per_user=3, workers=8, fresh=False):
+    keywords = list(dict.fromkeys(RANDOM_KEYWORDS))
+    random.shuffle(keywords)
 
-def search_users_by_keyword(keyword, limit=20):
-    results = client.app.bsky.actor.search_actors({'q': keyword, 'limit': limit})
-    return [user['handle'] for user in results['actors']]
+    #A generator, so the collector only searches as many keywords as it needs
+    def make_tasks(collector):
+        return (collector.actor_posts_task(keyword, users_per_keyword, posts_per_user) for keyword in keywords)
 
-def get_user_posts(handle, limit=3):
-    try:
-        actor = client.com.atproto.identity.resolve_handle({'handle': handle})
-        feed = client.app.bsky.feed.get_author_feed({'actor': actor['did'], 'limit': limit})
-        return [{
-            'user': handle,
-            'text': post['post']['record']['text'],
-            'uri': post['post']['uri'],
-            'cid': post['post']['cid']
-        } for post in feed['feed']]
-    except Exception as e:
-        print(f"Failed on {handle}: {e}")
-        return []
-
-def get_random_posts():
-    KEYWORDS = [
-        "the", "life", "news", "day", "art", "love", "fun", 
-        "you", "post", "time", "and", "world", "game", "travel",
-        "music", "photo", "food", "coffee", "fashion", "tech", "science",
-        "health", "nature", "sunset", "sunrise", "travel", "code", "design",
-        "film", "video", "story", "humor", "fitness", "yoga", "pets", "cats",
-        "dogs", "meme", "inspiration", "mindfulness", "book", "poetry",
-        "cooking", "sports", "newsfeed", "tutorial", "climate", "culture"
-    ]
-    POSTS_TO_COLLECT = 6000
-    POSTS_PER_USER = 3
-    COLLECTED_POSTS = []
-    random.shuffle(KEYWORDS)
-
-    for keyword in KEYWORDS:
-        if len(COLLECTED_POSTS) >= POSTS_TO_COLLECT:
-            break
-        handles = search_users_by_keyword(keyword)
-        random.shuffle(handles)
-        
-        for handle in handles:
-            if len(COLLECTED_POSTS) >= POSTS_TO_COLLECT:
-                break
-            posts = get_user_posts(handle, limit=POSTS_PER_USER)
-            COLLECTED_POSTS.extend(posts)
-            time.sleep(0.5)  # be nice to the API
-
-    # Save to JSON
-    with open('bluesky_random_posts.json', 'w') as f:
-        json.dump(COLLECTED_POSTS, f, indent=2)
-    return COLLECTED_POSTS
-
-def get_giveaway_posts():
-    df = pd.read_csv("./labeler-inputs/giveaway-words.csv")
-
-    # Extract the first column
-    words = df['Words'].dropna()
-    call_to_action = df['call-to-action'].dropna()
+    collect('bluesky_random_posts.jsonl', make_tasks, workers, posts_to_collect, fresh)
+    write_json_array(iter_jsonl('bluesky_random_posts.jsonl'), 'bluesky_random_posts.json')
+
+def get_giveaway_posts(posts_per_keyword=100, workers=8, fresh=False):
+    lexicon = load_lexicon("./labeler-inputs")
 
     # Print or process
-    GIVEAWAY_WORDS = words.tolist()
-    CTA = call_to_action.tolist()
+    GIVEAWAY_WORDS = list(lexicon.giveaway_words)
+    CTA = lexicon.cta_words
     print(GIVEAWAY_WORDS)
     print(CTA)
 
-    GIVEAWAY_POSTS = []
-
     random.shuffle(GIVEAWAY_WORDS)
 
-    for keyword in GIVEAWAY_WORDS:
-        response = client.app.bsky.feed.search_posts({'q': keyword, 'limit': 10})
-        for post in response.posts:
-            user = post.author.handle
-            text = post.record.text
-            uri = post.uri
-            cid = post.cid
-            # possibly collect replies down the line
-            GIVEAWAY_POSTS.append({
-                'user': user,
-                'text': text,
-                'uri': uri,
-                'cid': cid
-            })
-
-    # Save to JSON
-    with open('bluesky_giveaway_posts.json', 'w') as f:
-        json.dump(GIVEAWAY_POSTS, f, indent=2)
-
-    CTA_GIVEAWAY_POSTS = []
-    for post in GIVEAWAY_POSTS:
-        for cta in CTA:
-            if re.search(rf"\b{re.escape(cta)}\b", post['text'], re.IGNORECASE):
-                CTA_GIVEAWAY_POSTS.append(post)
-                break
-
-    with open('bluesky_confirmed_giveaway_posts.json', 'w') as f:
-        json.dump(CTA_GIVEAWAY_POSTS, f, indent=2)
-    
-    return GIVEAWAY_POSTS, CTA_GIVEAWAY_POSTS
+    def make_tasks(collector):
+        # possibly collect replies down the line
+        return [collector.search_posts_task(keyword, posts_per_keyword) for keyword in GIVEAWAY_WORDS]
+
+    collect('bluesky_giveaway_posts.jsonl', make_tasks, workers, None, fresh)
+    write_json_array(iter_jsonl('bluesky_giveaway_posts.jsonl'), 'bluesky_giveaway_posts.json')
+
+    CTA_GIVEAWAY_POSTS = (post for post in iter_jsonl('bluesky_giveaway_posts.jsonl')
+                          if lexicon.giveaway_matcher.has_cta_term(post['text']))
+    write_corpus(CTA_GIVEAWAY_POSTS, 'bluesky_confirmed_giveaway_posts.jsonl')
+    write_json_array(iter_jsonl('bluesky_confirmed_giveaway_posts.jsonl'), 'bluesky_confirmed_giveaway_posts.json')
 
 def train_test_split_list(items, train_frac=0.6, seed=42):
     rnd = random.Random(seed)
@@ -122,61 +80,55 @@ def train_test_split_list(items, train_frac=0.6, seed=42):
     return items[:cutoff], items[cutoff:]
 
 def main():
-    COLLECTED_POSTS = get_random_posts()
-    GIVEAWAY_POSTS, CTA_GIVEAWAY_POSTS = get_giveaway_posts()
-
-    COMBINED_POSTS = GIVEAWAY_POSTS + COLLECTED_POSTS
-    with open('bluesky_combined_posts.json', 'w') as f:
-        json.dump(COMBINED_POSTS, f, indent=2)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--random_posts", type=int, default=6000, help="random posts to collect")
+    parser.add_argument("--posts_per_keyword", type=int, default=100, help="posts to collect per giveaway word")
+    parser.add_argument("--workers", type=int, default=8, help="requests in flight")
+    parser.add_argument("--fresh", action="store_true", help="start over instead of resuming the last collection")
+    args = parser.parse_args()
 
-    print(f"Collected {len(COMBINED_POSTS)} posts.")
+    get_random_posts(args.random_posts, workers=args.workers, fresh=args.fresh)
+    get_giveaway_posts(args.posts_per_keyword, workers=args.workers, fresh=args.fresh)
 
-    # Split into test and train sets (60-40 split)
-    with open('bluesky_random_posts.json', 'r') as f:
-        COLLECTED_POSTS = json.load(f)
+    COMBINED_POSTS = itertools.chain(iter_jsonl('bluesky_giveaway_posts.jsonl'), iter_jsonl('bluesky_random_posts.jsonl'))
+    count = write_corpus(COMBINED_POSTS, 'bluesky_combined_posts.jsonl')
+    write_json_array(iter_jsonl('bluesky_combined_posts.jsonl'), 'bluesky_combined_posts.json')
 
-    with open('bluesky_giveaway_posts.json', 'r') as f:
-        GIVEAWAY_POSTS = json.load(f)
+    print(f"Collected {count} posts.")
 
-    with open('bluesky_confirmed_giveaway_posts.json', 'r') as f:
-        CTA_GIVEAWAY_POSTS = json.load(f)
+    # Split into test and train sets (60-40 split). The corpora are indexed, so the
+    # splits are lists of record numbers and posts are only read when rows are written.
+    COLLECTED_POSTS = Corpus('bluesky_random_posts.jsonl')
+    GIVEAWAY_POSTS = Corpus('bluesky_giveaway_posts.jsonl')
+    CTA_GIVEAWAY_POSTS = Corpus('bluesky_confirmed_giveaway_posts.jsonl')
 
     # Remove CTA_GIVEAWAY_POSTS from GIVEAWAY_POSTS so there aren't repeats in the test set
-    confirmed_ids = { post['cid'] for post in CTA_GIVEAWAY_POSTS }
-    remainder = [ post for post in GIVEAWAY_POSTS if post['cid'] not in confirmed_ids ] 
+    remainder = [ number for number, post in enumerate(GIVEAWAY_POSTS) if post['cid'] not in CTA_GIVEAWAY_POSTS ]
     remainder_train, remainder_test = train_test_split_list(remainder)
-    confirmed_giveaway_train, confirmed_giveaway_test = train_test_split_list(CTA_GIVEAWAY_POSTS)
-    random_dataset_train, random_dataset_test = train_test_split_list(COLLECTED_POSTS)
+    confirmed_giveaway_train, confirmed_giveaway_test = train_test_split_list(list(range(len(CTA_GIVEAWAY_POSTS))))
+    random_dataset_train, random_dataset_test = train_test_split_list(list(range(len(COLLECTED_POSTS))))
 
-    train_set = random_dataset_train + confirmed_giveaway_train + remainder_train
-    test_set = random_dataset_test + confirmed_giveaway_test + remainder_test
+    train_set = ([(COLLECTED_POSTS, n) for n in random_dataset_train] + [(CTA_GIVEAWAY_POSTS, n) for n in confirmed_giveaway_train]
+                 + [(GIVEAWAY_POSTS, n) for n in remainder_train])
+    test_set = ([(COLLECTED_POSTS, n) for n in random_dataset_test] + [(CTA_GIVEAWAY_POSTS, n) for n in confirmed_giveaway_test]
+                + [(GIVEAWAY_POSTS, n) for n in remainder_test])
     print("Train set:", len(train_set))
     print("Test set:", len(test_set))
 
     #Convert to input csv format with a link and a label
-    rows = []
-    for post in train_set:
-        uri = post['uri']
-        # uri looks like: "at://did:plc:…/postid"
-        user, post_id = uri.split('/')[2], uri.split('/')[-1]
-        url = f"https://bsky.app/profile/{user}/post/{post_id}"
-        label = ["giveaway"] if post['cid'] in confirmed_ids else []
-        rows.append((url, label))
-
-    df = pd.DataFrame(rows, columns=["URL", "Label"])
-    df.to_csv("input-posts-giveaway-train.csv", index=False)
-
-    rows = []
-    for post in test_set:
-        uri = post['uri']
-        # uri looks like: "at://did:plc:…/postid"
-        user, post_id = uri.split('/')[2], uri.split('/')[-1]
-        url = f"https://bsky.app/profile/{user}/post/{post_id}"
-        label = ["giveaway"] if post['cid'] in confirmed_ids else []
-        rows.append((url, label))
-
-    df = pd.DataFrame(rows, columns=["URL", "Label"])
-    df.to_csv("input-posts-giveaway-test.csv", index=False)
+    for split, path in [(train_set, "input-posts-giveaway-train.csv"), (test_set, "input-posts-giveaway-test.csv")]:
+        rows = []
+        for corpus, number in split:
+            post = corpus[number]
+            uri = post['uri']
+            # uri looks like: "at://did:plc:…/postid"
+            user, post_id = uri.split('/')[2], uri.split('/')[-1]
+            url = f"https://bsky.app/profile/{user}/post/{post_id}"
+            label = ["giveaway"] if post['cid'] in CTA_GIVEAWAY_POSTS else []
+            rows.append((url, label))
+
+        df = pd.DataFrame(rows, columns=["URL", "Label"])
+        df.to_csv(path, index=False)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -2,10 +2,9 @@
 
 import os
 
-from atproto import Client
 from dotenv import load_dotenv
 
-from pylabel import post_from_url
+from pylabel import get_client, post_from_url
 
 load_dotenv(override=True)
 USERNAME = os.getenv("USERNAME")
@@ -14,8 +13,7 @@ PW = os.getenv("PW")
 
 def main():
     """Main function"""
-    client = Client()
-    client.login(USERNAME, PW)
+    client = get_client()
     result = post_from_url(
         client, "https://bsky.app/profile/labeler-test.bsky.social/post/3lksxxugg4k27"
     )
@@ -1,107 +1,194 @@
-import pandas as pd 
 import re
 import time 
 import json 
-from atproto import Client
 from dotenv import load_dotenv
 import os 
-import requests
 import datetime 
 from dateutil import parser
-from typing import List
+from typing import TYPE_CHECKING, List
 
+from giveaway_labeler.safe_browsing import SafeBrowsingClient
+from pylabel.batching import BatchLoader
+from pylabel.cache import TTLCache, post_cache
+from pylabel.dedup import VerdictCache
+from pylabel.label import fetch_post
+from pylabel.lexicon import load_lexicon
+from pylabel.metrics import stage, stage_metrics
+from pylabel.pipeline import Pipeline, Stage
+from pylabel.record import repo_from_at_uri
+
+#atproto is imported lazily; the caller passes in a logged-in client
+if TYPE_CHECKING:
+    from atproto import Client
 
 load_dotenv(override=True)
-USERNAME = os.getenv("USERNAME")
-PW = os.getenv("PW")
 API_KEY = os.getenv("SAFE_BROWSING_API_KEY")
-SAFE_BROWSING_URL = f"https://safebrowsing.googleapis.com/v4/threatMatches:find?key={API_KEY}"
+#app.bsky.actor.getProfiles accepts at most 25 actors per call
+MAX_PROFILES_PER_REQUEST = 25
+#Pipeline stages whose returned label lists make up a post's labels, in label order
+LABEL_STAGES = ("safe_link", "bot")
+#Stages that go to the network, skipped by moderate_record(network=False)
+NETWORK_STAGES = ("safe_link", "bot")
+#An account is likely a bot when it follows this many times more accounts than follow it...
+FOLLOW_RATIO_THRESHOLD = 3
+#...or posts more than this many times a day
+POSTS_PER_DAY_THRESHOLD = 10
+
+
+def bot_rule(follow_ratio, posts_per_day, follow_ratio_threshold=FOLLOW_RATIO_THRESHOLD,
+             posts_per_day_threshold=POSTS_PER_DAY_THRESHOLD):
+    """The bot heuristic; works on numbers and on broadcastable NumPy arrays alike"""
+    return (follow_ratio > follow_ratio_threshold) | (posts_per_day > posts_per_day_threshold)
+
+
+def is_giveaway(post, giveaway: bool) -> bool:
+    """Pipeline condition of the safe link and bot stages: only giveaways are checked"""
+    return giveaway
 
-client = Client()
-client.login(USERNAME, PW)
 
 class AutomatedLabeler:
     """Automated labeler implementation"""
 
-    def __init__(self, client: Client, input_dir):
+    def __init__(
+        self, client: "Client", input_dir, cache: TTLCache = None, budget: float = None, near_duplicates: float = None
+    ):
         """Initialize the labeler"""
         self.client = client
+        #Per-post latency budget in seconds; the bot check is dropped once it runs out
+        self.budget = budget
+        #Post records are shared with pylabel through the cache
+        self.post_cache = post_cache if cache is None else cache
+
+        #Giveaway and CTA words, compiled once into the lexicon snapshot for input_dir
+        self.lexicon = load_lexicon(input_dir)
+        self.giveaway_words = self.lexicon.giveaway_words
+        self.cta_words = self.lexicon.cta_words
+        self.giveaway_matcher = self.lexicon.giveaway_matcher
+        #Giveaway verdicts of recent texts: giveaway spam is reposted verbatim by many accounts
+        self.verdicts = VerdictCache(self.lexicon.digest, near_duplicate_threshold=near_duplicates)
+        stage_metrics.register_cache("giveaway_verdicts", self.verdicts.stats)
 
-        #Read files for giveaway label
-        df_keywords = pd.read_csv(input_dir + "/giveaway-words.csv")
-        self.giveaway_words = df_keywords['Words'].dropna().tolist()
-        self.cta_words = df_keywords['call-to-action'].dropna().tolist()
+        #Bot features per DID; concurrent cache misses are coalesced into getProfiles batches
+        self.profile_cache = TTLCache(maxsize=10000, ttl=3600.0, negative_ttl=300.0)
+        self.profile_loader = BatchLoader(self.fetch_bot_features, max_batch=MAX_PROFILES_PER_REQUEST)
+
+        #Safe Browsing verdicts are cached per URL and batched across in-flight posts
+        self.safe_browsing = SafeBrowsingClient(API_KEY)
+        stage_metrics.register_cache("profiles", self.profile_cache.stats)
+        stage_metrics.register_cache("safe_browsing", self.safe_browsing.stats)
+
+        #Detectors as a pipeline: the safe link and bot checks only run for giveaways,
+        #and run concurrently with each other
+        self.pipeline = Pipeline([
+            Stage("giveaway", self.giveaway_verdict, inputs=("post",)),
+            Stage("safe_link", lambda post, giveaway: self.detect_safe_link(post) or [],
+                  inputs=("post", "giveaway"), when=is_giveaway, io=True),
+            Stage("bot", lambda post, giveaway: self.bot_labels(repo_from_at_uri(post.uri)),
+                  inputs=("post", "giveaway"), when=is_giveaway, io=True, optional=True),
+        ], inputs=("post",))
 
     def moderate_post(self, url: str) -> List[str]:
         """Apply moderation to the post specified by the given url"""
-        #Extract post information
-        parts = url.split('/post/')
-        did = parts[0].split('/')[-1]
-        rkey = parts[1]
-
+        start = time.monotonic()
         try:
-            post = client.com.atproto.repo.get_record({
-                "repo": did,
-                "collection": "app.bsky.feed.post",
-                "rkey": rkey
-            })
+            #Missing posts are negatively cached, so they are only requested once
+            with stage("fetch"):
+                post = fetch_post(self.client, url, self.post_cache)
 
         except Exception as e:
+            stage_metrics.count_error("post_unavailable")
             print(f"Skipping URL (missing or invalid post): {url}")
             return []
 
-        #Labeling logic
-        labels = []
-        post_text = post.value.text
-        #Check if it is a giveaway
-        if self.detect_giveaway(post_text):
-            #Apply "safe link" label
-            safe_links = self.detect_safe_link(post)
-            if safe_links is not None:
-                labels.extend(self.detect_safe_link(post))
-            #Apply "bot" label
-            bot_label, bot_results = self.detect_bot(did)
-            labels.extend(bot_label)
-
-            # #Store bot results for data analytics
-            # bot_results["url"] = url
-            # with open("bot_results_test.jsonl", 'a', encoding='utf-8') as f:
-            #     f.write(json.dumps(bot_results) + "\n")
-
-        return labels
+        budget = None if self.budget is None else self.budget - (time.monotonic() - start)
+        return self.moderate_record(post, budget=budget)
+
+    def moderate_record(self, post, network: bool = True, budget: float = None) -> List[str]:
+        """
+        Apply moderation to an already-materialized post (the shape client.get_post() returns).
+        The safe link and bot stages need the network; network=False runs only the giveaway text check.
+        """
+        run = self.pipeline.run(
+            {"post": post},
+            budget=self.budget if budget is None else budget,
+            skip=() if network else NETWORK_STAGES,
+        )
+        return run.labels(LABEL_STAGES)
+
+    def moderate_batch(self, posts, network: bool = True) -> List[List[str]]:
+        """
+        Moderate many materialized posts, returning labels in order.
+        The text check runs over every post first, so the profiles and URLs of
+        all giveaways are fetched in as few batched requests as possible.
+        """
+        with stage("giveaway"):
+            giveaways = [self.giveaway_verdict(post) for post in posts]
+        if not network:
+            return [[] for _ in posts]
+
+        giveaway_posts = [post for post, giveaway in zip(posts, giveaways) if giveaway]
+        #A failed prefetch only loses the batching: each post's stages then load what is still missing
+        if giveaway_posts:
+            try:
+                self.prefetch_bot_features([repo_from_at_uri(post.uri) for post in giveaway_posts])
+            except Exception as e:
+                stage_metrics.count_error("profile_prefetch")
+                print(f"Error prefetching profiles, checking authors one by one: {e}")
+            try:
+                self.safe_browsing.prefetch([url for post in giveaway_posts for url in self.extract_urls(post)])
+            except Exception as e:
+                stage_metrics.count_error("safe_browsing_prefetch")
+                print(f"Error prefetching Safe Browsing verdicts, checking posts one by one: {e}")
+        #The giveaway check is already done, so it is passed in instead of re-run
+        return [
+            self.pipeline.run({"post": post, "giveaway": True}, budget=self.budget).labels(LABEL_STAGES)
+            if giveaway else []
+            for post, giveaway in zip(posts, giveaways)
+        ]
+
+    def bot_labels(self, did: str) -> List[str]:
+        """Bot label for the author of a giveaway"""
+        bot_label, bot_results = self.detect_bot(did)
+
+        # #Store bot results for data analytics
+        # bot_results["did"] = did
+        # with open("bot_results_test.jsonl", 'a', encoding='utf-8') as f:
+        #     f.write(json.dumps(bot_results) + "\n")
+
+        return bot_label
     
+    def giveaway_verdict(self, post) -> bool:
+        """detect_giveaway for a post, reusing the verdict of an earlier post with the same text"""
+        self.verdicts.check_digest(self.lexicon.digest)
+        verdict, token = self.verdicts.lookup(post.value.text)
+        if verdict is None:
+            verdict = {"giveaway": self.detect_giveaway(post.value.text)}
+            self.verdicts.store(token, verdict)
+        return verdict["giveaway"]
+
     def detect_giveaway(self, text: str) -> bool:
         """Detect giveaway posts using giveaway_words and cta_words"""
-        has_giveaway = any(re.search(rf"\b{re.escape(word)}\b", text, re.IGNORECASE) for word in self.giveaway_words)
-        has_cta = any(re.search(rf"\b{re.escape(cta)}\b", text, re.IGNORECASE) for cta in self.cta_words)
-        return has_giveaway and has_cta
+        return self.giveaway_matcher.matches(text)
 
     def check_urls_with_safe_browsing(self, urls):
         """Check URL using Google's Safe Browsing API"""
-        body = {
-            "client": {
-                "clientId": "your-client-id",  #just a unique name
-                "clientVersion": "1.0"
-            },
-            "threatInfo": {
-                "threatTypes": ["MALWARE", "SOCIAL_ENGINEERING", "UNWANTED_SOFTWARE", "POTENTIALLY_HARMFUL_APPLICATION"],
-                "platformTypes": ["ANY_PLATFORM"],
-                "threatEntryTypes": ["URL"],
-                "threatEntries": [{"url": url} for url in urls]
-            }
-        }
-
-        response = requests.post(SAFE_BROWSING_URL, json=body)
-        response.raise_for_status()
-        matches = response.json()
-
-        if "matches" in matches:
-            return False
-        else:
-            return True
+        return self.safe_browsing.are_safe(urls)
         
     def detect_safe_link(self, post):
         """Find URL and label it as Safe Link Giveaway or Unsafe Link Giveaway"""
+        external_urls = self.extract_urls(post)
+
+        # If url exists, pass each one through Google safe browsing API
+        if external_urls:
+            safe = self.check_urls_with_safe_browsing(list(external_urls))
+            if not safe:
+               print("Found unsafe URL in post:", post)
+               return ["Unsafe Link Giveaway"]
+            else:
+                return ["Safe Link Giveaway"]
+
+    def extract_urls(self, post) -> set:
+        """External URLs of a post, from its text, link facets and external embed"""
         # Extract post information
         post_value = post["value"]
         embed = post_value["embed"]
@@ -131,15 +218,7 @@ class AutomatedLabeler:
                 external_dict = external.__dict__
                 if "uri" in external_dict:
                     external_urls.add(external_dict["uri"])
-        
-        # If url exists, pass each one through Google safe browsing API
-        if external_urls:
-            safe = self.check_urls_with_safe_browsing(list(external_urls))
-            if not safe:
-               print("Found unsafe URL in post:", post)
-               return ["Unsafe Link Giveaway"]
-            else:
-                return ["Safe Link Giveaway"]
+        return external_urls
 
 
     def label_as_bot(self, profile_dict):
@@ -159,11 +238,8 @@ class AutomatedLabeler:
         posts_per_day = posts / (account_age_days + 1)
 
         #heuristic rules
-        is_bot = (
-            # (followers <= 3 and follows > 300 and account_age_days < 14) or
-            follow_ratio > 3 or
-            posts_per_day > 10
-        )
+        # (followers <= 3 and follows > 300 and account_age_days < 14) or
+        is_bot = bool(bot_rule(follow_ratio, posts_per_day))
 
         return {
             "is_bot": is_bot,
@@ -174,11 +250,36 @@ class AutomatedLabeler:
             "follows": follows,
         }
     
+    def fetch_bot_features(self, dids: List[str]) -> dict:
+        """Fetch up to 25 profiles in one getProfiles call and reduce each to its bot features"""
+        response = self.client.app.bsky.actor.get_profiles({'actors': dids})
+        return {profile.did: self.label_as_bot(profile.model_dump()) for profile in response.profiles}
+
+    def prefetch_bot_features(self, dids: List[str]):
+        """Warm the profile cache for many accounts with as few getProfiles calls as possible"""
+        missing = [did for did in dict.fromkeys(dids) if did not in self.profile_cache]
+        for did, bot_results in self.profile_loader.load_many(missing).items():
+            self.profile_cache.set(did, bot_results)
+
+    def features(self, post) -> dict:
+        """
+        Raw detector inputs for a post, for offline evaluation: the giveaway and
+        CTA term hits, and for giveaways the safe link label and the author's
+        bot features
+        """
+        text = post.value.text
+        giveaway = self.detect_giveaway(text)
+        return {
+            "giveaway_term": self.giveaway_matcher.has_giveaway_term(text),
+            "cta_term": self.giveaway_matcher.has_cta_term(text),
+            "giveaway": giveaway,
+            "safe_link": (self.detect_safe_link(post) or []) if giveaway else None,
+            "bot": self.detect_bot(repo_from_at_uri(post.uri))[1] if giveaway else None,
+        }
+
     def detect_bot(self, did: str):
         """Label as likely bot or likely human"""
-        actor_info = client.app.bsky.actor.get_profile({'actor':did})
-        actor_info_dict = actor_info.model_dump()
-        bot_results = self.label_as_bot(actor_info_dict)
+        bot_results = dict(self.profile_cache.get_or_load(did, lambda: self.profile_loader.load(did)))
         if bot_results["is_bot"]:
             return ["Likely Bot Giveaway"], bot_results
         else:
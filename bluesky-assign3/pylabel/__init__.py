@@ -1,3 +1,9 @@
 """Init file for module"""
 from .automated_labeler import *
-from .label import *
\ No newline at end of file
+from .batch import *
+from .cache import *
+from .emitter import *
+from .identity import *
+from .label import *
+from .record import *
+from .session import *
\ No newline at end of file
@@ -1,66 +1,146 @@
 """Implementation of automated moderator"""
 
-from typing import List
-from atproto import Client
-from dotenv import load_dotenv
+from typing import TYPE_CHECKING, List
 import os
-import pprint
-import pandas as pd
-from .label import post_from_url
-from PIL import Image
-from io import BytesIO
-import requests
-from perception import hashers
+from .cache import TTLCache, post_cache
+from .dedup import VerdictCache
+from .hashing import ImageHasher
+from .identity import identity_resolver, is_did
+from .label import fetch_post
+from .lexicon import load_lexicon
+from .metrics import stage, stage_metrics
+from .pipeline import Pipeline, Stage
+from .record import repo_from_at_uri
+from . import transport as _transport
+import time
 
+#Heavy dependencies (atproto, numpy) are imported where
+#they are first needed, so importing pylabel stays fast and has no side effects
+if TYPE_CHECKING:
+    from atproto import Client
 
-load_dotenv(override=True)
-USERNAME = os.getenv("USERNAME")
-PW = os.getenv("PW")
-
-client = Client()
-profile = client.login(USERNAME, PW)
-pprint.pprint(profile.__dict__)
+    from .blob_cache import BlobHashCache
 
 T_AND_S_LABEL = "t-and-s"
 DOG_LABEL = "dog"
 THRESH = 0.3
+#Pipeline stages whose returned label lists make up a post's labels, in label order
+LABEL_STAGES = ("t_and_s", "news", "dog")
+#Stages that only read the post text, whose results are reused for duplicate texts
+TEXT_STAGES = ("t_and_s", "news")
+#Stages that go to the network, skipped by moderate_record(network=False):
+#building the image URL may resolve a handle, and the image is downloaded
+NETWORK_STAGES = ("image_url", "image")
 
 class AutomatedLabeler:
     """Automated labeler implementation"""
 
-    def __init__(self, client: Client, input_dir):
+    def __init__(
+        self, client: "Client", input_dir, cache: TTLCache = None, budget: float = None, hash_workers: int = 0,
+        blob_cache: "BlobHashCache" = None, near_duplicates: float = None,
+    ):
+        from .blob_cache import default_blob_cache_path, shared_blob_cache
+        from .dog_index import ReferenceHashIndex
+
         self.client = client
+        #Per-post latency budget in seconds; the image download is dropped once it runs out
+        self.budget = budget
+        #Post records are shared across detectors (and labelers) through the cache
+        self.post_cache = post_cache if cache is None else cache
+
+        #Load the compiled word/domain lists (rebuilt automatically when a CSV in input_dir changes)
+        self.lexicon = load_lexicon(input_dir)
+
+        #Domains and words for t-and-s label, each matched in a single pass per post
+        self.domains = dict.fromkeys(self.lexicon.t_and_s_domains, True)
+        self.words = dict.fromkeys(self.lexicon.t_and_s_words, True)
+        self.domain_matcher = self.lexicon.domain_matcher
+        self.word_matcher = self.lexicon.word_matcher
+
+        #News domains for news label
+        self.news_domains = self.lexicon.news_domains
+        self.news_matcher = self.lexicon.news_matcher
 
-        #Read domains and words files for t-and-s label
-        domains_df = pd.read_csv('./labeler-inputs/t-and-s-domains.csv')
-        self.domains = {domain.lower(): True for domain in domains_df['Domain'].dropna()}
-        words_df = pd.read_csv('./labeler-inputs/t-and-s-words.csv')
-        self.words = {word.lower(): True for word in words_df['Word'].dropna()}
+        #Text verdicts of recent posts, so reposted spam skips the matchers; with near_duplicates
+        #(a similarity threshold), near-identical texts reuse them too
+        self.verdicts = VerdictCache(self.lexicon.digest, near_duplicate_threshold=near_duplicates)
+        stage_metrics.register_cache("text_verdicts", self.verdicts.stats)
 
-        #Read news domains file for news label
-        news_domains_df = pd.read_csv('./labeler-inputs/news-domains.csv')
-        self.news_domains = dict(zip(news_domains_df['Domain'], news_domains_df['Source']))
+        #Hash the dog reference images once (reusing the on-disk index when it is fresh)
+        self.dog_index = ReferenceHashIndex.load_or_build(os.path.join(input_dir, "dog-list-images"))
+        #Downloaded images are decoded at reduced resolution and hashed inline or in worker processes
+        self.image_hasher = ImageHasher(hash_workers)
+        #Image hashes by blob CID, so an image seen before is matched without touching the CDN
+        #(one database per process, in input_dir unless BLOB_CACHE_PATH is set)
+        if blob_cache is None:
+            blob_cache = shared_blob_cache(default_blob_cache_path(input_dir))
+        self.blob_cache = blob_cache
+        stage_metrics.register_cache("blob_hashes", self.blob_cache.stats)
+
+        #Detectors as a pipeline: the image download only happens for posts with an image
+        #whose hash is not cached, and runs concurrently with the text stages
+        self.pipeline = Pipeline([
+            Stage("text", lambda post: post.value.text.lower(), inputs=("post",)),
+            Stage("t_and_s", self.t_and_s_labels, inputs=("text",)),
+            Stage("news", self.news_labels, inputs=("text",)),
+            Stage("image_cid", self.image_cid, inputs=("post",)),
+            Stage("cached_hash", self.blob_cache.get, inputs=("image_cid",), when=lambda cid: cid is not None),
+            Stage("image_url", self.image_url, inputs=("post",), optional_inputs=("cached_hash",),
+                  when=lambda post, cached_hash: cached_hash is None),
+            Stage("image", self.download_image_bytes, inputs=("image_url",),
+                  when=lambda image_url: image_url is not None, io=True, optional=True),
+            Stage("image_hash", self.hash_image, inputs=("image_cid", "image"),
+                  when=lambda cid, image: image is not None, io=True),
+            Stage("dog", self.hash_labels, optional_inputs=("cached_hash", "image_hash")),
+        ], inputs=("post",))
 
     def moderate_post(self, url: str) -> List[str]:
         """
         Apply moderation to the post specified by the given url
         """
-        #Labeling logic
-        labels = []
-        #Milestone 2: Apply "t-and-s" label
-        labels.extend(self.detect_t_and_s(url))
-        #Milestone 3: Apply "news" label
-        labels.extend(self.detect_news(url))
-        #Milestone 4: Apply "dog" label
-        labels.extend(self.find_dog(url))
-        return labels
+        start = time.monotonic()
+        #Fetch the record once up front, then moderate it like any other record
+        with stage("fetch"):
+            post = self.fetch_post(url)
+        budget = None if self.budget is None else self.budget - (time.monotonic() - start)
+        return self.moderate_record(post, budget=budget)
+
+    def moderate_record(self, post, network: bool = True, budget: float = None) -> List[str]:
+        """
+        Apply moderation to an already-materialized post (the shape client.get_post() returns).
+        Only the handle resolution and image download touch the network; network=False
+        skips both, so only images whose hash is already cached get a dog label.
+        """
+        #Milestone 2: "t-and-s" label, Milestone 3: "news" label, Milestone 4: "dog" label
+        values = {"post": post}
+        with stage("dedup"):
+            self.verdicts.check_digest(self.lexicon.digest)
+            verdict, token = self.verdicts.lookup(post.value.text)
+        if verdict is not None:
+            values.update(verdict)
+        run = self.pipeline.run(
+            values,
+            budget=self.budget if budget is None else budget,
+            skip=() if network else NETWORK_STAGES,
+        )
+        if token is not None:
+            self.verdicts.store(token, {name: run.values[name] for name in TEXT_STAGES})
+        return run.labels(LABEL_STAGES)
+
+    def moderate_batch(self, posts, network: bool = True) -> List[List[str]]:
+        """Moderate many materialized posts, e.g. a stored corpus, returning labels in order"""
+        return [self.moderate_record(post, network) for post in posts]
+
+    def fetch_post(self, url: str):
+        """Get the post behind url from the post cache"""
+        return fetch_post(self.client, url, self.post_cache)
 
     #Milestone 2: Label posts with T&S words and domains
     def find_t_and_s_matches(self, text: str) -> dict:
         """Find matches in text from both domains and words lists"""
-        domain_matches = [domain for domain in self.domains if domain in text]
-        word_matches = [word for word in self.words if word.lower() in text]
-        
+        domain_matches = self.domain_matcher.find_all(text)
+        word_matches = self.word_matcher.find_all(text)
+
         #Return both domain and word matches
         return {
             'domain_matches': domain_matches,
@@ -69,11 +149,12 @@ class AutomatedLabeler:
     
     def detect_t_and_s(self, url: str) -> List[str]:
         """Detect T&S posts and label them using find_t_and_s_matches()"""
-        post = post_from_url(self.client, url)
+        post = self.fetch_post(url)
         post_text = post.value.text.lower() #Grab text and convert to lowercase for matching
-        # print(post_text)
+        return self.t_and_s_labels(post_text)
 
-        #Find matches
+    def t_and_s_labels(self, post_text: str) -> List[str]:
+        """T&S label for already-lowercased post text"""
         matches = self.find_t_and_s_matches(post_text)
         if matches['domain_matches'] or matches['word_matches']:
             return [T_AND_S_LABEL]
@@ -83,8 +164,8 @@ class AutomatedLabeler:
     #Milestone 3: Cite your sources
     def find_news_matches(self, text: str) -> dict:
         """Find matches in text from news domain list"""
-        news_matches = [domain for domain in self.news_domains if domain in text]
-        
+        news_matches = self.news_matcher.find_all(text)
+
         #Return both news domain matches
         return {
             'domain_matches': news_matches,
@@ -92,10 +173,12 @@ class AutomatedLabeler:
     
     def detect_news(self, url: str) -> List[str]:
         """Detect news posts and label them using find_news_matches()"""
-        post = post_from_url(self.client, url)
+        post = self.fetch_post(url)
         post_text = post.value.text.lower() #Grab text and convert to lowercase for matching
+        return self.news_labels(post_text)
 
-        #Find matches
+    def news_labels(self, post_text: str) -> List[str]:
+        """News source label for already-lowercased post text"""
         matches = self.find_news_matches(post_text)
         if matches['domain_matches']:
             return [self.news_domains[matches['domain_matches'][0]]]
@@ -110,69 +193,106 @@ class AutomatedLabeler:
         return handle
     
     def get_did_from_handle(self, handle):
-        """Get DID from handle using ATProto API"""
-        url = f"https://public.api.bsky.app/xrpc/com.atproto.identity.resolveHandle?handle={handle}"
-        response = requests.get(url)
-        if response.status_code == 200:
-            return response.json()['did']
-        else:
+        """Get DID from handle using ATProto API (cached, and skipped for DID-form URLs)"""
+        try:
+            return identity_resolver.resolve(handle)
+        except Exception:
+            stage_metrics.count_error("did_resolution")
             print(f"Error resolving DID for {handle}")
             return None
         
     def construct_url(self, url):
         """Construct URL to get image. URL takes the form: "https://cdn.bsky.app/img/feed_thumbnail/plain/" + {their DID} + {blob CID}@jpeg"""
-        initial_url = "https://cdn.bsky.app/img/feed_thumbnail/plain/"
+        return self.image_url(self.fetch_post(url))
 
-        #Get DID
-        handle = self.parse_handle_from_url(url)
-        did = self.get_did_from_handle(handle)
-
-        #Get blob CID
-        post = post_from_url(client, url)
+    def image_cid(self, post):
+        """Blob CID of the first image embedded in a post, or None"""
         # if hasattr(post.value, 'embed') and post.value.embed is not None:
             # Check if embed has images
         if hasattr(post.value.embed, 'images') and post.value.embed.images:
-            blob_CID = post.value.embed.images[0].image.ref.link
-        else:
+            return post.value.embed.images[0].image.ref.link
+        return None
+
+    def image_url(self, post, cached_hash=None):
+        """Thumbnail URL of the first image embedded in a post, or None"""
+        initial_url = "https://cdn.bsky.app/img/feed_thumbnail/plain/"
+
+        #Get blob CID
+        blob_CID = self.image_cid(post)
+        if blob_CID is None:
+            return None
+
+        #Get DID (records fetched or streamed by DID need no lookup)
+        repo = repo_from_at_uri(post.uri)
+        did = repo if is_did(repo) else self.get_did_from_handle(repo)
+        if did is None:
             return None
 
         #Construct final URL
         final_url = initial_url + did + "/" + blob_CID + "@jpeg"
         return final_url
     
-    def download_image_from_url(self, url):
-        """Download image from URL"""
+    def download_image_bytes(self, url):
+        """Download the encoded image at URL, or None on failure"""
         try:
-            response = requests.get(url, timeout=5)
+            response = _transport.transport.get(url, timeout=5, endpoint="cdn_image")
             response.raise_for_status()  #Raises error if image failed to download
-            image = Image.open(BytesIO(response.content))
-            return image
+            return response.content
         except Exception as e:
+            stage_metrics.count_error("image_download")
             print(f"Error downloading image from {url}: {e}")
             return None
-        
+
     def find_dog(self, url):
         """Find out if the image is a dog using pHash and THRESH"""
-        image_url = self.construct_url(url)
-        if image_url is None:
+        return self.dog_labels(self.fetch_post(url))
+
+    def dog_labels(self, post) -> List[str]:
+        """Dog label for a materialized post, downloading its first image unless its hash is cached"""
+        return self.hash_labels(self.post_image_hash(post))
+
+    def post_image_hash(self, post):
+        """pHash of a post's first image (from the blob cache, else downloaded), or None"""
+        blob_CID = self.image_cid(post)
+        if blob_CID is None:
+            return None
+        image_hash = self.blob_cache.get(blob_CID)
+        if image_hash is None:
+            image_url = self.image_url(post)
+            data = None if image_url is None else self.download_image_bytes(image_url)
+            if data is None:
+                return None
+            image_hash = self.hash_image(blob_CID, data)
+        return image_hash
+
+    def features(self, post) -> dict:
+        """
+        Raw detector inputs for a post, for offline evaluation: the T&S and news
+        matches, the news label, and the pHash distance from its first image to
+        every dog reference image (None without an image)
+        """
+        text = post.value.text.lower()
+        image_hash = self.post_image_hash(post)
+        return {
+            **self.find_t_and_s_matches(text),
+            "news_matches": self.find_news_matches(text)['domain_matches'],
+            "news_labels": self.news_labels(text),
+            "dog_distances": None if image_hash is None else self.dog_index.distances(image_hash).tolist(),
+        }
+
+    def hash_image(self, blob_CID, data: bytes):
+        """pHash of a downloaded (still encoded) image, remembered under its blob CID"""
+        image_hash = self.image_hasher.hash(data)
+        if image_hash is None:
+            stage_metrics.count_error("image_decode")
+            return None
+        if blob_CID is not None:
+            self.blob_cache.set(blob_CID, image_hash)
+        return image_hash
+
+    def hash_labels(self, cached_hash=None, image_hash=None) -> List[str]:
+        """Dog label for an image's pHash (from the blob cache or freshly computed)"""
+        image_hash = cached_hash if cached_hash is not None else image_hash
+        if image_hash is None:
             return []
-        image_file = self.download_image_from_url(image_url)
-
-        hasher = hashers.PHash()
-        original_image_hash = hasher.compute(image_file)
-
-        #Directory containing dog images
-        dog_images_dir = "labeler-inputs/dog-list-images"
-
-        #Compare with each dog image
-        for filename in os.listdir(dog_images_dir):
-            if filename.endswith(".jpg"):
-                image_path = os.path.join(dog_images_dir, filename)
-                comparison_image = Image.open(image_path)
-                comparison_hash = hasher.compute(comparison_image)
-                distance = hasher.compute_distance(original_image_hash, comparison_hash)
-                if distance < THRESH:
-                    return [DOG_LABEL]
-
-        #If no match, return no dog label
-        return []
\ No newline at end of file
+        return [DOG_LABEL] if self.dog_index.matches(image_hash, THRESH) else []
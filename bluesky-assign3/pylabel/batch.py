@@ -0,0 +1,84 @@
+"""Concurrent batch moderation for labelers with a moderate_post(url) method"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, List, Optional, Sequence
+
+from .cache import post_cache
+from .label import at_uri_from_url, strong_ref
+from .metrics import stage_metrics
+
+
+@dataclass
+class BatchResult:
+    """Outcome of moderating a single URL in a batch"""
+
+    index: int
+    url: str
+    labels: List[str] = field(default_factory=list)
+    error: Optional[BaseException] = None
+    elapsed: float = 0.0
+    post_ref: Optional[Any] = None  # strong ref of the moderated post, captured when labels were produced
+
+
+def captured_ref(labeler, url: str):
+    """Strong ref of a post the labeler just fetched, read back from its post cache"""
+    post = getattr(labeler, "post_cache", post_cache).get(at_uri_from_url(url))
+    return strong_ref(post) if post is not None else None
+
+
+async def moderate_urls_async(
+    labeler,
+    urls: Sequence[str],
+    concurrency: int = 8,
+    on_result: Callable[[BatchResult], None] = None,
+) -> List[BatchResult]:
+    """
+    Moderate urls with at most `concurrency` posts in flight.
+
+    moderate_post is blocking (the ATProto client and requests are synchronous),
+    so each call runs on a worker thread. Results are returned in input order
+    regardless of completion order; a post that raises is reported through
+    BatchResult.error instead of aborting the batch. on_result, if given, is
+    called on the worker thread as soon as each post is done (e.g. to queue
+    label emission while the rest of the batch is still running).
+    """
+    concurrency = max(1, concurrency)
+    results = [None] * len(urls)
+    pending = iter(enumerate(urls))
+    loop = asyncio.get_running_loop()
+
+    def moderate(index: int, url: str) -> BatchResult:
+        start = time.perf_counter()
+        try:
+            labels = labeler.moderate_post(url)
+            result = BatchResult(index, url, labels, elapsed=time.perf_counter() - start)
+            if labels:
+                result.post_ref = captured_ref(labeler, url)
+        except Exception as e:
+            stage_metrics.count_error("moderate_post")
+            result = BatchResult(index, url, [], error=e, elapsed=time.perf_counter() - start)
+        if on_result is not None:
+            on_result(result)
+        return result
+
+    async def worker(executor):
+        #Workers share one iterator, so at most `concurrency` posts are ever in flight
+        for index, url in pending:
+            results[index] = await loop.run_in_executor(executor, moderate, index, url)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        await asyncio.gather(*(worker(executor) for _ in range(min(concurrency, len(urls)))))
+    return results
+
+
+def moderate_urls(
+    labeler,
+    urls: Sequence[str],
+    concurrency: int = 8,
+    on_result: Callable[[BatchResult], None] = None,
+) -> List[BatchResult]:
+    """Blocking wrapper around moderate_urls_async()"""
+    return asyncio.run(moderate_urls_async(labeler, urls, concurrency, on_result))
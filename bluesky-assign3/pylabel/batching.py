@@ -0,0 +1,119 @@
+"""Coalescing of concurrent single-key lookups into batched requests"""
+
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, Hashable, Iterable, List
+
+
+class BatchLoader:
+    """
+    Collect keys requested by concurrent callers and load them together.
+
+    batch_fn takes a list of at most max_batch distinct keys and returns a dict
+    of the values it found. A batch is sent as soon as it is full, or max_wait
+    seconds after its first key arrived. Keys missing from the result raise
+    KeyError in their callers; an exception from batch_fn is raised in every
+    caller of that batch.
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Hashable]], Dict[Hashable, object]],
+        max_batch: int = 25,
+        max_wait: float = 0.01,
+    ):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._pending = {}  # key -> Future, in arrival order
+        self._timer = None
+        self.batches = 0
+        self.keys_loaded = 0
+
+    def _enqueue(self, key: Hashable) -> Future:
+        """Add key to the pending batch, returning its future. Caller must hold the lock."""
+        future = self._pending.get(key)
+        if future is None:
+            future = self._pending[key] = Future()
+        return future
+
+    def _take_batch(self) -> Dict[Hashable, Future]:
+        """Remove up to max_batch pending keys. Caller must hold the lock."""
+        keys = list(self._pending)[:self.max_batch]
+        batch = {key: self._pending.pop(key) for key in keys}
+        if not self._pending and self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _run(self, batch: Dict[Hashable, Future]):
+        """Call batch_fn for one batch and resolve its futures"""
+        if not batch:
+            return
+        self.batches += 1
+        self.keys_loaded += len(batch)
+        try:
+            values = self.batch_fn(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                future.set_exception(e)
+            return
+        for key, future in batch.items():
+            if key in values:
+                future.set_result(values[key])
+            else:
+                future.set_exception(KeyError(key))
+
+    def _on_timer(self):
+        """Send whatever is pending once the wait window closes"""
+        while True:
+            with self._lock:
+                self._timer = None
+                batch = self._take_batch()
+            if not batch:
+                return
+            self._run(batch)
+
+    def _submit(self, keys: Iterable[Hashable], flush: bool) -> List[Future]:
+        full_batches = []
+        with self._lock:
+            futures = [self._enqueue(key) for key in keys]
+            while len(self._pending) >= self.max_batch or (flush and self._pending):
+                full_batches.append(self._take_batch())
+            if self._pending and self._timer is None:
+                self._timer = threading.Timer(self.max_wait, self._on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        for batch in full_batches:
+            self._run(batch)
+        return futures
+
+    def load(self, key: Hashable):
+        """Load a single key, waiting for the batch it is sent in"""
+        return self._submit([key], flush=False)[0].result()
+
+    def load_many(self, keys: Iterable[Hashable], flush: bool = True) -> Dict[Hashable, object]:
+        """
+        Load several keys, skipping keys that were not found.
+
+        With flush=True the keys are sent right away in as few batches as
+        possible; otherwise they join the pending batch like load() does.
+        """
+        keys = list(dict.fromkeys(keys))
+        futures = self._submit(keys, flush=flush)
+        values = {}
+        for key, future in zip(keys, futures):
+            try:
+                values[key] = future.result()
+            except KeyError:
+                pass
+        return values
+
+    def stats(self) -> dict:
+        """Batch counters"""
+        return {
+            "batches": self.batches,
+            "keys_loaded": self.keys_loaded,
+            "mean_batch_size": self.keys_loaded / self.batches if self.batches else 0.0,
+        }
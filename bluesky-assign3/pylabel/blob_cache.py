@@ -0,0 +1,210 @@
+"""Persistent blob CID -> perceptual hash cache"""
+
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from .hashing import DRAFT_SIZE
+
+#SQLite file the hashes survive restarts in, by default next to the labeler inputs;
+#BLOB_CACHE_PATH names another file, and BLOB_CACHE_PATH="" keeps them in memory only
+BLOB_CACHE_PATH = os.getenv("BLOB_CACHE_PATH")
+BLOB_CACHE_NAME = "blob-hashes.sqlite"
+#Hashes depend on the hasher and decoder, so a change to either must start a fresh cache
+HASH_VERSION = f"phash8-draft{DRAFT_SIZE}"
+
+#Seconds a write waits for another process (e.g. a sharded run's workers) to release the database
+BUSY_TIMEOUT = 30.0
+
+_shared = {}  # path -> the process's BlobHashCache for it
+_open_caches = set()  # caches with a database, flushed and closed at exit
+_lock = threading.RLock()
+_atexit_registered = False
+
+
+def default_blob_cache_path(input_dir: str) -> str:
+    """Database for a labeler inputs directory, unless BLOB_CACHE_PATH says otherwise"""
+    return BLOB_CACHE_PATH if BLOB_CACHE_PATH is not None else os.path.join(input_dir, BLOB_CACHE_NAME)
+
+
+def shared_blob_cache(path: Optional[str]) -> "BlobHashCache":
+    """The process-wide cache for path, so labelers in one process share one connection and one LRU"""
+    with _lock:
+        cache = _shared.get(path)
+        if cache is None:
+            cache = _shared[path] = BlobHashCache(path)
+        return cache
+
+
+def close_all():
+    """Flush and close every open cache; registered once per process to run at exit"""
+    with _lock:
+        caches = list(_open_caches)
+    for cache in caches:
+        cache.close()
+
+
+def _track(cache: "BlobHashCache"):
+    global _atexit_registered
+    with _lock:
+        _open_caches.add(cache)
+        if not _atexit_registered:
+            atexit.register(close_all)
+            _atexit_registered = True
+
+
+class BlobHashCache:
+    """
+    LRU map from image blob CID to its pHash vector.
+
+    CIDs are content addresses, so an entry never goes stale: a repeated image
+    is matched without a CDN request or a decode. Entries live in memory
+    (bounded by maxsize, least recently used evicted first) and are mirrored
+    to SQLite, which is read back on start so the cache is warm across
+    restarts. Writes are batched and flushed every flush_every changes and at
+    exit. Without a path the hashes are kept in memory only.
+    """
+
+    def __init__(self, path: Optional[str] = None, maxsize: int = 100000, flush_every: int = 100):
+        self.path = path
+        self.maxsize = maxsize
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # cid -> packed hash bytes
+        self._written = {}  # cid -> packed hash, not yet in the database
+        self._used = {}  # cid -> last use (wall clock), not yet in the database
+        self._evicted = set()
+        self._changes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._db = None
+        if path:
+            self._open()
+            _track(self)
+
+    def _open(self):
+        """Open (or create) the database and warm the cache with its most recently used hashes"""
+        self._db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS blob_hashes (cid TEXT PRIMARY KEY, hash BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'hash_version'").fetchone()
+        if row is None or row[0] != HASH_VERSION:
+            self._db.execute("DELETE FROM blob_hashes")
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('hash_version', ?)", (HASH_VERSION,))
+        self._db.commit()
+        rows = self._db.execute(
+            "SELECT cid, hash FROM blob_hashes ORDER BY last_used DESC LIMIT ?", (self.maxsize,)
+        ).fetchall()
+        for cid, packed in reversed(rows):
+            self._entries[cid] = bytes(packed)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, cid: str) -> bool:
+        with self._lock:
+            return cid in self._entries
+
+    def get(self, cid: str) -> Optional[np.ndarray]:
+        """pHash vector for a blob CID, or None if it has not been hashed"""
+        with self._lock:
+            packed = self._entries.get(cid)
+            if packed is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(cid)
+            self.hits += 1
+            if self._db is not None:
+                self._used[cid] = time.time()
+                self._changed()
+        return np.unpackbits(np.frombuffer(packed, dtype=np.uint8)).astype(bool)
+
+    def set(self, cid: str, hash_vector: np.ndarray):
+        """Remember the pHash vector of a blob"""
+        packed = np.packbits(np.asarray(hash_vector, dtype=bool).ravel()).tobytes()
+        with self._lock:
+            self._entries[cid] = packed
+            self._entries.move_to_end(cid)
+            while len(self._entries) > self.maxsize:
+                evicted, _packed = self._entries.popitem(last=False)
+                self.evictions += 1
+                if self._db is not None:
+                    self._written.pop(evicted, None)
+                    self._used.pop(evicted, None)
+                    self._evicted.add(evicted)
+            if self._db is not None:
+                self._evicted.discard(cid)
+                self._written[cid] = packed
+                self._used[cid] = time.time()
+                self._changed()
+
+    def _changed(self):
+        """Count a pending database change, flushing every flush_every. Caller must hold the lock."""
+        self._changes += 1
+        if self._changes >= self.flush_every:
+            self._flush()
+
+    def _flush(self):
+        """Write pending changes to the database. Caller must hold the lock."""
+        if self._db is None or not self._changes:
+            return
+        self._db.executemany(
+            "INSERT OR REPLACE INTO blob_hashes VALUES (?, ?, ?)",
+            [(cid, packed, self._used.pop(cid)) for cid, packed in self._written.items()],
+        )
+        self._db.executemany("UPDATE blob_hashes SET last_used = ? WHERE cid = ?",
+                             [(used, cid) for cid, used in self._used.items()])
+        self._db.executemany("DELETE FROM blob_hashes WHERE cid = ?", [(cid,) for cid in self._evicted])
+        self._db.commit()
+        self._written.clear()
+        self._used.clear()
+        self._evicted.clear()
+        self._changes = 0
+
+    def clear(self):
+        """Forget every hash, in memory and on disk"""
+        with self._lock:
+            self._entries.clear()
+            self._written.clear()
+            self._used.clear()
+            self._evicted.clear()
+            self._changes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM blob_hashes")
+                self._db.commit()
+
+    def flush(self):
+        """Write pending changes to the database"""
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        """Flush and close the database"""
+        with self._lock:
+            if self._db is not None:
+                self._flush()
+                self._db.close()
+                self._db = None
+        with _lock:
+            _open_caches.discard(self)
+
+    def stats(self) -> dict:
+        """Cache counters"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,178 @@
+"""In-memory LRU + TTL cache shared by the labelers"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+from .metrics import stage_metrics
+
+#Response statuses that answer "this record does not exist" rather than "the request failed"
+MISSING_STATUSES = frozenset({400, 404, 410})
+
+
+class NegativeCacheHit(LookupError):
+    """Raised when a key is remembered as missing (e.g. a deleted post)"""
+
+    def __init__(self, key: Hashable, cause: BaseException):
+        super().__init__(f"{key} is cached as missing: {cause}")
+        self.key = key
+        self.cause = cause
+
+
+def is_missing(error: BaseException) -> bool:
+    """
+    True if a load failed because the key does not exist (a deleted post, an
+    unknown handle), false for transient failures such as timeouts, 429 and 5xx
+    """
+    if isinstance(error, LookupError):
+        return True
+    #httpx.HTTPStatusError and the atproto request errors both carry the response
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    return status in MISSING_STATUSES
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after a time-to-live.
+
+    Loads that fail because the key does not exist (see is_missing) are stored
+    as negative entries with their own (usually shorter) TTL, so a missing
+    record is not requested again on every lookup. Transient failures are not
+    cached, so the next lookup tries again.
+    Concurrent loads of the same key are collapsed into a single call.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 300.0,
+        negative_ttl: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+        is_negative: Callable[[BaseException], bool] = is_missing,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._clock = clock
+        self._is_negative = is_negative
+        self._data = OrderedDict()  # key -> (expires_at, is_negative, value)
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> threading.Event for loads in progress
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+
+    def _lookup(self, key: Hashable):
+        """Return the live entry for key, or None. Caller must hold the lock."""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= self._clock():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry
+
+    def _store(self, key: Hashable, value: Any, ttl: float, is_negative: bool):
+        """Insert an entry and evict the least recently used ones. Caller must hold the lock."""
+        self._data[key] = (self._clock() + ttl, is_negative, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for key, or default if absent, expired or negative"""
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None or entry[1]:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key: Hashable, value: Any, ttl: float = None):
+        """Cache value under key"""
+        with self._lock:
+            self._store(key, value, self.ttl if ttl is None else ttl, False)
+
+    def set_negative(self, key: Hashable, cause: BaseException, ttl: float = None):
+        """Remember that key could not be loaded"""
+        with self._lock:
+            self._store(key, cause, self.negative_ttl if ttl is None else ttl, True)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        Return the cached value for key, calling loader() on a miss.
+
+        If loader raises, the error is re-raised. Errors saying the key is missing
+        are also cached as a negative entry, and later lookups raise
+        NegativeCacheHit until it expires.
+        """
+        while True:
+            with self._lock:
+                entry = self._lookup(key)
+                if entry is not None:
+                    if entry[1]:
+                        self.negative_hits += 1
+                        raise NegativeCacheHit(key, entry[2])
+                    self.hits += 1
+                    return entry[2]
+                pending = self._inflight.get(key)
+                if pending is None:
+                    self.misses += 1
+                    pending = self._inflight[key] = threading.Event()
+                    break
+            # Another thread is loading this key; wait for it and look again
+            pending.wait()
+
+        try:
+            value = loader()
+        except Exception as e:
+            if self._is_negative(e):
+                self.set_negative(key, e)
+            raise
+        else:
+            self.set(key, value)
+            return value
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            pending.set()
+
+    def invalidate(self, key: Hashable):
+        """Drop key from the cache"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._lookup(key)
+            return entry is not None and not entry[1]
+
+    def stats(self) -> dict:
+        """Hit/miss counters for the cache"""
+        lookups = self.hits + self.misses + self.negative_hits
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "negative_hits": self.negative_hits,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
+
+
+# Post records keyed by AT-URI, shared by pylabel and the giveaway labeler
+post_cache = TTLCache(maxsize=4096, ttl=300.0, negative_ttl=60.0)
+stage_metrics.register_cache("posts", post_cache.stats)
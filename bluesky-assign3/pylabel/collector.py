@@ -0,0 +1,248 @@
+"""Concurrent, paginated, resumable post collection into a deduplicated JSONL corpus"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .corpus import dumps_post, iter_jsonl
+
+if TYPE_CHECKING:
+    from atproto import Client
+
+#Largest page the AppView serves for searchPosts, searchActors and getAuthorFeed
+MAX_PAGE_SIZE = 100
+
+# A collection task pages through one listing (a post search, an actor search or an
+# author feed) and returns follow-up tasks; its progress is checkpointed under `key`.
+Task = Tuple[str, Callable[[], List["Task"]]]
+
+
+def post_entry(post) -> dict:
+    """Stored-corpus entry (user, text, uri, cid) for a PostView"""
+    return {
+        'user': post.author.handle,
+        'text': post.record.text,
+        'uri': post.uri,
+        'cid': post.cid,
+    }
+
+
+class PostWriter:
+    """
+    Append-only JSONL file of collected posts, deduplicated by CID.
+
+    Reopening an existing file reads its CIDs back, so a resumed collection
+    appends to it without writing any post twice.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.cids = set()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self.cids.update(post['cid'] for post in iter_jsonl(path))
+        self._file = open(path, 'a', encoding='utf-8')
+        self.duplicates = 0
+
+    def add(self, post: dict) -> bool:
+        """Append a post unless one with the same CID was already written"""
+        with self._lock:
+            if post['cid'] in self.cids:
+                self.duplicates += 1
+                return False
+            self.cids.add(post['cid'])
+            self._file.write(dumps_post(post) + "\n")
+            return True
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __len__(self) -> int:
+        return len(self.cids)
+
+
+class CollectionState:
+    """
+    Checkpoint of a collection: the next cursor and post count of every
+    listing, and which listings are finished.
+
+    It is saved only after the posts it accounts for were flushed, so resuming
+    from it may fetch a page again (the writer drops the duplicates) but never
+    skips one.
+    """
+
+    def __init__(self, path: Optional[str] = None, every: int = 20):
+        self.path = path
+        self.every = every
+        self._lock = threading.Lock()
+        self._since_save = 0
+        self.tasks: Dict[str, dict] = self.load()
+
+    def load(self) -> Dict[str, dict]:
+        """Read the saved task states, if any"""
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f).get("tasks", {})
+
+    def save(self):
+        """Atomically write the task states"""
+        if not self.path:
+            return
+        with self._lock:
+            data = json.dumps({"tasks": self.tasks, "saved_at": time.time()})
+            self._since_save = 0
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    def get(self, key: str) -> dict:
+        with self._lock:
+            return dict(self.tasks.get(key) or {"cursor": None, "collected": 0, "done": False})
+
+    def update(self, key: str, progress: dict) -> bool:
+        """Record a listing's progress after a page; True when it is time to save"""
+        with self._lock:
+            self.tasks[key] = progress
+            self._since_save += 1
+            return self._since_save >= self.every
+
+
+class PostCollector:
+    """
+    Collect posts from the AppView with several requests in flight.
+
+    Every listing is paged through with its cursor up to a per-listing count,
+    posts are streamed to the writer as pages arrive, and the cursors are
+    checkpointed in the state, so an interrupted collection picks up where it
+    stopped. Collection ends once the writer holds `target` posts or every
+    listing is exhausted. Requests go through the shared transport, whose
+    rate limiter paces them.
+    """
+
+    def __init__(self, client: "Client", writer: PostWriter, state: CollectionState = None,
+                 workers: int = 8, target: Optional[int] = None):
+        self.client = client
+        self.writer = writer
+        self.state = state or CollectionState()
+        self.workers = workers
+        self.target = target
+        self.failed = 0
+
+    def full(self) -> bool:
+        return self.target is not None and len(self.writer) >= self.target
+
+    def _store(self, post):
+        #Posts past the target are dropped, so pages still in flight only overshoot it by a few
+        if not self.full():
+            self.writer.add(post_entry(post))
+
+    def _page_through(self, key: str, fetch: Callable[[Optional[str], int], Tuple[list, Optional[str]]],
+                      limit: int, keep: bool = False) -> list:
+        """
+        Call fetch(cursor, page_size) from the checkpointed cursor until `limit`
+        items were fetched or the pages run out. With keep, the items are saved
+        in the checkpoint and every item ever fetched is returned.
+        """
+        progress = self.state.get(key)
+        items = list(progress.get("items", [])) if keep else []
+        while not progress["done"] and progress["collected"] < limit and not self.full():
+            page, cursor = fetch(progress["cursor"], min(MAX_PAGE_SIZE, limit - progress["collected"]))
+            items.extend(page)
+            progress["cursor"] = cursor
+            progress["collected"] += len(page)
+            progress["done"] = not cursor or not page or progress["collected"] >= limit
+            if keep:
+                progress["items"] = list(items)
+            #Flush first: the checkpoint must never get ahead of the posts on disk
+            self.writer.flush()
+            if self.state.update(key, dict(progress)):
+                self.state.save()
+        return items
+
+    def search_posts_task(self, query: str, limit: int) -> Task:
+        """Task that stores up to `limit` posts matching query"""
+        key = f"search_posts:{query}"
+
+        def fetch(cursor, page_size):
+            response = self.client.app.bsky.feed.search_posts({'q': query, 'limit': page_size, 'cursor': cursor})
+            for post in response.posts:
+                self._store(post)
+            return response.posts, response.cursor
+
+        def run():
+            self._page_through(key, fetch, limit)
+            return []
+
+        return key, run
+
+    def author_feed_task(self, actor: str, limit: int) -> Task:
+        """Task that stores up to `limit` posts from an actor's feed"""
+        key = f"author_feed:{actor}"
+
+        def fetch(cursor, page_size):
+            response = self.client.app.bsky.feed.get_author_feed({'actor': actor, 'limit': page_size, 'cursor': cursor})
+            for item in response.feed:
+                self._store(item.post)
+            return response.feed, response.cursor
+
+        def run():
+            self._page_through(key, fetch, limit)
+            return []
+
+        return key, run
+
+    def actor_posts_task(self, query: str, actors: int, posts_per_actor: int) -> Task:
+        """Task that finds up to `actors` accounts matching query, followed by a feed task per account"""
+        key = f"search_actors:{query}"
+
+        def fetch(cursor, page_size):
+            response = self.client.app.bsky.actor.search_actors({'q': query, 'limit': page_size, 'cursor': cursor})
+            return [actor.did for actor in response.actors], response.cursor
+
+        def run():
+            #The accounts are kept in the checkpoint, so a resumed run still queues their feeds
+            return [self.author_feed_task(did, posts_per_actor) for did in self._page_through(key, fetch, actors, keep=True)]
+
+        return key, run
+
+    def run(self, tasks: Iterable[Task]) -> int:
+        """Run tasks (and their follow-ups) concurrently; returns the number of posts stored"""
+        tasks = iter(tasks)
+        follow_ups = deque()
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="collector") as pool:
+            while True:
+                #Follow-ups first, so feeds are drained before more searches are started
+                while len(running) < self.workers * 2 and not self.full():
+                    task = follow_ups.popleft() if follow_ups else next(tasks, None)
+                    if task is None:
+                        break
+                    key, run = task
+                    running[pool.submit(run)] = key
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    try:
+                        follow_ups.extend(future.result())
+                    except Exception as e:
+                        #Left unfinished in the checkpoint, so a resumed run tries it again
+                        self.failed += 1
+                        print(f"Failed on {key}: {e}")
+        self.writer.flush()
+        self.state.save()
+        return len(self.writer)
+
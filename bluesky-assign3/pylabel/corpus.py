@@ -0,0 +1,227 @@
+"""Line-delimited post corpora with a memory-mapped index for lookups by position, CID or AT-URI"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import textwrap
+from typing import Iterable, Iterator, List, Optional
+
+# A corpus is a JSONL file with one compact post object per line (the entries of the
+# stored JSON corpora: user, text, uri, cid and optionally the raw record). Its index
+# is a sidecar file at path + ".idx":
+#   header   magic, corpus size in bytes, record count, hash table slots
+#   offsets  count + 1 little-endian uint64 byte offsets, one per line plus the end of the file
+#   table    open-addressing hash table of (uint64 key hash, uint32 record number + 1) slots,
+#            with one key for each record's CID and one for its AT-URI; 0 marks an empty slot
+INDEX_MAGIC = b"PLCORP01"
+_HEADER = struct.Struct("<8sQQQ")
+_OFFSET = struct.Struct("<Q")
+_SLOT = struct.Struct("<QI")
+#Hash table slots per key, at least; keeps linear probes short
+_LOAD = 2
+#Keys an entry is indexed under
+INDEX_KEYS = ("cid", "uri")
+
+
+def dumps_post(post: dict) -> str:
+    """One corpus line, without the newline"""
+    return json.dumps(post, ensure_ascii=False, separators=(",", ":"))
+
+
+def iter_jsonl(path: str) -> Iterator[dict]:
+    """Stream the posts of a JSONL corpus, one line in memory at a time"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_stored(path: str) -> Iterator[dict]:
+    """Stream the posts of a stored corpus, JSONL (in constant memory) or a JSON array (parsed at once)"""
+    if path.endswith(".jsonl"):
+        yield from iter_jsonl(path)
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from json.load(f)
+
+
+def _key_hash(key: str) -> int:
+    value = int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+    return value or 1
+
+
+def index_path(path: str) -> str:
+    return path + ".idx"
+
+
+def _build_index(path: str, offsets: List[int], keys: List[List[str]]):
+    """Write the index for a corpus whose lines start at offsets (plus the end) and carry keys"""
+    count = len(offsets) - 1
+    slots = 8
+    while slots < _LOAD * 2 * max(1, count):
+        slots *= 2
+    table = bytearray(slots * _SLOT.size)
+    mask = slots - 1
+    for number, record_keys in enumerate(keys):
+        for key in record_keys:
+            hashed = _key_hash(key)
+            slot = hashed & mask
+            while _SLOT.unpack_from(table, slot * _SLOT.size)[0]:
+                slot = (slot + 1) & mask
+            _SLOT.pack_into(table, slot * _SLOT.size, hashed, number + 1)
+    tmp_path = index_path(path) + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(INDEX_MAGIC, offsets[-1], count, slots))
+        f.write(struct.pack(f"<{count + 1}Q", *offsets))
+        f.write(table)
+    os.replace(tmp_path, index_path(path))
+
+
+def _record_keys(post: dict) -> List[str]:
+    return [post[name] for name in INDEX_KEYS if post.get(name)]
+
+
+def build_index(path: str) -> int:
+    """(Re)build the index of a JSONL corpus in one streaming pass; returns the record count"""
+    offsets, keys = [], []
+    position = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                offsets.append(position)
+                keys.append(_record_keys(json.loads(line)))
+            position += len(line)
+    offsets.append(position)
+    _build_index(path, offsets, keys)
+    return len(keys)
+
+
+def write_corpus(posts: Iterable[dict], path: str) -> int:
+    """Write posts as a JSONL corpus and index it, streaming; returns the count"""
+    offsets, keys = [], []
+    position = 0
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        for post in posts:
+            line = (dumps_post(post) + "\n").encode("utf-8")
+            offsets.append(position)
+            keys.append(_record_keys(post))
+            f.write(line)
+            position += len(line)
+    offsets.append(position)
+    os.replace(tmp_path, path)
+    _build_index(path, offsets, keys)
+    return len(keys)
+
+
+def convert(source: str, path: str) -> int:
+    """Convert a stored JSON array corpus (e.g. initial-stored-posts/*.json) to an indexed JSONL corpus"""
+    return write_corpus(iter_stored(source), path)
+
+
+def write_json_array(posts: Iterable[dict], path: str) -> int:
+    """Stream posts into a JSON array laid out like json.dump(posts, f, indent=2); returns the count"""
+    count = 0
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write("[")
+        for post in posts:
+            f.write(",\n" if count else "\n")
+            f.write(textwrap.indent(json.dumps(post, indent=2), "  "))
+            count += 1
+        f.write("\n]" if count else "]")
+    os.replace(tmp_path, path)
+    return count
+
+
+class Corpus:
+    """
+    Read-only view of an indexed JSONL corpus.
+
+    The corpus and its index are memory-mapped, so opening it reads nothing
+    up front: corpus[i] and get(cid or AT-URI) parse just the one line they
+    return, in O(1), and iterating streams the lines in constant memory. A
+    missing index, or one written for a different corpus size (e.g. after
+    appending), is rebuilt on open.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        size = os.path.getsize(path)
+        if not self._index_matches(size):
+            build_index(path)
+        with open(index_path(path), 'rb') as f:
+            self._index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _magic, _size, self._count, self._slots = _HEADER.unpack_from(self._index, 0)
+        self._offsets_at = _HEADER.size
+        self._table_at = self._offsets_at + (self._count + 1) * _OFFSET.size
+        self._data = None
+        if size:
+            with open(path, 'rb') as f:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _index_matches(self, size: int) -> bool:
+        try:
+            with open(index_path(self.path), 'rb') as f:
+                header = f.read(_HEADER.size)
+        except FileNotFoundError:
+            return False
+        if len(header) < _HEADER.size:
+            return False
+        magic, indexed_size, _count, _slots = _HEADER.unpack(header)
+        return magic == INDEX_MAGIC and indexed_size == size
+
+    def _line(self, number: int) -> bytes:
+        start, end = struct.unpack_from("<2Q", self._index, self._offsets_at + number * _OFFSET.size)
+        return self._data[start:end]
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, number: int) -> dict:
+        if number < 0:
+            number += self._count
+        if not 0 <= number < self._count:
+            raise IndexError(f"corpus index {number} out of range")
+        return json.loads(self._line(number))
+
+    def position(self, key: str) -> Optional[int]:
+        """Record number of the first post with this CID or AT-URI, or None"""
+        if not self._count:
+            return None
+        hashed = _key_hash(key)
+        mask = self._slots - 1
+        slot = hashed & mask
+        while True:
+            stored, number = _SLOT.unpack_from(self._index, self._table_at + slot * _SLOT.size)
+            if not stored:
+                return None
+            #Different keys can share a 64-bit hash; the record itself settles it
+            if stored == hashed and key in _record_keys(json.loads(self._line(number - 1))):
+                return number - 1
+            slot = (slot + 1) & mask
+
+    def get(self, key: str, default=None) -> Optional[dict]:
+        """The first post with this CID or AT-URI"""
+        number = self.position(key)
+        return default if number is None else self[number]
+
+    def __contains__(self, key: str) -> bool:
+        return self.position(key) is not None
+
+    def __iter__(self) -> Iterator[dict]:
+        for number in range(self._count):
+            yield json.loads(self._line(number))
+
+    def close(self):
+        self._index.close()
+        if self._data is not None:
+            self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,234 @@
+"""Duplicate and near-duplicate post detection, for reusing text verdicts"""
+
+import hashlib
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, Hashable, Optional, Tuple
+
+#numpy is only needed for near-duplicate detection, so it is imported there
+if TYPE_CHECKING:
+    import numpy as np
+
+_MULTIPLIER = 0x9E3779B97F4A7C15
+_FINALIZER = 0xC2B2AE3D27D4EB4F
+_WORD = re.compile(r"\w+")
+
+
+def normalize_text(text: str) -> str:
+    """The form every text detector sees: all of them match case-insensitively"""
+    return text.lower()
+
+
+def text_key(text: str) -> bytes:
+    """Hash of the normalized text, the exact-duplicate key"""
+    return hashlib.blake2b(normalize_text(text).encode("utf-8"), digest_size=16).digest()
+
+
+def shingle_hashes(text: str, size: int = 3) -> "np.ndarray":
+    """32-bit hashes of the word n-grams of the normalized text (of the whole text for posts shorter than size words)"""
+    import numpy as np
+
+    words = _WORD.findall(normalize_text(text))
+    hashes = np.array([zlib.crc32(word.encode("utf-8")) for word in words] or [0], dtype=np.uint64)
+    size = min(size, len(hashes))
+    count = len(hashes) - size + 1
+    combined = hashes[:count]
+    if size == 1:
+        return combined
+    #Polynomial hash of the n consecutive word hashes at each position, keeping the well-mixed high bits
+    for offset in range(1, size):
+        combined = combined * np.uint64(_MULTIPLIER) + hashes[offset:offset + count]
+    return (combined * np.uint64(_FINALIZER)) >> np.uint64(32)
+
+
+class MinHasher:
+    """MinHash signatures: the fraction of equal slots estimates the Jaccard similarity of two shingle sets"""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        import numpy as np
+
+        self.num_perm = num_perm
+        generator = np.random.RandomState(seed)
+        #Multiply-shift hash functions h(x) = (a * x + b) >> 32 over 64-bit words, with odd a
+        self._a = generator.randint(1, 1 << 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = generator.randint(0, 1 << 63, size=num_perm, dtype=np.uint64)
+        self._shift = np.uint64(32)
+
+    def signature(self, hashes: "np.ndarray") -> "np.ndarray":
+        """num_perm minimum hash values over the shingle hashes"""
+        return ((hashes[:, None] * self._a + self._b) >> self._shift).min(axis=0)
+
+    def text_signature(self, text: str) -> "np.ndarray":
+        """Signature of a post text's word 3-grams"""
+        return self.signature(shingle_hashes(text))
+
+    @staticmethod
+    def similarity(first: "np.ndarray", second: "np.ndarray") -> float:
+        """Estimated Jaccard similarity of the shingle sets behind two signatures"""
+        return float((first == second).sum()) / len(first)
+
+
+class LSHIndex:
+    """
+    Banded locality-sensitive hashing over MinHash signatures.
+
+    Each signature is cut into `bands` bands of equal rows; two signatures
+    become candidates when any band is identical, so a query only touches the
+    keys sharing a bucket instead of every stored signature.
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._buckets = [{} for _ in range(bands)]  # band -> {band bytes: set of keys}
+
+    def _bands(self, signature: "np.ndarray"):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def insert(self, key: Hashable, signature: "np.ndarray"):
+        for band, value in self._bands(signature):
+            self._buckets[band].setdefault(value, set()).add(key)
+
+    def remove(self, key: Hashable, signature: "np.ndarray"):
+        for band, value in self._bands(signature):
+            bucket = self._buckets[band].get(value)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band][value]
+
+    def query(self, signature: "np.ndarray") -> set:
+        """Keys sharing at least one band with signature"""
+        candidates = set()
+        for band, value in self._bands(signature):
+            candidates.update(self._buckets[band].get(value, ()))
+        return candidates
+
+    def clear(self):
+        for buckets in self._buckets:
+            buckets.clear()
+
+
+class VerdictCache:
+    """
+    Bounded memo of text-detector verdicts, keyed by normalized text.
+
+    An exact duplicate (same text up to case) reuses the stored verdict as is.
+    With a near_duplicate_threshold, a miss also looks the text's MinHash
+    signature up in an LSH index, and a stored text whose estimated Jaccard
+    similarity (of word 3-grams) reaches the threshold lends its verdict.
+    That reuse is an approximation: a one-character edit to a listed domain
+    is still a near-duplicate. Verdicts depend on the word lists, so the
+    cache is cleared whenever it is used with a different lexicon digest.
+    """
+
+    def __init__(self, digest: str = None, maxsize: int = 10000, near_duplicate_threshold: Optional[float] = None,
+                 num_perm: int = 64, bands: int = 16):
+        self.digest = digest
+        self.maxsize = maxsize
+        self.near_duplicate_threshold = near_duplicate_threshold
+        #The signature index only exists when near-duplicates are looked for
+        self.minhasher = MinHasher(num_perm) if near_duplicate_threshold is not None else None
+        self.lsh = LSHIndex(num_perm, bands) if near_duplicate_threshold is not None else None
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # text key -> (verdict, signature or None)
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def check_digest(self, digest: str):
+        """Drop every verdict if they were computed with a different lexicon"""
+        if digest != self.digest:
+            with self._lock:
+                if digest != self.digest:
+                    if self._entries:
+                        self.invalidations += 1
+                    self._clear()
+                    self.digest = digest
+
+    def lookup(self, text: str) -> Tuple[Optional[Dict[str, Any]], Any]:
+        """
+        (verdict, None) for a duplicate of a stored text, or (None, token)
+        on a miss; pass the token to store() to remember the verdict.
+        """
+        key = text_key(text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry[0], None
+        if self.near_duplicate_threshold is None:
+            with self._lock:
+                self.misses += 1
+            return None, (key, None)
+
+        signature = self.minhasher.text_signature(text)
+        with self._lock:
+            best, best_similarity = None, self.near_duplicate_threshold
+            for candidate in self.lsh.query(signature):
+                similarity = MinHasher.similarity(signature, self._entries[candidate][1])
+                if similarity >= best_similarity:
+                    best, best_similarity = candidate, similarity
+            if best is not None:
+                self._entries.move_to_end(best)
+                self.near_hits += 1
+                verdict = self._entries[best][0]
+                #Later exact copies of this text then skip the signature
+                self._insert(key, verdict, None)
+                return verdict, None
+            self.misses += 1
+        return None, (key, signature)
+
+    def store(self, token, verdict: Dict[str, Any]):
+        """Remember the verdict for a text that lookup() missed"""
+        key, signature = token
+        with self._lock:
+            self._insert(key, verdict, signature)
+
+    def _insert(self, key: bytes, verdict: Dict[str, Any], signature: Optional["np.ndarray"]):
+        """Add an entry and evict the least recently used ones. Caller must hold the lock."""
+        if key in self._entries:
+            return
+        self._entries[key] = (verdict, signature)
+        if signature is not None:
+            self.lsh.insert(key, signature)
+        while len(self._entries) > self.maxsize:
+            evicted, (_verdict, evicted_signature) = self._entries.popitem(last=False)
+            if evicted_signature is not None:
+                self.lsh.remove(evicted, evicted_signature)
+            self.evictions += 1
+
+    def _clear(self):
+        self._entries.clear()
+        if self.lsh is not None:
+            self.lsh.clear()
+
+    def clear(self):
+        """Drop every verdict"""
+        with self._lock:
+            self._clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """Cache counters"""
+        lookups = self.exact_hits + self.near_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.exact_hits + self.near_hits,
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": (self.exact_hits + self.near_hits) / lookups if lookups else 0.0,
+        }
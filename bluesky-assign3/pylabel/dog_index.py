@@ -0,0 +1,157 @@
+"""Precomputed perceptual-hash index over the dog reference images"""
+
+import argparse
+import hashlib
+import os
+import zipfile
+from typing import List, Tuple
+
+import numpy as np
+
+from .fileio import atomic_write
+
+#Version 2: reference images are decoded at reduced resolution, like downloaded ones
+#Version 3: the manifest holds content digests instead of mtimes, so a fresh checkout is not stale
+INDEX_VERSION = 3
+IMAGE_EXTENSIONS = (".jpg",)
+
+#Number of set bits for every byte value, used to popcount packed hashes
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def default_index_path(image_dir: str) -> str:
+    """Location of the on-disk index for a reference image directory"""
+    return os.path.normpath(image_dir) + ".phash.npz"
+
+
+def file_digest(path: str) -> str:
+    """Hex blake2b digest of a file's contents"""
+    with open(path, "rb") as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+def scan_images(image_dir: str) -> List[Tuple[str, str, int]]:
+    """List (filename, content digest, size) for every reference image, sorted by name"""
+    entries = []
+    for filename in sorted(os.listdir(image_dir)):
+        if filename.endswith(IMAGE_EXTENSIONS):
+            path = os.path.join(image_dir, filename)
+            entries.append((filename, file_digest(path), os.path.getsize(path)))
+    return entries
+
+
+class ReferenceHashIndex:
+    """
+    Packed pHash matrix for a directory of reference images.
+
+    Each row holds one reference hash packed into bytes, so comparing a query
+    hash against every reference is a single XOR + popcount over the matrix.
+    """
+
+    def __init__(self, manifest: List[Tuple[str, str, int]], packed: np.ndarray, hash_length: int):
+        self.manifest = manifest
+        self.names = [name for name, _digest, _size in manifest]
+        self.packed = packed
+        self.hash_length = hash_length
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @classmethod
+    def build(cls, image_dir: str, workers: int = 0) -> "ReferenceHashIndex":
+        """Hash every reference image in image_dir (decoded the same way as downloaded images)"""
+        from .hashing import ImageHasher
+
+        manifest = scan_images(image_dir)
+        datas = []
+        for filename, _digest, _size in manifest:
+            with open(os.path.join(image_dir, filename), "rb") as f:
+                datas.append(f.read())
+        image_hasher = ImageHasher(workers)
+        try:
+            vectors = image_hasher.hash_many(datas)
+        finally:
+            image_hasher.close()
+        for (filename, _digest, _size), vector in zip(manifest, vectors):
+            if vector is None:
+                raise ValueError(f"Could not decode reference image {filename}")
+        vectors = np.asarray(vectors, dtype=bool).reshape(len(vectors), -1)
+        return cls(manifest, np.packbits(vectors, axis=1), vectors.shape[1] if len(vectors) else 64)
+
+    def save(self, path: str):
+        """Atomically write the index to an .npz file"""
+        names, digests, sizes = zip(*self.manifest) if self.manifest else ((), (), ())
+        #Written aside and moved into place, so an interrupted save or processes building the
+        #index at once (e.g. sharded workers) never leave a partial file at path
+        with atomic_write(path, "wb") as f:
+            np.savez(
+                f,
+                version=INDEX_VERSION,
+                hash_length=self.hash_length,
+                names=np.array(names, dtype=str),
+                digests=np.array(digests, dtype=str),
+                sizes=np.array(sizes, dtype=np.int64),
+                packed=self.packed,
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "ReferenceHashIndex":
+        """Read an index written by save()"""
+        with np.load(path) as data:
+            if int(data["version"]) != INDEX_VERSION:
+                raise ValueError(f"Unsupported index version in {path}")
+            manifest = list(zip(
+                data["names"].tolist(), data["digests"].tolist(), data["sizes"].tolist()
+            ))
+            return cls(manifest, data["packed"], int(data["hash_length"]))
+
+    def is_stale(self, image_dir: str) -> bool:
+        """True if any reference image was added, removed or modified since the index was built"""
+        return scan_images(image_dir) != self.manifest
+
+    @classmethod
+    def load_or_build(cls, image_dir: str, index_path: str = None) -> "ReferenceHashIndex":
+        """Load the on-disk index, rebuilding (and re-saving) it if missing or stale"""
+        index_path = index_path or default_index_path(image_dir)
+        if os.path.exists(index_path):
+            try:
+                index = cls.load(index_path)
+                if not index.is_stale(image_dir):
+                    return index
+            #A truncated or corrupt file fails inside numpy's zip reader
+            except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile) as e:
+                print(f"Rebuilding unreadable hash index {index_path}: {e}")
+        index = cls.build(image_dir)
+        try:
+            index.save(index_path)
+        except OSError as e:
+            print(f"Could not save hash index to {index_path}: {e}")
+        return index
+
+    def distances(self, hash_vector: np.ndarray) -> np.ndarray:
+        """Normalized Hamming distance from hash_vector to every reference hash"""
+        query = np.packbits(np.asarray(hash_vector, dtype=bool).ravel())
+        differing = _POPCOUNT[np.bitwise_xor(self.packed, query)].sum(axis=1, dtype=np.int64)
+        return differing / self.hash_length
+
+    def matches(self, hash_vector: np.ndarray, threshold: float) -> bool:
+        """True if any reference hash is closer than threshold"""
+        return len(self) > 0 and bool((self.distances(hash_vector) < threshold).any())
+
+
+def main():
+    """Build the reference hash index offline"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("image_dir", type=str)
+    parser.add_argument("--index_path", type=str, default=None)
+    parser.add_argument("--workers", type=int, default=0, help="hash in this many processes")
+    args = parser.parse_args()
+
+    index_path = args.index_path or default_index_path(args.image_dir)
+    index = ReferenceHashIndex.build(args.image_dir, args.workers)
+    index.save(index_path)
+    print(f"Indexed {len(index)} reference images into {index_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Queued, coalescing, concurrent label emission"""
+
+import queue
+import random
+import threading
+import time
+from typing import TYPE_CHECKING, List
+
+from .label import at_uri_from_url, did_from_handle, fetch_post, label_event, strong_ref
+from .metrics import stage_metrics
+
+if TYPE_CHECKING:
+    from atproto import Client
+    from atproto_client.models.com.atproto.repo.strong_ref import Main
+
+
+class LabelEmitter:
+    """
+    Send label events to the labeler service in the background.
+
+    Labels submitted for a subject that is still waiting in the queue are
+    merged into the same ModEventLabel, so each subject gets one emit_event
+    call per batch of labels. At most max_in_flight calls run at once, and
+    failed calls are retried with exponential backoff and jitter.
+    """
+
+    def __init__(
+        self,
+        client: "Client",
+        labeler_client: "Client",
+        max_in_flight: int = 4,
+        max_retries: int = 4,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+    ):
+        self.client = client
+        self.labeler_client = labeler_client
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._pending = {}  # subject key -> [resolve_subject, labels]
+        self._queue = queue.Queue()
+        self.emitted = 0
+        self.merged = 0
+        self.retries = 0
+        self.failed = 0
+        self._workers = [
+            threading.Thread(target=self._worker, name=f"label-emitter-{i}", daemon=True)
+            for i in range(max(1, max_in_flight))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit_post(self, post_url: str, label_value: List[str], post_ref: "Main" = None):
+        """Queue labels for a post; pass the strong ref captured during moderation to skip a lookup"""
+        key = post_ref.uri if post_ref is not None else at_uri_from_url(post_url)
+        if post_ref is not None:
+            resolve = lambda: post_ref
+        else:
+            resolve = lambda: strong_ref(fetch_post(self.client, post_url))
+        self._submit(key, resolve, label_value)
+
+    def submit_account(self, handle: str, label_value: List[str]):
+        """Queue labels for an account"""
+        from atproto_client.models.com.atproto.admin.defs import RepoRef
+
+        self._submit(handle, lambda: RepoRef(did=did_from_handle(handle)), label_value)
+
+    def _submit(self, key: str, resolve, label_value: List[str]):
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                #Still queued: fold the new labels into the same event
+                pending[1].extend(label for label in label_value if label not in pending[1])
+                self.merged += 1
+                return
+            self._pending[key] = [resolve, list(dict.fromkeys(label_value))]
+        self._queue.put(key)
+
+    def _worker(self):
+        while True:
+            key = self._queue.get()
+            try:
+                if key is None:
+                    return
+                with self._lock:
+                    resolve, labels = self._pending.pop(key)
+                self._emit(key, resolve, labels)
+            finally:
+                self._queue.task_done()
+
+    def _emit(self, key: str, resolve, labels: List[str]):
+        """Send one event, retrying with backoff"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                data = label_event(self.client.me.did, resolve(), labels)
+                self.labeler_client.tools.ozone.moderation.emit_event(data)
+                with self._lock:
+                    self.emitted += 1
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"Error emitting {labels} for {key}: {e}")
+                    with self._lock:
+                        self.failed += 1
+                    stage_metrics.count_error("emit_failed")
+                    return
+                with self._lock:
+                    self.retries += 1
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                time.sleep(delay * random.uniform(0.5, 1.5))
+
+    def flush(self):
+        """Wait until every queued event has been sent (or given up on)"""
+        self._queue.join()
+
+    def close(self):
+        """Flush the queue and stop the workers"""
+        self.flush()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def stats(self) -> dict:
+        """Emission counters"""
+        return {
+            "emitted": self.emitted,
+            "merged": self.merged,
+            "retries": self.retries,
+            "failed": self.failed,
+        }
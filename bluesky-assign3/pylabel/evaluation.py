@@ -0,0 +1,140 @@
+"""Offline evaluation: cached per-post detector features, re-scored over threshold grids"""
+
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+DOG_LABEL = "dog"
+BOT_LABEL = "Likely Bot Giveaway"
+HUMAN_LABEL = "Likely Human Giveaway"
+
+
+class FeatureCache:
+    """
+    JSONL file of {url, expected, features} records, one per evaluated post.
+
+    The features are whatever the labeler's features(post) returns: the raw
+    inputs of its detectors before any threshold is applied. Records are
+    appended as posts finish, so an interrupted extraction only has to fetch
+    the posts it has not reached yet.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.records[record["url"]] = record
+
+    def __contains__(self, url: str) -> bool:
+        return url in self.records
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def add(self, url: str, expected: List[str], features: dict):
+        record = {"url": url, "expected": list(expected), "features": features}
+        with self._lock:
+            self.records[url] = record
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + "\n")
+
+    def ordered(self, urls: Sequence[str] = None) -> List[dict]:
+        """Records for urls (every record when None), in that order, skipping urls without features"""
+        if urls is None:
+            return list(self.records.values())
+        return [self.records[url] for url in urls if url in self.records]
+
+
+def grid(spec: str) -> np.ndarray:
+    """Thresholds from "start:stop:step" (stop included) or a comma-separated list"""
+    if ":" in spec:
+        start, stop, step = (float(part) for part in spec.split(":"))
+        return np.round(np.arange(start, stop + step / 2, step), 10)
+    return np.array([float(part) for part in spec.split(",")])
+
+
+def label_metrics(predicted: np.ndarray, expected: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Precision, recall and F1 of boolean predictions shaped (..., posts) against
+    expected (posts,), for every leading index at once; 0 where undefined
+    """
+    expected = np.asarray(expected, dtype=bool)
+    true_positives = (predicted & expected).sum(axis=-1)
+    predicted_positives = predicted.sum(axis=-1)
+    positives = expected.sum()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(predicted_positives > 0, true_positives / predicted_positives, 0.0)
+        recall = np.where(positives > 0, true_positives / positives, 0.0) * np.ones_like(precision)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    return {"precision": precision, "recall": recall, "f1": f1, "support": int(positives)}
+
+
+def expected_matrix(records: List[dict], label: str) -> np.ndarray:
+    return np.array([label in record["expected"] for record in records], dtype=bool)
+
+
+def fixed_label_metrics(records: List[dict], labels_of, skip: Sequence[str] = ()) -> Dict[str, dict]:
+    """Metrics of the labels no threshold affects; labels_of(features) gives a post's labels"""
+    predicted_labels = [set(labels_of(record["features"])) for record in records]
+    names = sorted({label for labels in predicted_labels for label in labels}
+                   | {label for record in records for label in record["expected"]})
+    return {
+        label: label_metrics(np.array([label in labels for labels in predicted_labels]),
+                             expected_matrix(records, label))
+        for label in names if label not in skip
+    }
+
+
+def dog_min_distances(records: List[dict]) -> np.ndarray:
+    """Distance from each post's image to its closest dog reference (inf without an image)"""
+    return np.array([
+        min(record["features"]["dog_distances"]) if record["features"].get("dog_distances") else np.inf
+        for record in records
+    ])
+
+
+def sweep_dog(records: List[dict], thresholds: np.ndarray) -> Dict[str, np.ndarray]:
+    """Dog label metrics for every threshold, in one pass: predictions are (thresholds, posts)"""
+    predicted = dog_min_distances(records)[None, :] < thresholds[:, None]
+    return label_metrics(predicted, expected_matrix(records, DOG_LABEL))
+
+
+def bot_feature_arrays(records: List[dict]):
+    """(giveaway, has bot features, follow_ratio, posts_per_day) arrays over posts"""
+    giveaway = np.array([bool(record["features"].get("giveaway")) for record in records])
+    bot = [record["features"].get("bot") or {} for record in records]
+    has_bot = np.array([bool(features) for features in bot])
+    follow_ratio = np.array([features.get("follow_ratio", 0.0) for features in bot], dtype=float)
+    posts_per_day = np.array([features.get("posts_per_day", 0.0) for features in bot], dtype=float)
+    return giveaway, has_bot, follow_ratio, posts_per_day
+
+
+def sweep_bot(records: List[dict], follow_ratio_thresholds: np.ndarray, posts_per_day_thresholds: np.ndarray,
+              rule) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    Bot and human label metrics over the grid of both bot thresholds in one
+    pass: rule(follow_ratio, posts_per_day, follow_ratio_threshold,
+    posts_per_day_threshold) is broadcast to (follow ratios, posts per day, posts)
+    """
+    giveaway, has_bot, follow_ratio, posts_per_day = bot_feature_arrays(records)
+    is_bot = rule(follow_ratio[None, None, :], posts_per_day[None, None, :],
+                  follow_ratio_thresholds[:, None, None], posts_per_day_thresholds[None, :, None])
+    labeled = giveaway & has_bot
+    return {
+        BOT_LABEL: label_metrics(labeled & is_bot, expected_matrix(records, BOT_LABEL)),
+        HUMAN_LABEL: label_metrics(labeled & ~is_bot, expected_matrix(records, HUMAN_LABEL)),
+    }
+
+
+def best(metrics: Dict[str, np.ndarray]) -> Optional[tuple]:
+    """Index (into the threshold grid) of the highest F1"""
+    f1 = metrics["f1"]
+    return np.unravel_index(int(np.argmax(f1)), f1.shape) if f1.size else None
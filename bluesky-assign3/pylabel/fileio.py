@@ -0,0 +1,26 @@
+"""Atomic replacement of files that several processes may write at once"""
+
+import os
+import tempfile
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = "w", **kwargs):
+    """
+    Open a temporary file of its own (created 0600) next to path, and replace
+    path with it once the block finishes.
+
+    Readers never see a partial file, and processes writing the same path at
+    once (e.g. sharded workers) never move or publish each other's temporary
+    file. On an error the temporary file is removed and path is left as it was.
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                                    dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, mode, **kwargs) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,86 @@
+"""pHash of downloaded images: reduced-resolution decode, optionally in a process pool"""
+
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from io import BytesIO
+from typing import List, Optional, Sequence
+
+#pHash resizes to 32x32 (hash_size 8 x highfreq_factor 4); JPEG draft mode decodes at
+#1/2, 1/4 or 1/8 scale, as small as possible while staying at least this size
+DRAFT_SIZE = 64
+
+_worker_hasher = None
+
+
+def decode_image(data: bytes, draft_size: Optional[int] = DRAFT_SIZE):
+    """Open image bytes, letting the JPEG decoder skip detail pHash throws away anyway"""
+    from PIL import Image
+
+    image = Image.open(BytesIO(data))
+    if draft_size:
+        #No-op for formats without draft support (PNG, WebP, ...)
+        image.draft("RGB", (draft_size, draft_size))
+    return image
+
+
+def hash_image_bytes(data: bytes, draft_size: Optional[int] = DRAFT_SIZE, hasher=None):
+    """pHash bool vector of an encoded image, or None if it can't be decoded"""
+    global _worker_hasher
+    if hasher is None:
+        if _worker_hasher is None:
+            from perception import hashers
+            _worker_hasher = hashers.PHash()
+        hasher = _worker_hasher
+    try:
+        with decode_image(data, draft_size) as image:
+            return hasher.compute(image, hash_format="vector")
+    except Exception:
+        return None
+
+
+class ImageHasher:
+    """
+    Hash encoded images, inline or in a process pool.
+
+    With workers=0, hashing runs on the calling thread. Otherwise a pool of
+    worker processes is started on first use (spawned, so it is safe from a
+    threaded labeler) and hash()/hash_many() spread images over every core.
+    """
+
+    def __init__(self, workers: int = 0, draft_size: Optional[int] = DRAFT_SIZE, hasher=None):
+        self.workers = os.cpu_count() if workers is None else workers
+        self.draft_size = draft_size
+        self.hasher = hasher
+        self._pool = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            import multiprocessing
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def submit(self, data: bytes) -> Future:
+        """Hash one image in the background (or right away when inline)"""
+        if not self.workers:
+            future = Future()
+            future.set_result(hash_image_bytes(data, self.draft_size, self.hasher))
+            return future
+        return self.pool.submit(hash_image_bytes, data, self.draft_size)
+
+    def hash(self, data: bytes):
+        """pHash vector of one encoded image, or None"""
+        return self.submit(data).result()
+
+    def hash_many(self, datas: Sequence[bytes]) -> List:
+        """pHash vectors of many encoded images, in order (None for undecodable ones)"""
+        if not self.workers:
+            return [hash_image_bytes(data, self.draft_size, self.hasher) for data in datas]
+        chunksize = max(1, len(datas) // (self.workers * 4))
+        return list(self.pool.map(hash_image_bytes, datas, [self.draft_size] * len(datas), chunksize=chunksize))
+
+    def close(self):
+        """Stop the worker processes"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
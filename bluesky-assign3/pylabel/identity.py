@@ -0,0 +1,131 @@
+"""Cached handle -> DID resolution"""
+
+import atexit
+import json
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from .cache import TTLCache
+from .fileio import atomic_write
+from .metrics import stage_metrics
+from . import transport as _transport
+from .transport import Transport
+
+RESOLVE_HANDLE_URL = "https://public.api.bsky.app/xrpc/com.atproto.identity.resolveHandle"
+
+
+def is_did(identifier: str) -> bool:
+    """True if identifier is already a DID (e.g. did:plc:...) rather than a handle"""
+    return identifier.startswith("did:")
+
+
+class IdentityResolver:
+    """
+    Resolve handles to DIDs through an in-memory LRU + TTL cache.
+
+    Identifiers that are already DIDs are returned as-is without any request.
+    With a persist_path, resolutions are also written to a JSON file and
+    loaded back (minus their elapsed TTL) on the next run. Writes are batched:
+    the file is rewritten every flush_every new resolutions and at exit.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 10000,
+        ttl: float = 3600.0,
+        negative_ttl: float = 60.0,
+        persist_path: str = None,
+        endpoint: str = RESOLVE_HANDLE_URL,
+        timeout: float = 10,
+        http: Transport = _transport.transport,
+        flush_every: int = 100,
+    ):
+        self.ttl = ttl
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl, negative_ttl=negative_ttl)
+        self.persist_path = persist_path
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.http = http
+        self.flush_every = flush_every
+        self._persisted = {}  # handle -> [did, resolved_at (wall clock)]
+        self._unsaved = 0  # resolutions not yet written to persist_path
+        self._persist_lock = threading.Lock()
+        if persist_path:
+            self._load_persisted()
+            atexit.register(self.flush)
+
+    def resolve(self, handle_or_did: str) -> str:
+        """Return the DID for a handle (or the DID itself)"""
+        if is_did(handle_or_did):
+            return handle_or_did
+        handle = handle_or_did.lower().lstrip("@")
+        return self.cache.get_or_load(handle, lambda: self._fetch(handle))
+
+    def _fetch(self, handle: str) -> str:
+        """Resolve a handle over the network"""
+        response = self.http.get(self.endpoint, params={"handle": handle}, timeout=self.timeout, endpoint="resolveHandle")
+        response.raise_for_status()
+        did = response.json()["did"]
+        if self.persist_path:
+            with self._persist_lock:
+                self._persisted[handle] = [did, time.time()]
+                self._unsaved += 1
+                if self._unsaved >= self.flush_every:
+                    self._save_persisted()
+        return did
+
+    def _read_persisted(self) -> dict:
+        """Resolutions in the persisted file, or none if it is missing or unreadable"""
+        if not os.path.exists(self.persist_path):
+            return {}
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable DID cache {self.persist_path}: {e}")
+            return {}
+
+    def _load_persisted(self):
+        """Warm the cache from the persisted file, dropping expired entries"""
+        now = time.time()
+        for handle, (did, resolved_at) in self._read_persisted().items():
+            remaining = self.ttl - (now - resolved_at)
+            if remaining > 0:
+                self._persisted[handle] = [did, resolved_at]
+                self.cache.set(handle, did, ttl=remaining)
+
+    def _save_persisted(self):
+        """
+        Atomically write the persisted resolutions, merged with what other
+        processes sharing the file (e.g. sharded workers) saved meanwhile. Two
+        processes saving at the same instant can still drop a few of each
+        other's entries, which only costs a later re-resolution. Caller must
+        hold the persist lock.
+        """
+        cutoff = time.time() - self.ttl
+        for handle, (did, resolved_at) in self._read_persisted().items():
+            if resolved_at > cutoff and resolved_at > self._persisted.get(handle, (None, 0.0))[1]:
+                self._persisted[handle] = [did, resolved_at]
+        with atomic_write(self.persist_path, 'w', encoding='utf-8') as f:
+            json.dump(self._persisted, f)
+        self._unsaved = 0
+
+    def flush(self):
+        """Write resolutions made since the last save to persist_path"""
+        with self._persist_lock:
+            if self.persist_path and self._unsaved:
+                self._save_persisted()
+
+    def stats(self) -> dict:
+        """Cache counters"""
+        return self.cache.stats()
+
+
+#Importers such as automated_labeler load this module before anything else reads .env
+load_dotenv(override=True)
+# Shared resolver; set DID_CACHE_PATH to persist resolutions across runs
+identity_resolver = IdentityResolver(persist_path=os.getenv("DID_CACHE_PATH"))
+stage_metrics.register_cache("identity", identity_resolver.stats)
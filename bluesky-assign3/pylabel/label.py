@@ -2,14 +2,20 @@
 
 import argparse
 import os
-from typing import List
+import sys
+from typing import TYPE_CHECKING, List
 
-import requests
-from atproto import Client, models
-from atproto_client.models.com.atproto.admin.defs import RepoRef
-from atproto_client.models.com.atproto.repo.strong_ref import Main
 from dotenv import load_dotenv
 
+from .cache import TTLCache, post_cache
+from .identity import identity_resolver
+from .session import get_client
+
+#atproto takes over a second to import, so it is only loaded when a label is built
+if TYPE_CHECKING:
+    from atproto import Client
+    from atproto_client.models.com.atproto.repo.strong_ref import Main
+
 load_dotenv(override=True)
 USERNAME = os.getenv("USERNAME")
 PW = os.getenv("PW")
@@ -19,20 +25,16 @@ def did_from_handle(handle: str):
     Resolve the DID associated with a handle.
 
     Args:
-        handle (str): The handle to resolve.
+        handle (str): The handle to resolve. DIDs are returned unchanged.
 
     Returns:
         str: The DID associated with the input handle.
     """
     # via: https://github.com/skygaze-ai/atproto-101
-    return requests.get(
-        "https://bsky.social/xrpc/com.atproto.identity.resolveHandle",
-        params={"handle": handle},
-        timeout=10,
-    ).json()["did"]
+    return identity_resolver.resolve(handle)
 
 
-def post_from_url(client: Client, url: str):
+def post_from_url(client: "Client", url: str):
     """
     Retrieve a Bluesky post from its URL
     """
@@ -42,56 +44,127 @@ def post_from_url(client: Client, url: str):
     return client.get_post(rkey, handle)
 
 
-def label_account(client: Client, handle: str, label_value: List[str]):
+def at_uri_from_url(url: str) -> str:
     """
-    Apply a label to an account with the specified handle
+    Build the AT-URI of the post record behind a Bluesky post URL
     """
-    did = did_from_handle(handle)
-    data = models.ToolsOzoneModerationEmitEvent.Data(
-        created_by=client.me.did,
+    parts = url.split("/")
+    return f"at://{parts[-3]}/app.bsky.feed.post/{parts[-1]}"
+
+
+def fetch_post(client: "Client", url: str, cache: TTLCache = post_cache):
+    """
+    Retrieve a Bluesky post through the record cache, so repeated lookups of
+    the same post (and lookups of missing posts) don't hit the network again
+    """
+    return cache.get_or_load(at_uri_from_url(url), lambda: post_from_url(client, url))
+
+
+def strong_ref(post) -> "Main":
+    """
+    Strong reference (uri + cid) to a fetched post, the subject of a post label
+    """
+    from atproto_client.models.com.atproto.repo.strong_ref import Main
+
+    return Main(cid=post.cid, uri=post.uri)
+
+
+def label_event(created_by: str, subject, label_value: List[str]):
+    """
+    Build the moderation event that applies labels to a subject
+    """
+    from atproto import models
+
+    return models.ToolsOzoneModerationEmitEvent.Data(
+        created_by=created_by,
         event=models.ToolsOzoneModerationDefs.ModEventLabel(
             create_label_vals=label_value,
             negate_label_vals=[],
         ),
-        subject=RepoRef(did=did),
+        subject=subject,
         subject_blob_cids=[],
     )
+
+
+def label_account(client: "Client", handle: str, label_value: List[str]):
+    """
+    Apply a label to an account with the specified handle
+    """
+    from atproto_client.models.com.atproto.admin.defs import RepoRef
+
+    did = did_from_handle(handle)
+    data = label_event(client.me.did, RepoRef(did=did), label_value)
     return client.tools.ozone.moderation.emit_event(data)
 
 
 def label_post(
-    client: Client, labeler_client: Client, post_url: str, label_value: List[str]
+    client: "Client",
+    labeler_client: "Client",
+    post_url: str,
+    label_value: List[str],
+    post_ref: "Main" = None,
 ):
     """
-    Apply a label to a post with the specified URL
+    Apply a label to a post with the specified URL. Pass the post's strong ref
+    if it is already known; otherwise the post is looked up through the cache.
     """
-    post = post_from_url(client, post_url)
-    post_ref = Main(cid=post.cid, uri=post.uri)
-    data = models.ToolsOzoneModerationEmitEvent.Data(
-        created_by=client.me.did,
-        event=models.ToolsOzoneModerationDefs.ModEventLabel(
-            create_label_vals=label_value,
-            negate_label_vals=[],
-        ),
-        subject=post_ref,
-        subject_blob_cids=[],
-    )
+    if post_ref is None:
+        post_ref = strong_ref(fetch_post(client, post_url))
+    data = label_event(client.me.did, post_ref, label_value)
     return labeler_client.tools.ozone.moderation.emit_event(data)
 
 
+def read_label_requests(path: str):
+    """
+    Read bulk label requests, one "label_target target_id label_value" per line,
+    from a file or from stdin when path is "-". Blank lines and # comments are skipped.
+    """
+    stream = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        for line in stream:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            parts = line.split()
+            if len(parts) != 3:
+                raise ValueError(f"Error: Invalid label request: {line}")
+            yield tuple(parts)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
 def main():
     """
     Main function for command-line tool.
     """
-    client = Client()
-    client.login(USERNAME, PW)
+    client = get_client()
     did = did_from_handle(USERNAME)
     labeler_client = client.with_proxy("atproto_labeler", did)
     parser = argparse.ArgumentParser()
-    parser.add_argument("label_target", type=str)
-    parser.add_argument("target_id", type=str)
-    parser.add_argument("label_value", type=str)
+    parser.add_argument("label_target", type=str, nargs="?")
+    parser.add_argument("target_id", type=str, nargs="?")
+    parser.add_argument("label_value", type=str, nargs="?")
+    parser.add_argument("--file", type=str, default=None, help='bulk mode: file of label requests, or "-" for stdin')
+    parser.add_argument("--max_in_flight", type=int, default=4)
     args = parser.parse_args()
+
+    if args.file is not None:
+        from .emitter import LabelEmitter
+
+        with LabelEmitter(client, labeler_client, max_in_flight=args.max_in_flight) as emitter:
+            for label_target, target_id, label_value in read_label_requests(args.file):
+                if label_target == "post":
+                    emitter.submit_post(target_id, [label_value])
+                elif label_target == "account":
+                    emitter.submit_account(target_id, [label_value])
+                else:
+                    raise ValueError("Error: Invalid target")
+        print("result:", emitter.stats())
+        return
+    if args.label_value is None:
+        parser.error("label_target, target_id and label_value are required without --file")
+
     label_target, target_id, label_value = (
         args.label_target,
         args.target_id,
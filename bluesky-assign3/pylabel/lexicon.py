@@ -0,0 +1,147 @@
+"""Compiled lexicon snapshot: word/domain lists and their matchers, ready to use"""
+
+import argparse
+import csv
+import hashlib
+import os
+import pickle
+from typing import Dict, List
+
+from .fileio import atomic_write
+from .matching import AhoCorasick, GiveawayMatcher
+
+#Bump when the snapshot layout or the matchers change, so old snapshots are rebuilt
+LEXICON_VERSION = 3
+SNAPSHOT_NAME = "lexicon.snapshot"
+SOURCE_FILES = (
+    "t-and-s-words.csv",
+    "t-and-s-domains.csv",
+    "news-domains.csv",
+    "giveaway-words.csv",
+)
+#Sources whose columns pair up per row (the others are independent word lists)
+PAIRED_FILES = ("news-domains.csv",)
+
+
+def read_csv_rows(path: str) -> List[Dict[str, str]]:
+    """Read a CSV into one {column: value} dict per row, skipping rows whose cells are all empty"""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return [row for row in csv.DictReader(f, restval="") if any(row.values())]
+
+
+def read_csv_columns(path: str) -> Dict[str, List[str]]:
+    """
+    Read a CSV into {column: non-empty values in order}, like pd.read_csv(...)[column].dropna().
+    Only for files whose columns are independent lists; rows are not kept aligned.
+    """
+    columns = {}
+    for row in read_csv_rows(path):
+        for name, value in row.items():
+            if name is None:  # cells past the header
+                continue
+            values = columns.setdefault(name, [])
+            if value:
+                values.append(value)
+    return columns
+
+
+def source_digest(input_dir: str) -> str:
+    """SHA-256 over the names and contents of the source CSVs present in input_dir"""
+    digest = hashlib.sha256()
+    for filename in SOURCE_FILES:
+        path = os.path.join(input_dir, filename)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                digest.update(filename.encode() + b"\0" + f.read())
+    return digest.hexdigest()
+
+
+class Lexicon:
+    """Every labeler word/domain list plus its compiled matcher"""
+
+    def __init__(self, input_dir: str):
+        #Content hash of the sources, for caches (and the snapshot) that must be dropped when the lexicon changes;
+        #taken before parsing, so a CSV edited meanwhile makes the snapshot stale rather than wrong
+        self.digest = source_digest(input_dir)
+        columns = {}
+        for filename in SOURCE_FILES:
+            path = os.path.join(input_dir, filename)
+            if os.path.exists(path):
+                columns[filename] = read_csv_rows(path) if filename in PAIRED_FILES else read_csv_columns(path)
+
+        #T&S words and domains, lowercased and deduplicated in file order
+        t_and_s_words = columns.get("t-and-s-words.csv", {})
+        t_and_s_domains = columns.get("t-and-s-domains.csv", {})
+        self.t_and_s_words = list(dict.fromkeys(word.lower() for word in t_and_s_words.get("Word", [])))
+        self.t_and_s_domains = list(dict.fromkeys(domain.lower() for domain in t_and_s_domains.get("Domain", [])))
+        self.word_matcher = AhoCorasick(self.t_and_s_words)
+        self.domain_matcher = AhoCorasick(self.t_and_s_domains)
+
+        #News domain -> source label, read row by row so each domain keeps its own source
+        self.news_domains = {row["Domain"]: row["Source"] for row in columns.get("news-domains.csv", []) if row["Domain"]}
+        self.news_matcher = AhoCorasick(self.news_domains)
+
+        #Giveaway and call-to-action words
+        giveaway = columns.get("giveaway-words.csv", {})
+        self.giveaway_words = giveaway.get("Words", [])
+        self.cta_words = giveaway.get("call-to-action", [])
+        self.giveaway_matcher = GiveawayMatcher(self.giveaway_words, self.cta_words)
+
+
+def default_snapshot_path(input_dir: str) -> str:
+    """Location of the snapshot for a labeler inputs directory"""
+    return os.path.join(input_dir, SNAPSHOT_NAME)
+
+
+def save_snapshot(lexicon: Lexicon, path: str):
+    """Atomically write a versioned snapshot, tagged with the digest of the sources it was compiled from"""
+    with atomic_write(path, 'wb') as f:
+        pickle.dump(
+            {"version": LEXICON_VERSION, "digest": lexicon.digest, "lexicon": lexicon},
+            f,
+            protocol=pickle.HIGHEST_PROTOCOL,
+        )
+
+
+def build_snapshot(input_dir: str, snapshot_path: str = None) -> Lexicon:
+    """Compile the lexicon from the CSVs in input_dir and save it"""
+    lexicon = Lexicon(input_dir)
+    try:
+        save_snapshot(lexicon, snapshot_path or default_snapshot_path(input_dir))
+    except OSError as e:
+        print(f"Could not save lexicon snapshot: {e}")
+    return lexicon
+
+
+def load_lexicon(input_dir: str, snapshot_path: str = None) -> Lexicon:
+    """Load the snapshot for input_dir, rebuilding it if it is missing, outdated or any source CSV changed"""
+    snapshot_path = snapshot_path or default_snapshot_path(input_dir)
+    if os.path.exists(snapshot_path):
+        try:
+            with open(snapshot_path, 'rb') as f:
+                snapshot = pickle.load(f)
+            if snapshot["version"] == LEXICON_VERSION and snapshot["digest"] == source_digest(input_dir):
+                return snapshot["lexicon"]
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, KeyError, TypeError) as e:
+            print(f"Rebuilding unreadable lexicon snapshot {snapshot_path}: {e}")
+    return build_snapshot(input_dir, snapshot_path)
+
+
+def main():
+    """Build the lexicon snapshot ahead of time"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("labeler_inputs_dir", type=str)
+    parser.add_argument("--snapshot_path", type=str, default=None)
+    args = parser.parse_args()
+
+    snapshot_path = args.snapshot_path or default_snapshot_path(args.labeler_inputs_dir)
+    lexicon = build_snapshot(args.labeler_inputs_dir, snapshot_path)
+    print(
+        f"Compiled {len(lexicon.t_and_s_words)} T&S words, {len(lexicon.t_and_s_domains)} T&S domains, "
+        f"{len(lexicon.news_domains)} news domains, {len(lexicon.giveaway_words)} giveaway words and "
+        f"{len(lexicon.cta_words)} CTA words into {snapshot_path}"
+    )
+
+
+if __name__ == "__main__":
+    main()
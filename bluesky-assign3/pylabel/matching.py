@@ -0,0 +1,133 @@
+"""Multi-pattern text matching for the labeler lexicons"""
+
+import re
+from collections import deque
+from typing import Iterable, Iterator, List, Tuple
+
+
+def _is_word_char(char: str) -> bool:
+    """Same notion of a word character as the regex \\w class"""
+    return char.isalnum() or char == "_"
+
+
+def is_word_boundary(text: str, index: int) -> bool:
+    """True if a regex \\b would match between text[index - 1] and text[index]"""
+    before = index > 0 and _is_word_char(text[index - 1])
+    after = index < len(text) and _is_word_char(text[index])
+    return before != after
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton over a fixed list of patterns.
+
+    The automaton is compiled once and then reports every pattern occurring in
+    a text in a single left-to-right pass, independent of the number of
+    patterns. With word_boundary=True a match only counts when it is delimited
+    like the regex \\bpattern\\b would be.
+    """
+
+    def __init__(self, patterns: Iterable[str], word_boundary: bool = False, ignore_case: bool = False):
+        self.word_boundary = word_boundary
+        self.ignore_case = ignore_case
+        self.patterns = list(patterns)
+        self._goto = [{}]  # state -> {char: next state}
+        self._fail = [0]
+        self._out = [[]]  # state -> indices of patterns ending at this state
+        self._lengths = []
+        for index, pattern in enumerate(self.patterns):
+            if ignore_case:
+                pattern = pattern.lower()
+            self._lengths.append(len(pattern))
+            if pattern:
+                self._add(pattern, index)
+        self._link()
+
+    def _add(self, pattern: str, index: int):
+        """Insert a pattern into the trie"""
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = next_state
+        self._out[state].append(index)
+
+    def _link(self):
+        """Compute failure links breadth-first and merge outputs along them"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int]]:
+        """Yield (start, pattern index) for every occurrence of a pattern in text"""
+        if self.ignore_case:
+            text = text.lower()
+        goto, fail, out, lengths = self._goto, self._fail, self._out, self._lengths
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in out[state]:
+                end = position + 1
+                start = end - lengths[index]
+                if self.word_boundary and not (
+                    is_word_boundary(text, start) and is_word_boundary(text, end)
+                ):
+                    continue
+                yield start, index
+
+    def find_all(self, text: str) -> List[str]:
+        """Distinct patterns found in text, in pattern-list order"""
+        found = {index for _start, index in self.iter_matches(text)}
+        return [self.patterns[index] for index in sorted(found)]
+
+    def search(self, text: str) -> bool:
+        """True if any pattern occurs in text, stopping at the first match"""
+        return next(self.iter_matches(text), None) is not None
+
+
+def compile_word_alternation(words: Iterable[str], flags: int = re.IGNORECASE) -> "re.Pattern":
+    """
+    Compile a word list into a single \\b(?:w1|w2|...)\\b pattern.
+
+    A text matches the compiled pattern exactly when it matches \\bword\\b for
+    at least one of the words, so one search replaces a search per word.
+    """
+    alternatives = [re.escape(word) for word in words if word]
+    if not alternatives:
+        return re.compile(r"(?!)")  # never matches
+    return re.compile(rf"\b(?:{'|'.join(alternatives)})\b", flags)
+
+
+class GiveawayMatcher:
+    """Compiled giveaway + call-to-action term matcher"""
+
+    def __init__(self, giveaway_words: Iterable[str], cta_words: Iterable[str]):
+        self.giveaway_pattern = compile_word_alternation(giveaway_words)
+        self.cta_pattern = compile_word_alternation(cta_words)
+
+    def has_giveaway_term(self, text: str) -> bool:
+        """True if text contains any giveaway word"""
+        return self.giveaway_pattern.search(text) is not None
+
+    def has_cta_term(self, text: str) -> bool:
+        """True if text contains any call-to-action word"""
+        return self.cta_pattern.search(text) is not None
+
+    def matches(self, text: str) -> bool:
+        """True if text has both a giveaway term and a CTA term (CTA is only checked after a giveaway hit)"""
+        return self.has_giveaway_term(text) and self.has_cta_term(text)
@@ -0,0 +1,443 @@
+"""Labeler instrumentation: stage timers, outbound-call counters, cache and error metrics"""
+
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+#Requests made outside any stage (e.g. from a batch loader's own thread) are counted here
+UNATTRIBUTED = "other"
+#Histogram bucket upper bounds in seconds, Prometheus style
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+#XRPC method -> endpoint name used in the call metrics
+XRPC_ENDPOINTS = {
+    "com.atproto.repo.getRecord": "getPost",
+    "com.atproto.identity.resolveHandle": "resolveHandle",
+    "app.bsky.actor.getProfile": "getProfile",
+    "app.bsky.actor.getProfiles": "getProfile",
+    "tools.ozone.moderation.emitEvent": "emit_event",
+}
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Linearly interpolated q-th percentile (0-100) of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def latency_summary(samples: List[float]) -> dict:
+    """count/mean/p50/p95/p99/max of a list of durations in seconds"""
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered) if ordered else 0.0,
+        "p50": percentile(ordered, 50),
+        "p95": percentile(ordered, 95),
+        "p99": percentile(ordered, 99),
+        "max": ordered[-1] if ordered else 0.0,
+    }
+
+
+class Histogram:
+    """Fixed-bucket duration histogram (constant memory, safe to keep on in production)"""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        index = 0
+        while index < len(self.buckets) and seconds > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th percentile (0-100)"""
+        if not self.count:
+            return 0.0
+        rank = self.count * q / 100
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(50),
+            "p95": self.quantile(95),
+            "p99": self.quantile(99),
+            "buckets": dict(zip([str(bound) for bound in self.buckets] + ["+Inf"], self.counts)),
+        }
+
+
+class StageMetrics:
+    """
+    Metrics shared by both labelers, pylabel.label and the clients they use.
+
+    Stage durations, outbound calls (count, errors, latency, bytes per
+    endpoint), error counts and registered cache stats are always collected in
+    constant memory. Raw per-stage samples, used by the benchmark for exact
+    percentiles, are only kept between enable() and disable(). Stages nest per
+    thread, and a request is charged to the innermost stage of the thread
+    that made it.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._stacks = {}  # thread id -> stage stack, also read by the sampling profiler
+        self._stage_histograms = defaultdict(Histogram)
+        self._call_histograms = defaultdict(Histogram)
+        self._call_counts = Counter()
+        self._call_errors = Counter()
+        self._bytes_sent = Counter()
+        self._bytes_received = Counter()
+        self._errors = Counter()
+        self._caches = {}  # name -> callable returning cache stats
+        self._samples = defaultdict(list)
+        self._requests = defaultdict(int)
+        self._bytes = defaultdict(int)
+
+    def enable(self):
+        """Start keeping raw samples for summary()"""
+        self.enabled = True
+
+    def disable(self):
+        """Stop keeping raw samples (they are kept until reset())"""
+        self.enabled = False
+
+    def reset(self):
+        """Drop every recorded sample and counter"""
+        with self._lock:
+            for metric in (
+                self._stage_histograms, self._call_histograms, self._call_counts, self._call_errors,
+                self._bytes_sent, self._bytes_received, self._errors, self._samples, self._requests, self._bytes,
+            ):
+                metric.clear()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time one run of a stage"""
+        stack = self._stack()
+        stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            if not stack:
+                #Drop finished threads' stacks so short-lived worker threads don't pile up
+                self._stacks.pop(threading.get_ident(), None)
+            self.record(name, elapsed)
+
+    def _stack(self) -> list:
+        ident = threading.get_ident()
+        stack = self._stacks.get(ident)
+        if stack is None:
+            stack = self._stacks[ident] = []
+        return stack
+
+    def current_stage(self) -> str:
+        """Innermost stage running on this thread"""
+        stack = self._stacks.get(threading.get_ident())
+        return stack[-1] if stack else UNATTRIBUTED
+
+    def thread_stage(self, ident: int) -> str:
+        """Innermost stage running on another thread, or None"""
+        stack = self._stacks.get(ident)
+        try:
+            return stack[-1] if stack else None
+        except IndexError:
+            return None
+
+    def record(self, name: str, seconds: float):
+        """Add one duration sample for a stage"""
+        with self._lock:
+            self._stage_histograms[name].observe(seconds)
+            if self.enabled:
+                self._samples[name].append(seconds)
+
+    def record_call(self, endpoint: str, seconds: float, error: bool = False):
+        """Count one outbound call that took seconds"""
+        with self._lock:
+            self._call_counts[endpoint] += 1
+            self._call_histograms[endpoint].observe(seconds)
+            if error:
+                self._call_errors[endpoint] += 1
+
+    def add_bytes(self, endpoint: str, sent: int = 0, received: int = 0):
+        """Add request/response body sizes of a call"""
+        with self._lock:
+            self._bytes_sent[endpoint] += sent
+            self._bytes_received[endpoint] += received
+
+    def count_error(self, kind: str):
+        """Count an error that was handled (logged and skipped) rather than raised"""
+        with self._lock:
+            self._errors[kind] += 1
+
+    def register_cache(self, name: str, stats: Callable[[], dict]):
+        """Report a cache's stats() (hits, misses, hit_rate, ...) under name"""
+        with self._lock:
+            self._caches[name] = stats
+
+    def count_request(self, received_bytes: int = 0):
+        """Charge one HTTP request to the current stage (benchmark only)"""
+        if not self.enabled:
+            return
+        name = self.current_stage()
+        with self._lock:
+            self._requests[name] += 1
+            self._bytes[name] += received_bytes
+
+    def summary(self) -> Dict[str, dict]:
+        """Exact latency percentiles plus request counts for every stage seen since enable()"""
+        with self._lock:
+            names = sorted(set(self._samples) | set(self._requests))
+            summary = {}
+            for name in names:
+                stats = latency_summary(self._samples.get(name, []))
+                stats["requests"] = self._requests.get(name, 0)
+                stats["bytes_received"] = self._bytes.get(name, 0)
+                summary[name] = stats
+        return summary
+
+    def snapshot(self) -> dict:
+        """Point-in-time copy of every metric"""
+        with self._lock:
+            stages = {name: histogram.to_dict() for name, histogram in self._stage_histograms.items()}
+            calls = {
+                endpoint: {
+                    "count": self._call_counts[endpoint],
+                    "errors": self._call_errors[endpoint],
+                    "bytes_sent": self._bytes_sent[endpoint],
+                    "bytes_received": self._bytes_received[endpoint],
+                    "latency": self._call_histograms[endpoint].to_dict(),
+                }
+                for endpoint in sorted(set(self._call_counts) | set(self._bytes_received) | set(self._bytes_sent))
+            }
+            errors = dict(self._errors)
+            caches = dict(self._caches)
+        return {
+            "stages": stages,
+            "calls": calls,
+            "errors": errors,
+            "caches": {name: stats() for name, stats in caches.items()},
+        }
+
+    def prometheus_text(self, prefix: str = "labeler") -> str:
+        """Snapshot in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+
+        def histogram(name: str, label: str, values: dict):
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            for key, stats in values.items():
+                cumulative = 0
+                for bound, count in stats["buckets"].items():
+                    cumulative += count
+                    lines.append(f'{prefix}_{name}_bucket{{{label}="{key}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_{name}_sum{{{label}="{key}"}} {stats["sum"]}')
+                lines.append(f'{prefix}_{name}_count{{{label}="{key}"}} {stats["count"]}')
+
+        def counter(name: str, labels: Dict[str, dict], field: str):
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            for key, values in labels.items():
+                lines.append(f'{prefix}_{name}{{endpoint="{key}"}} {values[field]}')
+
+        histogram("stage_seconds", "stage", snapshot["stages"])
+        counter("calls_total", snapshot["calls"], "count")
+        counter("call_errors_total", snapshot["calls"], "errors")
+        counter("call_bytes_sent_total", snapshot["calls"], "bytes_sent")
+        counter("call_bytes_received_total", snapshot["calls"], "bytes_received")
+        histogram("call_seconds", "endpoint", {key: values["latency"] for key, values in snapshot["calls"].items()})
+        lines.append(f"# TYPE {prefix}_errors_total counter")
+        for kind, count in snapshot["errors"].items():
+            lines.append(f'{prefix}_errors_total{{kind="{kind}"}} {count}')
+        lines.append(f"# TYPE {prefix}_cache gauge")
+        for cache, stats in snapshot["caches"].items():
+            for key, value in stats.items():
+                if isinstance(value, (int, float)):
+                    lines.append(f'{prefix}_cache{{cache="{cache}",stat="{key}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+stage_metrics = StageMetrics()
+
+
+def stage(name: str):
+    """Time a block as one run of a stage in the shared stage_metrics"""
+    return stage_metrics.stage(name)
+
+
+def snapshot() -> dict:
+    """Snapshot of the shared stage_metrics"""
+    return stage_metrics.snapshot()
+
+
+def prometheus_text(prefix: str = "labeler") -> str:
+    """Prometheus text dump of the shared stage_metrics"""
+    return stage_metrics.prometheus_text(prefix)
+
+
+def xrpc_endpoint(url) -> str:
+    """Endpoint name for an XRPC URL (the method NSID if it has no friendlier name)"""
+    path = str(getattr(url, "path", url))
+    nsid = path.rsplit("/xrpc/", 1)[-1].split("?", 1)[0]
+    return XRPC_ENDPOINTS.get(nsid, nsid)
+
+
+def serve_metrics(port: int, host: str = "0.0.0.0", metrics: StageMetrics = stage_metrics):
+    """Serve the Prometheus text dump on http://host:port/metrics from a daemon thread"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+class SamplingProfiler:
+    """
+    Periodically sample the stacks of every other thread.
+
+    Each sample is attributed to the stage the thread was in, so the profile
+    shows both which stage and which code inside it is using the time.
+    folded() returns collapsed stacks for flamegraph tools.
+    """
+
+    def __init__(self, interval: float = 0.005, metrics: StageMetrics = stage_metrics, max_depth: int = 40):
+        self.interval = interval
+        self.metrics = metrics
+        self.max_depth = max_depth
+        self.stage_samples = Counter()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stage_name = self.metrics.thread_stage(ident)
+                if stage_name is None:
+                    continue
+                names = []
+                while frame is not None and len(names) < self.max_depth:
+                    code = frame.f_code
+                    names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.stage_samples[stage_name] += 1
+                self.stacks[(stage_name,) + tuple(reversed(names))] += 1
+
+    def folded(self) -> str:
+        """Collapsed "stage;outer;...;inner count" lines"""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def report(self, top: int = 10) -> str:
+        """Share of samples per stage and the hottest innermost frames"""
+        total = sum(self.stage_samples.values())
+        if not total:
+            return "No samples"
+        lines = [f"{total} samples every {self.interval * 1000:.1f}ms"]
+        for stage_name, count in self.stage_samples.most_common():
+            lines.append(f"  {stage_name:<12} {count / total:6.1%}")
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[(stack[0], stack[-1])] += count
+        lines.append("Hottest frames:")
+        for (stage_name, frame), count in leaves.most_common(top):
+            lines.append(f"  {count / total:6.1%}  [{stage_name}] {frame}")
+        return "\n".join(lines)
+
+
+def instrument_http(metrics: StageMetrics = stage_metrics) -> Callable[[], None]:
+    """
+    Count every request sent through requests or httpx (used by the ATProto client).
+
+    Meant for benchmarks only: the send methods are wrapped in place, and the
+    returned function restores them.
+    """
+    patched = []
+
+    def wrap(cls):
+        original = cls.send
+
+        def send(self, request, *args, **kwargs):
+            response = original(self, request, *args, **kwargs)
+            metrics.count_request(_response_size(response))
+            return response
+
+        cls.send = send
+        patched.append((cls, original))
+
+    import requests
+    wrap(requests.Session)
+    try:
+        import httpx
+    except ImportError:
+        httpx = None
+    if httpx is not None:
+        wrap(httpx.Client)
+
+    def restore():
+        for cls, original in reversed(patched):
+            cls.send = original
+
+    return restore
+
+
+def _response_size(response) -> int:
+    length = response.headers.get("content-length")
+    if length is not None and length.isdigit():
+        return int(length)
+    try:
+        return len(response.content)
+    except Exception:
+        return 0
@@ -0,0 +1,149 @@
+"""Declarative detector pipeline: stages declare their inputs, independent I/O runs concurrently"""
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+from .metrics import stage_metrics
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def default_executor() -> ThreadPoolExecutor:
+    """Thread pool shared by every pipeline's I/O stages"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="pipeline")
+        return _executor
+
+
+@dataclass
+class Stage:
+    """
+    One detector step.
+
+    run is called with the values of `inputs` (pipeline inputs or earlier
+    stages), in order, followed by those of `optional_inputs`, and its return
+    value becomes this stage's value. A skipped input skips the stage; a
+    skipped optional input is passed as None instead.
+    """
+
+    name: str
+    run: Callable[..., Any]
+    inputs: Sequence[str] = ()
+    optional_inputs: Sequence[str] = ()
+    #Cheap check on the same inputs; the stage (and everything after it) is skipped when it returns False
+    when: Optional[Callable[..., bool]] = None
+    #Network-bound: run on the thread pool, concurrently with other ready stages
+    io: bool = False
+    #May be dropped once the post's latency budget is spent
+    optional: bool = False
+
+
+class PipelineRun:
+    """Values computed for one post, plus the stages that did not run"""
+
+    def __init__(self, values: Dict[str, Any], skipped: set, dropped: set, elapsed: float):
+        self.values = values
+        self.skipped = skipped  # ruled out by `when`, a skipped input, or the caller
+        self.dropped = dropped  # optional stages cut by the latency budget
+        self.elapsed = elapsed
+
+    def labels(self, names: Iterable[str]) -> List[str]:
+        """Concatenate the label lists returned by the named stages, skipping any that did not run"""
+        labels = []
+        for name in names:
+            labels.extend(self.values.get(name) or [])
+        return labels
+
+
+class Pipeline:
+    """
+    Run a set of stages over one post.
+
+    A stage starts as soon as all of its inputs are available. Ready I/O
+    stages are submitted to a thread pool first, then ready CPU stages run on
+    the calling thread. With a budget (seconds), optional stages that have not
+    started by the deadline are dropped, and the run stops waiting for
+    optional stages still in flight; required stages always complete.
+    """
+
+    def __init__(self, stages: Sequence[Stage], inputs: Sequence[str] = (), executor: ThreadPoolExecutor = None):
+        self.stages = list(stages)
+        self.inputs = tuple(inputs)
+        self._executor = executor
+        known = set(self.inputs)
+        for stage in self.stages:
+            missing = [name for name in (*stage.inputs, *stage.optional_inputs) if name not in known]
+            if missing:
+                raise ValueError(f"Stage {stage.name} needs {missing}, which no earlier stage provides")
+            if stage.name in known:
+                raise ValueError(f"Duplicate stage name {stage.name}")
+            known.add(stage.name)
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        return self._executor or default_executor()
+
+    def _call(self, stage: Stage, values: Dict[str, Any]):
+        with stage_metrics.stage(stage.name):
+            return stage.run(*self._arguments(stage, values))
+
+    @staticmethod
+    def _arguments(stage: Stage, values: Dict[str, Any]) -> list:
+        return [values.get(name) for name in (*stage.inputs, *stage.optional_inputs)]
+
+    def run(self, values: Dict[str, Any], budget: float = None, skip: Iterable[str] = ()) -> PipelineRun:
+        """Run every stage not already given in values; stages named in skip are not run"""
+        start = time.monotonic()
+        deadline = None if budget is None else start + budget
+        values = dict(values)
+        skip = set(skip)
+        skipped, dropped = set(), set()
+        pending = [stage for stage in self.stages if stage.name not in values]
+        running = {}
+
+        while pending or running:
+            ready = [
+                stage for stage in pending
+                if all(name in values or name in skipped for name in (*stage.inputs, *stage.optional_inputs))
+            ]
+            for stage in ready:
+                pending.remove(stage)
+            inline = []
+            for stage in ready:
+                if (stage.name in skip or any(name in skipped for name in stage.inputs)
+                        or (stage.when is not None and not stage.when(*self._arguments(stage, values)))):
+                    skipped.add(stage.name)
+                elif stage.optional and deadline is not None and time.monotonic() >= deadline:
+                    skipped.add(stage.name)
+                    dropped.add(stage.name)
+                elif stage.io:
+                    running[self.executor.submit(self._call, stage, values)] = stage
+                else:
+                    inline.append(stage)
+            for stage in inline:
+                values[stage.name] = self._call(stage, values)
+            if ready:
+                continue
+
+            #Nothing new can start until an in-flight stage finishes
+            timeout = None
+            if deadline is not None and all(stage.optional for stage in running.values()):
+                timeout = max(0.0, deadline - time.monotonic())
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                #Out of time with only optional stages left: stop waiting for them
+                for stage in running.values():
+                    skipped.add(stage.name)
+                    dropped.add(stage.name)
+                running.clear()
+                continue
+            for future in done:
+                values[running.pop(future).name] = future.result()
+
+        return PipelineRun(values, skipped, dropped, time.monotonic() - start)
@@ -0,0 +1,316 @@
+"""Client-side rate limiting: a token bucket and an AIMD concurrency window per endpoint class"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Mapping, Optional, Tuple
+
+from .metrics import stage_metrics
+
+#Endpoint names (as in the call metrics) that share a limit; other XRPC methods are "appview"
+#unless their namespace has a class of its own below
+ENDPOINT_CLASSES = {
+    "getPost": "appview",
+    "getProfile": "appview",
+    "resolveHandle": "appview",
+    "emit_event": "ozone",
+    "cdn_image": "cdn",
+    "safe_browsing": "safe_browsing",
+}
+#XRPC method prefix -> class. Session calls (createSession, refreshSession) have strict per-route
+#policies (e.g. 30 per 5 minutes) that would throttle every read if they shared the appview limiter.
+XRPC_NAMESPACE_CLASSES = {
+    "com.atproto.server.": "session",
+}
+#Endpoint class -> (requests per second or None for no fixed rate, burst, initial concurrency, max concurrency).
+#A server's ratelimit-policy header replaces the fixed rate once it has been seen.
+CLASS_LIMITS = {
+    #The public AppView allows 3000 requests per 5 minutes
+    "appview": (10.0, 50, 8, 32),
+    #Moderation events are writes, which have much lower limits than reads
+    "ozone": (5.0, 10, 4, 8),
+    "cdn": (None, 0, 8, 64),
+    #Safe Browsing quotas are per day; lookups are batched, so a few requests go a long way
+    "safe_browsing": (5.0, 10, 2, 4),
+    #Logins and token refreshes are rare; their own ratelimit-policy sets the rate
+    "session": (None, 0, 2, 4),
+    "default": (None, 0, 8, 64),
+}
+#Statuses that mean "slow down": the window shrinks and the class pauses
+THROTTLE_STATUSES = frozenset({429, 503})
+
+
+def endpoint_class(endpoint: str, xrpc: bool = False) -> str:
+    """Rate-limit class of an endpoint"""
+    if endpoint in ENDPOINT_CLASSES:
+        return ENDPOINT_CLASSES[endpoint]
+    for prefix, limit_class in XRPC_NAMESPACE_CLASSES.items():
+        if endpoint.startswith(prefix):
+            return limit_class
+    return "appview" if xrpc else "default"
+
+
+def _header_number(headers: Mapping[str, str], *names: str) -> Optional[float]:
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value.split(",", 1)[0])
+            except ValueError:
+                return None
+    return None
+
+
+def parse_rate_limit(headers: Mapping[str, str], now: float = None) -> dict:
+    """
+    Rate-limit headers of a response as {limit, remaining, reset_in, window, retry_after}
+    (seconds; missing values are None). Understands the ratelimit-* headers
+    Bluesky sends, their x-ratelimit-* variants and Retry-After.
+    """
+    now = time.time() if now is None else now
+    reset = _header_number(headers, "ratelimit-reset", "x-ratelimit-reset")
+    window = None
+    policy = headers.get("ratelimit-policy") or headers.get("x-ratelimit-policy")
+    if policy:
+        #e.g. "3000;w=300": 3000 requests per 300 seconds
+        for part in policy.split(",", 1)[0].split(";")[1:]:
+            key, _, value = part.strip().partition("=")
+            if key == "w":
+                try:
+                    window = float(value)
+                except ValueError:
+                    pass
+    #Bluesky sends reset as a Unix timestamp; small values are already seconds from now
+    reset_in = None
+    if reset is not None:
+        reset_in = max(0.0, reset - now) if reset > 1e9 else reset
+    return {
+        "limit": _header_number(headers, "ratelimit-limit", "x-ratelimit-limit"),
+        "remaining": _header_number(headers, "ratelimit-remaining", "x-ratelimit-remaining"),
+        "reset_in": reset_in,
+        "window": window,
+        "retry_after": _header_number(headers, "retry-after"),
+    }
+
+
+class TokenBucket:
+    """
+    Token bucket that hands out waits instead of blocking.
+
+    reserve() takes a token and returns how long the caller must wait before
+    using it; the balance may go negative, so callers are served in order. A
+    rate of None means no limit.
+    """
+
+    def __init__(self, rate: Optional[float], burst: float = 1, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._clock = clock
+        self._tokens = self.burst
+        self._updated = clock()
+
+    def _refill(self, now: float):
+        if self.rate is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def set_rate(self, rate: Optional[float]):
+        self._refill(self._clock())
+        self.rate = rate
+
+    def reserve(self) -> float:
+        """Take one token; seconds to wait before it is available"""
+        if self.rate is None:
+            return 0.0
+        now = self._clock()
+        self._refill(now)
+        self._tokens -= 1
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def drain(self):
+        """Spend every token, e.g. after the server said the quota is used up"""
+        self._refill(self._clock())
+        self._tokens = min(self._tokens, 0.0)
+
+
+class EndpointLimiter:
+    """
+    Limits for one endpoint class.
+
+    Requests take a slot from an AIMD concurrency window and a token from the
+    bucket. Each success while the window is full widens it by 1/window (so
+    by about one slot per round of requests); a 429 or 503 halves it, at most
+    once per round, and a 429 (or a 503 with Retry-After) pauses the class
+    until Retry-After or the quota reset. The rate follows the server's headers: the policy sets the
+    steady-state rate, and the remaining quota paces requests until the reset.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: Optional[float] = None,
+        burst: float = 1,
+        concurrency: float = 8,
+        max_concurrency: float = 64,
+        min_concurrency: float = 1,
+        cooldown: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.base_rate = rate
+        self.bucket = TokenBucket(rate, burst, clock)
+        self.window = float(concurrency)
+        self.max_window = float(max_concurrency)
+        self.min_window = float(min_concurrency)
+        self.cooldown = cooldown
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._paced_until = 0.0
+        #Responses since the window was last halved; it is halved at most once per window of responses
+        self._since_decrease = float("inf")
+        self.requests = 0
+        self.throttled = 0
+        self.waited = 0.0
+
+    @contextmanager
+    def slot(self):
+        """Hold one request's slot; call observe() with the response inside"""
+        waited = self._acquire()
+        try:
+            yield self
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify()
+        if waited:
+            stage_metrics.record("rate_limit_wait", waited)
+
+    def _acquire(self) -> float:
+        """Wait for a window slot, the end of any pause and a token; returns the seconds waited"""
+        start = self._clock()
+        with self._cond:
+            while True:
+                now = self._clock()
+                if now < self._paused_until:
+                    self._cond.wait(self._paused_until - now)
+                elif self._in_flight >= max(1, int(self.window)):
+                    self._cond.wait()
+                else:
+                    break
+            self._in_flight += 1
+            self.requests += 1
+            if self._paced_until and now >= self._paced_until:
+                #The quota window reset: back to the steady-state rate
+                self._paced_until = 0.0
+                self.bucket.set_rate(self.base_rate)
+            delay = self.bucket.reserve()
+        if delay > 0:
+            time.sleep(delay)
+        waited = self._clock() - start
+        self.waited += waited
+        return waited
+
+    def observe(self, status: int, headers: Mapping[str, str] = None):
+        """Adjust the limits to a response's status and rate-limit headers"""
+        info = parse_rate_limit(headers or {})
+        with self._cond:
+            now = self._clock()
+            self._follow_headers(info, now)
+            self._since_decrease += 1
+            if status in THROTTLE_STATUSES:
+                self.throttled += 1
+                stage_metrics.count_error("rate_limited")
+                if self._since_decrease >= self.window:
+                    self._since_decrease = 0
+                    self.window = max(self.min_window, self.window / 2)
+                pause = info["retry_after"]
+                if pause is None and info["remaining"] == 0:
+                    pause = info["reset_in"]
+                if pause is None and status == 429:
+                    pause = self.cooldown
+                #A bare 503 means "too many at once": the smaller window is enough
+                if pause is not None:
+                    self._paused_until = max(self._paused_until, now + pause)
+                    self.bucket.drain()
+            elif status < 400 and self._in_flight >= int(self.window):
+                self.window = min(self.max_window, self.window + 1 / self.window)
+            self._cond.notify_all()
+
+    def _follow_headers(self, info: dict, now: float):
+        """Take the steady-state rate from the policy and pace the remaining quota. Caller must hold the lock."""
+        if info["limit"] and info["window"]:
+            rate = info["limit"] / info["window"]
+            if rate != self.base_rate:
+                self.base_rate = rate
+                self.bucket.burst = max(1.0, min(info["limit"], rate * 5))
+                if not self._paced_until:
+                    self.bucket.set_rate(rate)
+        remaining, reset_in = info["remaining"], info["reset_in"]
+        if remaining is None or not reset_in:
+            return
+        if remaining <= 0:
+            self._paused_until = max(self._paused_until, now + reset_in)
+            return
+        #Spread what is left of the quota over the time until it resets
+        pace = remaining / reset_in
+        if self.base_rate is None or pace < self.base_rate:
+            self.bucket.set_rate(pace)
+            self._paced_until = now + reset_in
+        elif self._paced_until:
+            self._paced_until = 0.0
+            self.bucket.set_rate(self.base_rate)
+
+    def stats(self) -> dict:
+        return {
+            "window": self.window,
+            "in_flight": self._in_flight,
+            "rate": self.bucket.rate if self.bucket.rate is not None else 0.0,
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "waited_seconds": self.waited,
+        }
+
+
+class RateLimitScheduler:
+    """One EndpointLimiter per endpoint class, created from `limits` on first use"""
+
+    def __init__(
+        self,
+        limits: Mapping[str, Tuple[Optional[float], float, float, float]] = CLASS_LIMITS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.limits = dict(limits)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._limiters: Dict[str, EndpointLimiter] = {}
+
+    def limiter(self, name: str) -> EndpointLimiter:
+        limiter = self._limiters.get(name)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.get(name)
+                if limiter is None:
+                    rate, burst, concurrency, max_concurrency = self.limits.get(name, self.limits["default"])
+                    limiter = self._limiters[name] = EndpointLimiter(
+                        name, rate, burst, concurrency, max_concurrency, clock=self._clock
+                    )
+        return limiter
+
+    def slot(self, name: str):
+        """Context manager holding one request slot of an endpoint class"""
+        return self.limiter(name).slot()
+
+    def stats(self) -> dict:
+        """Flat per-class limiter stats, e.g. appview_window"""
+        return {
+            f"{name}_{key}": value
+            for name, limiter in sorted(self._limiters.items())
+            for key, value in limiter.stats().items()
+        }
+
+
+# Shared scheduler used by the shared transport
+rate_limits = RateLimitScheduler()
+stage_metrics.register_cache("rate_limits", rate_limits.stats)
@@ -0,0 +1,53 @@
+"""Materialized post records in the shape client.get_post() returns, built without fetching"""
+
+from typing import List
+
+from .corpus import iter_stored
+
+POST_COLLECTION = "app.bsky.feed.post"
+
+
+def at_uri(repo: str, rkey: str) -> str:
+    """AT-URI of a post"""
+    return f"at://{repo}/{POST_COLLECTION}/{rkey}"
+
+
+def repo_from_at_uri(uri: str) -> str:
+    """Repo (DID or handle) of an AT-URI like at://did:plc:…/app.bsky.feed.post/rkey"""
+    return uri.split('/')[2]
+
+
+def url_from_at_uri(uri: str) -> str:
+    """bsky.app URL of the post behind an AT-URI"""
+    parts = uri.split('/')
+    return f"https://bsky.app/profile/{parts[2]}/post/{parts[-1]}"
+
+
+def record_to_post(uri: str, cid: str, record: dict):
+    """Wrap a raw app.bsky.feed.post record (text, facets, embed, ...) like client.get_post() does"""
+    from atproto import models
+
+    record = dict(record)
+    record.setdefault("$type", POST_COLLECTION)
+    record.setdefault("createdAt", "")
+    return models.AppBskyFeedPost.GetRecordResponse(
+        uri=uri,
+        cid=cid,
+        value=models.get_or_create(record, strict=False),
+    )
+
+
+def post_from_stored(data: dict):
+    """
+    Materialize one entry of a stored corpus (e.g. initial-stored-posts/*.json or a JSONL corpus).
+
+    Entries carry uri, cid and text, and optionally the full raw "record" with
+    facets and embeds; the record is used as-is when present.
+    """
+    record = data.get("record") or {"text": data["text"]}
+    return record_to_post(data["uri"], data.get("cid", ""), record)
+
+
+def load_stored_posts(path: str) -> List:
+    """Materialize every post of a stored corpus, a JSON array or a JSONL file"""
+    return [post_from_stored(data) for data in iter_stored(path)]
@@ -0,0 +1,80 @@
+"""Lazily created ATProto client that reuses its session across runs"""
+
+import os
+import threading
+from typing import TYPE_CHECKING, Optional
+
+from dotenv import load_dotenv
+
+from .fileio import atomic_write
+
+if TYPE_CHECKING:
+    from atproto import Client
+
+load_dotenv(override=True)
+USERNAME = os.getenv("USERNAME")
+PW = os.getenv("PW")
+#Exported session string, reused instead of calling createSession on every launch
+SESSION_PATH = os.getenv("SESSION_PATH", ".session")
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def load_session_string(path: str = SESSION_PATH) -> Optional[str]:
+    """Read a saved session string, if any"""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read().strip() or None
+
+
+def save_session_string(session_string: str, path: str = SESSION_PATH):
+    """Save a session string readable only by the current user"""
+    if not path:
+        return
+    #atomic_write creates the file 0600, and processes saving at once (e.g. sharded workers)
+    #never replace each other's half-written file
+    with atomic_write(path, 'w', encoding='utf-8') as f:
+        f.write(session_string)
+
+
+def login(username: str = USERNAME, password: str = PW, session_path: str = SESSION_PATH) -> "Client":
+    """
+    Create a logged-in client, resuming the saved session when possible.
+
+    The session string is saved again whenever the client creates or refreshes
+    its session, so the next process can pick it up.
+    """
+    from atproto import Client
+
+    from .transport import atproto_request
+
+    def new_client():
+        #XRPC calls share the pooled transport, which also records their latency and sizes
+        return Client(request=atproto_request())
+
+    session_string = load_session_string(session_path)
+    client = new_client()
+    if session_string:
+        try:
+            client.login(session_string=session_string)
+        except Exception as e:
+            print(f"Saved session could not be resumed ({e}); logging in again")
+            client = new_client()
+            session_string = None
+    if not session_string:
+        client.login(username, password)
+
+    save_session_string(client.export_session_string(), session_path)
+    client.on_session_change(lambda _event, _session: save_session_string(client.export_session_string(), session_path))
+    return client
+
+
+def get_client() -> "Client":
+    """Shared logged-in client, created on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = login()
+        return _client
@@ -0,0 +1,180 @@
+"""Sharded batch moderation: split a URL list across worker processes, each with its own labeler"""
+
+import importlib
+import multiprocessing
+import os
+import queue
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from .batch import BatchResult, moderate_urls
+from .metrics import latency_summary, stage_metrics
+
+#Labeler names accepted by the runner -> "module:attribute" of the labeler class
+LABELERS = {
+    "pylabel": "pylabel.automated_labeler:AutomatedLabeler",
+    "giveaway": "giveaway_labeler.policy_proposal_labeler:AutomatedLabeler",
+}
+#"module:attribute" of the function every worker calls for its client
+DEFAULT_CLIENT_FACTORY = "pylabel.session:get_client"
+
+
+def load_attribute(spec: str):
+    """The object named by "module:attribute" """
+    module, _, attribute = spec.partition(":")
+    return getattr(importlib.import_module(module), attribute)
+
+
+def shard(items: Sequence, shards: int) -> List[List[int]]:
+    """Round-robin split of item positions, so every shard gets a similar mix of the input"""
+    return [list(range(start, len(items), shards)) for start in range(shards)]
+
+
+@dataclass
+class WorkerStats:
+    """What one worker process reported when its shard was done"""
+
+    worker: int
+    posts: int = 0
+    startup: float = 0.0  # seconds to log in and build the labeler
+    elapsed: float = 0.0  # seconds moderating the shard
+    metrics: dict = field(default_factory=dict)
+
+
+def _run_shard(worker: int, labeler: str, labeler_inputs_dir: str, urls: List[str], positions: List[int],
+               concurrency: int, client_factory: str, results):
+    """
+    Worker process: log in, build a labeler and moderate one shard, sending
+    every result to the parent as soon as it is done
+    """
+    start = time.perf_counter()
+    client = load_attribute(client_factory)()
+    instance = load_attribute(LABELERS.get(labeler, labeler))(client, labeler_inputs_dir)
+    ready = time.perf_counter()
+
+    def send(result: BatchResult):
+        error = None if result.error is None else f"{type(result.error).__name__}: {result.error}"
+        results.put(("result", positions[result.index], result.labels, error, result.elapsed))
+
+    moderate_urls(instance, urls, concurrency, send)
+    done = time.perf_counter()
+    results.put(("done", WorkerStats(worker, len(urls), ready - start, done - ready, stage_metrics.snapshot())))
+
+
+class ShardedRun:
+    """
+    Moderate urls in `workers` processes with up to `concurrency` posts in
+    flight in each.
+
+    Every worker has its own client session (resumed from the saved session
+    file, so workers don't each log in from scratch), its own labeler and
+    caches, and its own GIL, so image hashing and matching scale with cores.
+    Results stream back as they finish; iterating the run yields them in input
+    order, each as soon as every earlier one has arrived. The per-worker stats
+    are in `workers_stats` once iteration ends.
+    """
+
+    def __init__(self, labeler: str, labeler_inputs_dir: str, urls: Sequence[str], workers: Optional[int] = None,
+                 concurrency: int = 8, client_factory: str = DEFAULT_CLIENT_FACTORY):
+        self.labeler = labeler
+        self.labeler_inputs_dir = labeler_inputs_dir
+        self.urls = list(urls)
+        self.workers = max(1, min(workers or os.cpu_count() or 1, len(self.urls) or 1))
+        self.concurrency = concurrency
+        self.client_factory = client_factory
+        self.workers_stats: List[WorkerStats] = []
+        self.elapsed = 0.0
+
+    def __iter__(self) -> Iterator[BatchResult]:
+        #spawn, not fork: the parent's client, connection pool and threads must not leak into the workers
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        processes = []
+        start = time.perf_counter()
+        for worker, positions in enumerate(shard(self.urls, self.workers)):
+            process = context.Process(
+                target=_run_shard,
+                args=(worker, self.labeler, self.labeler_inputs_dir, [self.urls[i] for i in positions], positions,
+                      self.concurrency, self.client_factory, results),
+                daemon=True,
+            )
+            process.start()
+            processes.append(process)
+
+        pending: Dict[int, BatchResult] = {}
+        next_index = 0
+        finished = set()
+        try:
+            while len(finished) < len(processes):
+                try:
+                    message = results.get(timeout=1.0)
+                except queue.Empty:
+                    crashed = [worker for worker, process in enumerate(processes)
+                               if worker not in finished and process.exitcode not in (None, 0)]
+                    if crashed:
+                        raise RuntimeError(f"Worker process {crashed[0]} exited with code {processes[crashed[0]].exitcode}")
+                    continue
+                if message[0] == "done":
+                    finished.add(message[1].worker)
+                    self.workers_stats.append(message[1])
+                    continue
+                _kind, index, labels, error, elapsed = message
+                pending[index] = BatchResult(index, self.urls[index], labels,
+                                             None if error is None else RuntimeError(error), elapsed)
+                while next_index in pending:
+                    yield pending.pop(next_index)
+                    next_index += 1
+        finally:
+            for process in processes:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+            self.elapsed = time.perf_counter() - start
+        self.workers_stats.sort(key=lambda stats: stats.worker)
+
+    def stats(self, results: Sequence[BatchResult] = ()) -> dict:
+        """Throughput, per-worker timing and merged stage/call metrics of a finished run"""
+        posts = sum(stats.posts for stats in self.workers_stats)
+        busy = sum(stats.elapsed for stats in self.workers_stats)
+        stages, calls, errors = Counter(), Counter(), Counter()
+        stage_seconds = Counter()
+        for stats in self.workers_stats:
+            for name, histogram in stats.metrics.get("stages", {}).items():
+                stages[name] += histogram["count"]
+                stage_seconds[name] += histogram["sum"]
+            for endpoint, call in stats.metrics.get("calls", {}).items():
+                calls[endpoint] += call["count"]
+            errors.update(stats.metrics.get("errors", {}))
+        return {
+            "workers": self.workers,
+            "posts": posts,
+            "elapsed": self.elapsed,
+            "posts_per_second": posts / self.elapsed if self.elapsed else 0.0,
+            #Share of the workers' wall time spent moderating rather than starting up or idle
+            "utilization": busy / (self.workers * self.elapsed) if self.elapsed else 0.0,
+            "startup": max((stats.startup for stats in self.workers_stats), default=0.0),
+            "post_latency": latency_summary([result.elapsed for result in results]),
+            "stages": {name: {"count": count, "mean": stage_seconds[name] / count} for name, count in stages.items()},
+            "calls": dict(calls),
+            "errors": dict(errors),
+            "per_worker": [
+                {"worker": stats.worker, "posts": stats.posts, "startup": stats.startup, "elapsed": stats.elapsed,
+                 "posts_per_second": stats.posts / stats.elapsed if stats.elapsed else 0.0}
+                for stats in self.workers_stats
+            ],
+        }
+
+
+def scaling_efficiency(runs: Dict[int, float]) -> Dict[int, dict]:
+    """Speedup and efficiency (speedup / workers) of each worker count's throughput over one worker's"""
+    baseline = runs.get(1)
+    return {
+        workers: {
+            "posts_per_second": throughput,
+            "speedup": throughput / baseline if baseline else 0.0,
+            "efficiency": throughput / (baseline * workers) if baseline else 0.0,
+        }
+        for workers, throughput in sorted(runs.items())
+    }
@@ -0,0 +1,353 @@
+"""Streaming ingestion: label posts as they are created instead of from a CSV"""
+
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterator, List, Optional
+
+from dateutil import parser as date_parser
+from atproto import CAR, FirehoseSubscribeReposClient, firehose_models, models, parse_subscribe_repos_message
+
+from .cache import TTLCache, post_cache
+from .record import POST_COLLECTION, at_uri, record_to_post
+
+# A stream event is a plain dict:
+#   {"seq": int, "repo": did, "rkey": str, "cid": str, "record": {...}, "time": iso-8601}
+# where "record" is the raw app.bsky.feed.post record as it appears in the repo.
+
+#Seconds before the first retry of an event that failed to label; doubled for each later retry
+RETRY_DELAY = 0.5
+
+
+def event_post_url(event: dict) -> str:
+    """bsky.app URL of the post carried by a stream event"""
+    return f"https://bsky.app/profile/{event['repo']}/post/{event['rkey']}"
+
+
+def event_at_uri(event: dict) -> str:
+    """AT-URI of the post carried by a stream event"""
+    return at_uri(event['repo'], event['rkey'])
+
+
+def event_to_post(event: dict):
+    """Materialize a stream event into the same shape client.get_post() returns"""
+    return record_to_post(event_at_uri(event), event["cid"], event["record"])
+
+
+class Checkpoint:
+    """
+    Cursor checkpoint for a stream.
+
+    Events finish out of order when several workers run, so the saved cursor is
+    the highest sequence number up to which every dispatched event completed.
+    All the posts of one firehose commit share its seq, so the cursor only moves
+    past a seq once each of them is done (labeled, or dead-lettered after its
+    retries ran out). Resuming may reprocess a few events but never skips one.
+    """
+
+    def __init__(self, path: Optional[str] = None, every: int = 100):
+        self.path = path
+        self.every = every
+        self._lock = threading.Lock()
+        self._dispatched = deque()  # distinct seqs in dispatch order
+        self._outstanding: Dict[int, int] = {}  # seq -> events dispatched but not completed
+        self._since_save = 0
+        self.cursor = self.load()
+
+    def load(self) -> Optional[int]:
+        """Read the saved cursor, if any"""
+        if not self.path or not os.path.exists(self.path):
+            return None
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f).get("cursor")
+
+    def save(self):
+        """Atomically write the current cursor"""
+        if not self.path or self.cursor is None:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"cursor": self.cursor, "saved_at": time.time()}, f)
+        os.replace(tmp_path, self.path)
+
+    def dispatched(self, seq: int):
+        """Record that an event was handed to a worker"""
+        with self._lock:
+            if seq not in self._outstanding:
+                self._dispatched.append(seq)
+                self._outstanding[seq] = 0
+            self._outstanding[seq] += 1
+
+    def completed(self, seq: int):
+        """Record that an event finished and advance the cursor if possible"""
+        with self._lock:
+            self._outstanding[seq] -= 1
+            while self._dispatched and not self._outstanding[self._dispatched[0]]:
+                self.cursor = self._dispatched.popleft()
+                del self._outstanding[self.cursor]
+                self._since_save += 1
+            if self._since_save >= self.every:
+                self._since_save = 0
+                self.save()
+
+
+class ReplaySource:
+    """Replay stream events from a JSONL file, optionally throttled to `rate` events per second"""
+
+    def __init__(self, path: str, rate: Optional[float] = None):
+        self.path = path
+        self.rate = rate
+
+    def events(self, cursor: Optional[int] = None) -> Iterator[dict]:
+        """Yield events with seq greater than cursor"""
+        start = time.perf_counter()
+        emitted = 0
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if cursor is not None and event["seq"] <= cursor:
+                    continue
+                if self.rate:
+                    delay = start + emitted / self.rate - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                emitted += 1
+                yield event
+
+    def stop(self):
+        """Nothing to tear down for a file"""
+
+
+class FirehoseSource:
+    """Post-creation events from the network firehose (com.atproto.sync.subscribeRepos)"""
+
+    def __init__(self, base_uri: Optional[str] = None, queue_size: int = 1000):
+        self.base_uri = base_uri
+        self.queue_size = queue_size
+        self._client = None
+
+    def events(self, cursor: Optional[int] = None) -> Iterator[dict]:
+        """Yield new-post events, starting after cursor when one is given"""
+        params = models.ComAtprotoSyncSubscribeRepos.Params(cursor=cursor) if cursor else None
+        kwargs = {"base_uri": self.base_uri} if self.base_uri else {}
+        self._client = FirehoseSubscribeReposClient(params, **kwargs)
+        buffer = queue.Queue(maxsize=self.queue_size)
+        done = object()
+
+        def on_message(message: firehose_models.MessageFrame):
+            commit = parse_subscribe_repos_message(message)
+            if not isinstance(commit, models.ComAtprotoSyncSubscribeRepos.Commit) or not commit.blocks:
+                return
+            car = CAR.from_bytes(commit.blocks)
+            for op in commit.ops:
+                if op.action != "create" or not op.path.startswith(POST_COLLECTION + "/"):
+                    continue
+                record = car.blocks.get(op.cid)
+                if record is None:
+                    continue
+                #Blocking put: a slow consumer stalls the websocket instead of buffering unboundedly
+                buffer.put({
+                    "seq": commit.seq,
+                    "repo": commit.repo,
+                    "rkey": op.path.split("/", 1)[1],
+                    "cid": str(op.cid),
+                    "record": record,
+                    "time": commit.time,
+                })
+
+        def run():
+            try:
+                self._client.start(on_message)
+            except Exception as e:
+                #Re-raised by the consumer, so StreamLabeler reconnects from its checkpoint
+                buffer.put(e)
+            finally:
+                buffer.put(done)
+
+        threading.Thread(target=run, name="firehose", daemon=True).start()
+        while True:
+            event = buffer.get()
+            if event is done:
+                return
+            if isinstance(event, Exception):
+                raise event
+            yield event
+
+    def update_cursor(self, cursor: int):
+        """Make the client's automatic reconnects resume from cursor"""
+        if self._client is not None and cursor is not None:
+            self._client.update_params(models.ComAtprotoSyncSubscribeRepos.Params(cursor=cursor))
+
+    def stop(self):
+        """Close the websocket"""
+        if self._client is not None:
+            self._client.stop()
+
+
+class StreamLabeler:
+    """
+    Run stream events through a labeler without re-fetching the posts.
+
+    Each event's record is handed straight to the labeler's moderate_record()
+    (and kept in the post cache under its AT-URI). Events flow through a bounded
+    queue to a pool of workers; when the workers fall behind, the queue fills
+    up and the source blocks (backpressure). Progress is checkpointed as a
+    cursor, and if the source drops (e.g. the firehose disconnects a consumer
+    that lagged too far), it is reopened from the last checkpoint.
+
+    An event whose labeling fails is retried up to `retries` more times with
+    backoff. After that it is counted, logged and appended to the
+    dead_letter_path JSONL file (when given) for a later replay, and the cursor
+    moves past it, so one post that always fails cannot hold the stream back.
+    """
+
+    def __init__(
+        self,
+        labeler,
+        source,
+        workers: int = 4,
+        queue_size: int = 1000,
+        checkpoint: Optional[Checkpoint] = None,
+        on_labels: Optional[Callable[[dict, List[str]], None]] = None,
+        cache: TTLCache = None,
+        max_reconnects: int = 5,
+        retries: int = 2,
+        dead_letter_path: Optional[str] = None,
+    ):
+        self.labeler = labeler
+        self.source = source
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.checkpoint = checkpoint or Checkpoint()
+        self.on_labels = on_labels
+        self.post_cache = getattr(labeler, "post_cache", post_cache) if cache is None else cache
+        self.max_reconnects = max_reconnects
+        self.retries = retries
+        self.dead_letter_path = dead_letter_path
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.processed = 0
+        self.labeled = 0
+        self.errors = 0
+        self.dead_letters = 0
+        self.reconnects = 0
+        self.lag = 0.0  # seconds between an event's creation and its processing
+        self.started_at = None
+
+    def handle(self, event: dict) -> List[str]:
+        """Label a single event"""
+        post = event_to_post(event)
+        #Keep the record in the post cache too, for label emission and URL-based lookups
+        self.post_cache.set(event_at_uri(event), post)
+        return self.labeler.moderate_record(post)
+
+    def _worker(self):
+        while True:
+            event = self.queue.get()
+            if event is None:
+                return
+            try:
+                for attempt in range(self.retries + 1):
+                    try:
+                        labels = self.handle(event)
+                        if labels and self.on_labels is not None:
+                            self.on_labels(event, labels)
+                        with self._lock:
+                            self.processed += 1
+                            self.labeled += bool(labels)
+                            self.lag = _event_lag(event)
+                        break
+                    except Exception as e:
+                        with self._lock:
+                            self.errors += 1
+                        if attempt < self.retries and not self._stopping.is_set():
+                            print(f"Error labeling {event_post_url(event)}: {e}; retrying")
+                            time.sleep(RETRY_DELAY * 2 ** attempt)
+                            continue
+                        print(f"Giving up on {event_post_url(event)} after {attempt + 1} attempts: {e}")
+                        self._dead_letter(event, e)
+            finally:
+                self.checkpoint.completed(event["seq"])
+
+    def _dead_letter(self, event: dict, error: Exception):
+        """Count an event that could not be labeled and keep it for a later replay"""
+        with self._lock:
+            self.dead_letters += 1
+            if self.dead_letter_path:
+                with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+                    #The event itself plus its error, so the file can be fed back to ReplaySource;
+                    #firehose records can hold CIDs and bytes, which are written as strings
+                    f.write(json.dumps({**event, "error": f"{type(error).__name__}: {error}"}, default=str) + "\n")
+
+    def _produce(self, limit: Optional[int]):
+        """Feed the queue from the source, reopening it from the checkpoint when it fails"""
+        delay = 1.0
+        dispatched = 0
+        while not self._stopping.is_set():
+            try:
+                for event in self.source.events(self.checkpoint.cursor):
+                    self.checkpoint.dispatched(event["seq"])
+                    self.queue.put(event)
+                    dispatched += 1
+                    delay = 1.0
+                    if dispatched % self.checkpoint.every == 0 and hasattr(self.source, "update_cursor"):
+                        self.source.update_cursor(self.checkpoint.cursor)
+                    if self._stopping.is_set() or (limit and dispatched >= limit):
+                        return
+                return
+            except Exception as e:
+                if self.reconnects >= self.max_reconnects:
+                    raise
+                self.reconnects += 1
+                print(f"Stream source failed ({e}); resuming from cursor {self.checkpoint.cursor} in {delay:.0f}s")
+                time.sleep(delay)
+                delay = min(delay * 2, 60.0)
+
+    def run(self, limit: Optional[int] = None):
+        """Consume the source until it ends, `limit` events were read, or stop() is called"""
+        self.started_at = time.perf_counter()
+        threads = [threading.Thread(target=self._worker, name=f"labeler-{i}", daemon=True) for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            self._produce(limit)
+        finally:
+            for _ in threads:
+                self.queue.put(None)
+            for thread in threads:
+                thread.join()
+            self.source.stop()
+            self.checkpoint.save()
+
+    def stop(self):
+        """Ask run() to finish after the events already queued"""
+        self._stopping.set()
+        self.source.stop()
+
+    def stats(self) -> dict:
+        """Throughput and lag counters"""
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0.0
+        return {
+            "processed": self.processed,
+            "labeled": self.labeled,
+            "errors": self.errors,
+            "dead_letters": self.dead_letters,
+            "reconnects": self.reconnects,
+            "queue_depth": self.queue.qsize(),
+            "cursor": self.checkpoint.cursor,
+            "lag_seconds": self.lag,
+            "posts_per_second": self.processed / elapsed if elapsed else 0.0,
+        }
+
+
+def _event_lag(event: dict) -> float:
+    """Seconds since the event was emitted, or 0 if it carries no usable timestamp"""
+    try:
+        return max(0.0, time.time() - date_parser.parse(event["time"]).timestamp())
+    except (KeyError, TypeError, ValueError, OverflowError):
+        return 0.0
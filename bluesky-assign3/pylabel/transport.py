@@ -0,0 +1,229 @@
+"""Shared HTTP transport: pooled keep-alive connections, timeouts, retries and per-request metrics"""
+
+import os
+import random
+import threading
+import time
+from contextlib import nullcontext
+from typing import TYPE_CHECKING, Optional
+from urllib.parse import urlsplit
+
+from .metrics import StageMetrics, stage_metrics, xrpc_endpoint
+from .ratelimit import RateLimitScheduler, endpoint_class, parse_rate_limit, rate_limits
+
+#httpx (and atproto) are imported on first use, so importing pylabel stays fast
+if TYPE_CHECKING:
+    import httpx
+
+#Set HTTP2=1 to negotiate HTTP/2 where the server supports it (needs the h2 package)
+HTTP2 = os.getenv("HTTP2", "").lower() in ("1", "true", "yes")
+#Seconds to connect and to wait for each read, for calls that don't pass their own timeout
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 10.0
+#Statuses worth another try: throttling and transient server errors
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+#Methods that are safe to send twice; other calls must opt in with retry=True
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+
+def http2_available() -> bool:
+    """True if the h2 package httpx needs for HTTP/2 is installed"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def is_xrpc(url) -> bool:
+    """True for ATProto XRPC calls"""
+    return "/xrpc/" in urlsplit(str(url)).path
+
+
+def endpoint_name(url) -> str:
+    """Metrics name for a request: the XRPC method for ATProto calls, else the host"""
+    parts = urlsplit(str(url))
+    if "/xrpc/" in parts.path:
+        return xrpc_endpoint(parts.path)
+    return parts.hostname or "unknown"
+
+
+def retry_after(response: "httpx.Response") -> Optional[float]:
+    """Seconds the server asked us to wait (Retry-After, or the reset of a used-up quota), if any"""
+    info = parse_rate_limit(response.headers)
+    if info["retry_after"] is not None:
+        return max(0.0, info["retry_after"])
+    if info["remaining"] == 0:
+        return info["reset_in"]
+    return None
+
+
+class Transport:
+    """
+    One pooled HTTP client for every outbound call.
+
+    Connections are kept alive and reused per host, so repeated calls to the
+    CDN, the AppView or Safe Browsing skip the TCP and TLS handshakes. Every
+    request gets a timeout and waits for its endpoint class's rate limits in
+    the scheduler, idempotent requests (or ones sent with retry=True) are
+    retried on connection errors and on RETRY_STATUSES with jittered
+    exponential backoff, and each attempt's latency and body sizes are
+    recorded in the metrics under its endpoint name.
+    """
+
+    def __init__(
+        self,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        max_connections: int = 100,
+        max_keepalive: int = 20,
+        retries: int = 2,
+        backoff: float = 0.25,
+        max_backoff: float = 5.0,
+        http2: bool = HTTP2,
+        metrics: StageMetrics = stage_metrics,
+        scheduler: Optional[RateLimitScheduler] = rate_limits,
+    ):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        if http2 and not http2_available():
+            print("HTTP/2 requested but the h2 package is not installed; using HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        self.metrics = metrics
+        self.scheduler = scheduler
+        self._client = None
+        self._lock = threading.Lock()
+        self.requests_sent = 0
+        self.retried = 0
+
+    @property
+    def client(self) -> "httpx.Client":
+        """The pooled httpx client, created on first use"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import httpx
+                    self._client = httpx.Client(
+                        http2=self.http2,
+                        timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                        limits=httpx.Limits(
+                            max_connections=self.max_connections, max_keepalive_connections=self.max_keepalive
+                        ),
+                        follow_redirects=True,
+                    )
+        return self._client
+
+    def request(self, method: str, url, endpoint: str = None, retry: bool = None, **kwargs) -> "httpx.Response":
+        """
+        Send a request and return its response (check it with raise_for_status()).
+        Extra keyword arguments go to httpx.Client.request (params, json, content, headers, timeout, ...).
+        """
+        import httpx
+
+        method = method.upper()
+        endpoint = endpoint or endpoint_name(url)
+        retries = self.retries if (method in IDEMPOTENT_METHODS if retry is None else retry) else 0
+        limit_class = endpoint_class(endpoint, is_xrpc(url))
+        for attempt in range(retries + 1):
+            with self._slot(limit_class) as limiter:
+                start = time.perf_counter()
+                try:
+                    response = self.client.request(method, url, **kwargs)
+                except httpx.TransportError:
+                    self.metrics.record_call(endpoint, time.perf_counter() - start, error=True)
+                    if attempt == retries:
+                        raise
+                    delay = None
+                else:
+                    failed = response.status_code >= 400
+                    self.metrics.record_call(endpoint, time.perf_counter() - start, error=failed)
+                    self.metrics.add_bytes(endpoint, sent=len(response.request.content), received=len(response.content))
+                    if limiter is not None:
+                        limiter.observe(response.status_code, response.headers)
+                    if response.status_code not in RETRY_STATUSES or attempt == retries:
+                        return response
+                    delay = retry_after(response)
+                    if delay is not None and delay > self.max_backoff:
+                        #Not worth holding a post for; let the caller see the error
+                        return response
+                    if limiter is not None and response.status_code == 429:
+                        #The limiter now holds back the whole class until the server's pause is over
+                        delay = 0.0
+                finally:
+                    with self._lock:
+                        self.requests_sent += 1
+            with self._lock:
+                self.retried += 1
+            self.metrics.count_error("http_retry")
+            if delay is None:
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.5)
+            time.sleep(delay)
+
+    def _slot(self, limit_class: str):
+        """Rate-limit slot for one attempt (a no-op without a scheduler)"""
+        if self.scheduler is None:
+            return nullcontext()
+        return self.scheduler.slot(limit_class)
+
+    def get(self, url, **kwargs) -> "httpx.Response":
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs) -> "httpx.Response":
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        """Close every pooled connection"""
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+    def stats(self) -> dict:
+        """Request counters"""
+        return {"requests": self.requests_sent, "retries": self.retried, "http2": self.http2}
+
+
+_request_class = None
+
+
+def atproto_request(http: Transport = None):
+    """An atproto Request that sends through a Transport (the shared one by default): Client(request=...)"""
+    global _request_class
+    if _request_class is None:
+        from atproto_client import request as atproto_request_module
+
+        class TransportRequest(atproto_request_module.Request):
+            """atproto request handler backed by a pylabel Transport instead of its own httpx client"""
+
+            def __init__(self, http: Transport = None):
+                atproto_request_module.RequestBase.__init__(self)
+                self.transport = transport if http is None else http
+
+            def _new_instance(self):
+                return type(self)(self.transport)
+
+            def _send_request(self, method: str, url: str, **kwargs):
+                headers = self.get_headers(kwargs.pop('headers', None))
+                try:
+                    response = self.transport.request(method, url, headers=headers, **kwargs)
+                    return atproto_request_module._handle_response(response)
+                except Exception as e:
+                    atproto_request_module._handle_request_errors(e)
+                    raise
+
+            def close(self):
+                #The transport is shared; close it with transport.close()
+                pass
+
+        _request_class = TransportRequest
+    return _request_class(http)
+
+
+# Shared transport for both labelers, pylabel.label and the ATProto clients
+transport = Transport()
@@ -0,0 +1,54 @@
+"""Script for re-labeling a stored post corpus offline, without fetching the posts"""
+
+import argparse
+import json
+import time
+
+from pylabel import AutomatedLabeler
+from pylabel.record import load_stored_posts, url_from_at_uri
+
+
+def main():
+    """
+    Main function for the relabel script
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("labeler_inputs_dir", type=str)
+    parser.add_argument("posts", type=str, help="stored corpus (JSON or JSONL), e.g. initial-stored-posts/bluesky_combined_posts.json")
+    parser.add_argument("--labeler", choices=["pylabel", "giveaway"], default="pylabel")
+    parser.add_argument("--network", action="store_true", help="also run the stages that need the network (dog, safe link, bot)")
+    parser.add_argument("--near_duplicates", type=float, default=None,
+                        help="reuse text verdicts for posts at least this similar to an earlier one (e.g. 0.9)")
+    parser.add_argument("--output", type=str, default=None, help="JSONL file of {uri, url, labels}")
+    args = parser.parse_args()
+
+    client = None
+    if args.network:
+        from pylabel import get_client
+        client = get_client()
+    if args.labeler == "giveaway":
+        from giveaway_labeler.policy_proposal_labeler import AutomatedLabeler as GiveawayLabeler
+        labeler = GiveawayLabeler(client, args.labeler_inputs_dir, near_duplicates=args.near_duplicates)
+    else:
+        labeler = AutomatedLabeler(client, args.labeler_inputs_dir, near_duplicates=args.near_duplicates)
+
+    start = time.perf_counter()
+    posts = load_stored_posts(args.posts)
+    loaded = time.perf_counter()
+    results = labeler.moderate_batch(posts, network=args.network)
+    elapsed = time.perf_counter() - loaded
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            for post, labels in zip(posts, results):
+                f.write(json.dumps({"uri": post.uri, "url": url_from_at_uri(post.uri), "labels": labels}) + "\n")
+
+    labeled = sum(bool(labels) for labels in results)
+    print(f"Loaded {len(posts)} posts in {loaded - start:.2f}s")
+    print(f"Labeled {labeled} of {len(posts)} posts in {elapsed:.2f}s ({len(posts) / elapsed:.0f} posts/s)")
+    verdicts = labeler.verdicts.stats()
+    print(f"Reused text verdicts for {verdicts['exact_hits']} duplicate and {verdicts['near_hits']} near-duplicate posts")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Script for running the labeler test workloads across several worker processes"""
+
+import argparse
+import ast
+import json
+import os
+
+import pandas as pd
+
+from pylabel.sharded import DEFAULT_CLIENT_FACTORY, ShardedRun, scaling_efficiency
+
+
+def labels_match(labeler: str, labels, expected) -> bool:
+    """Same comparison as test_labeler.py (pylabel) and test_trusty_labeler.py (giveaway)"""
+    if labeler == "giveaway":
+        return set(labels) == set(expected)
+    return sorted(labels) == sorted(expected)
+
+
+def run(args, urls: pd.DataFrame, workers: int, output: str = None) -> dict:
+    """Moderate every URL with `workers` processes, streaming results to output; returns the run stats"""
+    sharded = ShardedRun(args.labeler, args.labeler_inputs_dir, urls["URL"].tolist(), workers, args.concurrency,
+                         args.client_factory)
+    results, num_correct = [], 0
+    out = open(output, 'w', encoding='utf-8') if output else None
+    try:
+        for result in sharded:
+            expected = urls["Labels"].iloc[result.index]
+            correct = labels_match(args.labeler, result.labels, expected)
+            num_correct += correct
+            results.append(result)
+            if result.error is not None:
+                print(f"For {result.url}, labeler failed: {result.error}")
+            elif not correct and args.verbose:
+                print(f"For {result.url}, labeler produced {result.labels}, expected {expected}")
+            if out is not None:
+                out.write(json.dumps({"url": result.url, "labels": result.labels, "expected": list(expected),
+                                      "correct": correct, "error": None if result.error is None else str(result.error),
+                                      "elapsed": result.elapsed}) + "\n")
+    finally:
+        if out is not None:
+            out.close()
+    stats = sharded.stats(results)
+    stats["correct"] = num_correct
+    return stats
+
+
+def print_stats(stats: dict, total: int):
+    print(f"The labeler produced {stats['correct']} correct labels assignments out of {total}")
+    print(f"Overall ratio of correct label assignments {stats['correct'] / total if total else 0.0}")
+    latency = stats["post_latency"]
+    print(f"{stats['workers']} workers: {stats['posts']} posts in {stats['elapsed']:.2f}s "
+          f"({stats['posts_per_second']:.1f} posts/s), worker startup {stats['startup']:.2f}s, "
+          f"utilization {stats['utilization']:.0%}")
+    print(f"   post latency p50 {latency['p50'] * 1000:.1f}ms  p95 {latency['p95'] * 1000:.1f}ms  "
+          f"p99 {latency['p99'] * 1000:.1f}ms")
+    for worker in stats["per_worker"]:
+        print(f"   worker {worker['worker']:>2}  {worker['posts']:>5} posts  {worker['elapsed']:7.2f}s  "
+              f"{worker['posts_per_second']:7.1f} posts/s")
+    print("   stage          count   mean ms")
+    for name, stage in sorted(stats["stages"].items()):
+        print(f"   {name:<14} {stage['count']:>5} {stage['mean'] * 1000:9.2f}")
+    if stats["errors"]:
+        print(f"   errors {stats['errors']}")
+
+
+def main():
+    """
+    Main function for the sharded test script
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("labeler_inputs_dir", type=str)
+    parser.add_argument("input_urls", type=str)
+    parser.add_argument("--labeler", choices=["pylabel", "giveaway"], default="pylabel")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes (default: one per core)")
+    parser.add_argument("--concurrency", type=int, default=8, help="posts in flight per worker")
+    parser.add_argument("--output", type=str, default=None, help="JSONL of per-post results, in input order")
+    parser.add_argument("--scaling", type=str, default=None,
+                        help="comma-separated worker counts to run in turn (e.g. 1,2,4,8) to report scaling efficiency")
+    parser.add_argument("--client_factory", type=str, default=DEFAULT_CLIENT_FACTORY, help=argparse.SUPPRESS)
+    parser.add_argument("--verbose", action="store_true", help="print every mislabeled post")
+    args = parser.parse_args()
+
+    urls = pd.read_csv(args.input_urls, converters={"Labels": ast.literal_eval})
+    total = urls.shape[0]
+
+    if not args.scaling:
+        print_stats(run(args, urls, args.workers, args.output), total)
+        return
+
+    counts = sorted({int(count) for count in args.scaling.split(",")} | {1})
+    throughput = {}
+    for workers in counts:
+        stats = run(args, urls, workers, args.output if workers == counts[-1] else None)
+        print_stats(stats, total)
+        throughput[workers] = stats["posts_per_second"]
+    print("workers   posts/s   speedup   efficiency")
+    for workers, scaling in scaling_efficiency(throughput).items():
+        print(f"{workers:>7} {scaling['posts_per_second']:9.1f} {scaling['speedup']:8.2f}x {scaling['efficiency']:11.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Script for running a labeler over a stream of newly created posts"""
+
+import argparse
+import datetime
+import json
+
+from pylabel import AutomatedLabeler, get_client
+from pylabel.corpus import iter_stored
+from pylabel.metrics import serve_metrics
+from pylabel.stream import Checkpoint, FirehoseSource, ReplaySource, StreamLabeler
+
+
+def build_replay(posts_path: str, events_path: str):
+    """Convert a stored post corpus (e.g. bluesky_combined_posts.json or .jsonl) into a JSONL event file"""
+    count = 0
+    created_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    with open(events_path, 'w', encoding='utf-8') as f:
+        for seq, post in enumerate(iter_stored(posts_path), start=1):
+            # uri looks like: "at://did:plc:…/app.bsky.feed.post/postid"
+            repo, rkey = post['uri'].split('/')[2], post['uri'].split('/')[-1]
+            event = {
+                "seq": seq,
+                "repo": repo,
+                "rkey": rkey,
+                "cid": post['cid'],
+                "record": {"$type": "app.bsky.feed.post", "text": post['text'], "createdAt": created_at},
+                "time": created_at,
+            }
+            f.write(json.dumps(event) + "\n")
+            count = seq
+    print(f"Wrote {count} events to {events_path}")
+
+
+def main():
+    """
+    Main function for the stream script
+    """
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build-replay")
+    build_parser.add_argument("posts", type=str)
+    build_parser.add_argument("events", type=str)
+
+    for name in ("replay", "firehose"):
+        run_parser = subparsers.add_parser(name)
+        run_parser.add_argument("labeler_inputs_dir", type=str)
+        if name == "replay":
+            run_parser.add_argument("events", type=str)
+            run_parser.add_argument("--rate", type=float, default=None, help="events per second (default: as fast as possible)")
+        else:
+            run_parser.add_argument("--base_uri", type=str, default=None)
+        run_parser.add_argument("--labeler", choices=["pylabel", "giveaway"], default="pylabel")
+        run_parser.add_argument("--workers", type=int, default=4)
+        run_parser.add_argument("--queue_size", type=int, default=1000)
+        run_parser.add_argument("--checkpoint", type=str, default=None)
+        run_parser.add_argument("--retries", type=int, default=2, help="retries of a post that fails to label")
+        run_parser.add_argument("--dead_letter", type=str, default=None,
+                                help="JSONL file for events that still failed after their retries")
+        run_parser.add_argument("--limit", type=int, default=None)
+        run_parser.add_argument("--budget", type=float, default=None, help="per-post latency budget in seconds")
+        run_parser.add_argument("--hash_workers", type=int, default=0, help="processes for image hashing (0: inline)")
+        run_parser.add_argument("--near_duplicates", type=float, default=None,
+                                help="reuse text verdicts for posts at least this similar to a recent one (e.g. 0.9)")
+        run_parser.add_argument("--metrics_port", type=int, default=None, help="serve Prometheus metrics on this port")
+    args = parser.parse_args()
+
+    if args.command == "build-replay":
+        build_replay(args.posts, args.events)
+        return
+
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+    client = get_client()
+    if args.labeler == "giveaway":
+        from giveaway_labeler.policy_proposal_labeler import AutomatedLabeler as GiveawayLabeler
+        labeler = GiveawayLabeler(
+            client, args.labeler_inputs_dir, budget=args.budget, near_duplicates=args.near_duplicates
+        )
+    else:
+        labeler = AutomatedLabeler(
+            client, args.labeler_inputs_dir, budget=args.budget, hash_workers=args.hash_workers,
+            near_duplicates=args.near_duplicates,
+        )
+
+    if args.command == "replay":
+        source = ReplaySource(args.events, rate=args.rate)
+    else:
+        source = FirehoseSource(base_uri=args.base_uri, queue_size=args.queue_size)
+
+    def on_labels(event, labels):
+        print(f"at://{event['repo']}/app.bsky.feed.post/{event['rkey']}: {labels}")
+
+    stream = StreamLabeler(
+        labeler,
+        source,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        checkpoint=Checkpoint(args.checkpoint),
+        on_labels=on_labels,
+        retries=args.retries,
+        dead_letter_path=args.dead_letter,
+    )
+    try:
+        stream.run(limit=args.limit)
+    except KeyboardInterrupt:
+        stream.stop()
+    stats = stream.stats()
+    print(f"Processed {stats['processed']} posts ({stats['labeled']} labeled, {stats['errors']} errors, "
+          f"{stats['dead_letters']} dead-lettered)")
+    print(f"Sustained throughput {stats['posts_per_second']:.1f} posts/s, last cursor {stats['cursor']}")
+
+
+if __name__ == "__main__":
+    main()
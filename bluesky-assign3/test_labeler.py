@@ -5,10 +5,9 @@ import json
 import os
 
 import pandas as pd
-from atproto import Client
 from dotenv import load_dotenv
 
-from pylabel import AutomatedLabeler, label_post, did_from_handle
+from pylabel import AutomatedLabeler, LabelEmitter, did_from_handle, get_client, moderate_urls
 
 load_dotenv(override=True)
 USERNAME = os.getenv("USERNAME")
@@ -18,33 +17,45 @@ def main():
     """
     Main function for the test script
     """
-    client = Client()
+    client = get_client()
     labeler_client = None
-    client.login(USERNAME, PW)
     did = did_from_handle(USERNAME)
 
     parser = argparse.ArgumentParser()
     parser.add_argument("labeler_inputs_dir", type=str)
     parser.add_argument("input_urls", type=str)
     parser.add_argument("--emit_labels", action="store_true")
+    parser.add_argument("--concurrency", type=int, default=8)
     args = parser.parse_args()
 
+    emitter = None
     if args.emit_labels:
         labeler_client = client.with_proxy("atproto_labeler", did)
+        emitter = LabelEmitter(client, labeler_client)
 
     labeler = AutomatedLabeler(client, args.labeler_inputs_dir)
 
     urls = pd.read_csv(args.input_urls)
     num_correct, total = 0, urls.shape[0]
-    for _index, row in urls.iterrows():
+
+    def emit_labels(result):
+        #Queue emission as soon as a post is moderated, reusing the strong ref it was fetched with
+        if emitter is not None and len(result.labels) > 0:
+            emitter.submit_post(result.url, result.labels, result.post_ref)
+
+    results = moderate_urls(labeler, urls["URL"].tolist(), args.concurrency, emit_labels)
+    for (_index, row), result in zip(urls.iterrows(), results):
         url, expected_labels = row["URL"], json.loads(row["Labels"])
-        labels = labeler.moderate_post(url)
+        if result.error is not None:
+            print(f"For {url}, labeler failed: {result.error}")
+        labels = result.labels
         if sorted(labels) == sorted(expected_labels):
             num_correct += 1
         else:
             print(f"For {url}, labeler produced {labels}, expected {expected_labels}")
-        if args.emit_labels and (len(labels) > 0):
-            label_post(client, labeler_client, url, labels)
+    if emitter is not None:
+        emitter.close()
+        print(f"Label emission: {emitter.stats()}")
     print(f"The labeler produced {num_correct} correct labels assignments out of {total}")
     print(f"Overall ratio of correct label assignments {num_correct/total}")
 